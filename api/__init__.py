@@ -1,30 +1,34 @@
+from api.models import Account, Advertisement
 
 
 class PetHome(object):
 
-    def __init__(self, username: str, password: str, addr: str, port: str):
+    def __init__(self, username: str, password: str, addr: str, port: str, token: str = None):
         self.addr = addr
         self.port = port
         self.protocol = 'http'
-        self.token = self.auth(username, password)
+        # a token of a restored session is reused as is
+        self.token = token if token is not None else self.auth(username, password)
         # self.url = f"{self.protocol}://{self.addr}:{self.port}"
 
     def auth(self, username: str, password: str) -> str: ...
 
-    def create_ad(self, data: dict) -> int: ...
+    def create_ad(self, ad: Advertisement) -> int: ...
 
-    def update_ad(self, data: dict, id: int) -> int: ...
+    def update_ad(self, ad: Advertisement, id: int) -> int: ...
 
     def delete_ad(self, id: int): ...
 
-    def get_own_advertisements(self, page: int) -> list: ...
+    def get_own_advertisements(self, page: int, size: int = 4) -> list: ...
 
-    def get_other_advertisements(self, page: int) -> list: ...
+    def get_other_advertisements(self, page: int, size: int = 4, cache: bool = True) -> list: ...
 
-    def get_advertisement_by(self, id: int) -> dict: ...
+    def get_advertisement_by(self, id: int, cache: bool = True) -> Advertisement: ...
 
-    def _get_advertisements(self, pov: str, page: int, size: int = 4) -> list: ...
+    def get_advertisements_by(self, ids: list, cache: bool = True) -> list: ...
 
-    def get_account(self) -> dict: ...
+    def _get_advertisements(self, pov: str, page: int, size: int = 4, cache: bool = True) -> list: ...
+
+    def get_account(self) -> Account: ...
 
     def update_account(self, data: dict) -> int: ...
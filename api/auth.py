@@ -0,0 +1,45 @@
+import base64
+import json
+import time
+
+# lifetime assumed for tokens that do not carry their expiry
+DEFAULT_TOKEN_TTL = 3600
+# refresh that long before the token expires
+REFRESH_MARGIN = 300
+
+
+class AuthExpired(Exception):
+    """The backend refuses the token and it cannot be renewed, the user has to log in again."""
+
+
+class Credentials(object):
+    """Login and password kept only to re-authenticate, never printed or serialized."""
+    __slots__ = ('username', '_password')
+
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self._password = password
+
+    @property
+    def password(self) -> str:
+        return self._password
+
+    def __repr__(self):
+        return f"Credentials(username={self.username!r}, password='***')"
+
+    def __getstate__(self):
+        raise TypeError('Credentials must not be serialized')
+
+
+def token_expires_at(token: str, default_ttl: float = DEFAULT_TOKEN_TTL) -> float:
+    """``time.time()`` based expiry of the token: the ``exp`` claim of a JWT or now + ``default_ttl``."""
+    parts = token.split('.') if token else []
+    if len(parts) == 3:
+        try:
+            payload = parts[1] + '=' * (-len(parts[1]) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+            if exp is not None:
+                return float(exp)
+        except (ValueError, AttributeError):
+            pass
+    return time.time() + default_ttl
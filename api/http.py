@@ -0,0 +1,126 @@
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from api.policy import BackendError, Policy
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+# connections open at once per backend host, further requests wait for a free one
+DEFAULT_POOL_MAXSIZE = 32
+
+_ID_IN_PATH = re.compile(r'/\d+')
+
+
+def endpoint_of(method: str, path: str) -> str:
+    """'GET /v1/advertisements/12' -> 'GET /v1/advertisements/{id}', to group calls by endpoint."""
+    return f"{method} {_ID_IN_PATH.sub('/{id}', path)}"
+
+
+def conditional_headers(response_headers) -> dict:
+    """Headers revalidating the response on the next request: If-None-Match / If-Modified-Since."""
+    headers = dict()
+    etag = response_headers.get('ETag')
+    if etag:
+        headers['If-None-Match'] = etag
+    last_modified = response_headers.get('Last-Modified')
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+class HttpPool(object):
+    """Keep-alive connection pool to one PetHome backend, shared by every logged in user."""
+
+    def __init__(self, addr: str, port: str, protocol: str = 'http',
+                 maxsize: int = DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, policy: Policy = None):
+        self.base_url = f"{protocol}://{addr}:{port}"
+        self.timeout = timeout
+        self.policy = policy if policy is not None else Policy(default_timeout=timeout)
+        self.session = requests.Session()
+        # pool_block caps the connections at maxsize, without it a burst opens extra ones
+        # that are only closed instead of kept alive
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxsize, pool_block=True)
+        self.session.mount(f"{protocol}://", adapter)
+        # observer(endpoint, status, seconds) is called after every request, status is
+        # 'error' when no response was received
+        self.observer = None
+
+    def request(self, method: str, path: str, headers: dict = None, **kwargs) -> requests.Response:
+        """Send the request under the pool policy.
+
+        Raises ``api.policy.BackendError`` when no response is received and
+        ``api.policy.BackendUnavailable`` while the circuit breaker is open.
+        """
+        policy = self.policy
+        breaker = policy.breaker
+        endpoint = endpoint_of(method, path)
+        kwargs.setdefault('timeout', policy.timeout_for(endpoint))
+        attempts = policy.retry.attempts_for(method)
+
+        for attempt in range(attempts):
+            breaker.check()
+            last = attempt + 1 == attempts
+            try:
+                resp = self._send(method, path, endpoint, headers, kwargs)
+            except requests.RequestException as e:
+                breaker.failure()
+                if last:
+                    raise BackendError(f'{method} {path} failed: {e}') from e
+            else:
+                if resp.status_code < 500:
+                    breaker.success()
+                    return resp
+                breaker.failure()
+                if last or resp.status_code not in policy.retry.statuses:
+                    return resp
+            time.sleep(policy.retry.delay(attempt))
+
+    def _send(self, method: str, path: str, endpoint: str, headers: dict, kwargs: dict) -> requests.Response:
+        if self.observer is None:
+            return self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            resp = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+            status = resp.status_code
+            return resp
+        finally:
+            self.observer(endpoint, status, time.perf_counter() - started)
+
+    def get(self, path: str, headers: dict = None, **kwargs) -> requests.Response:
+        return self.request('GET', path, headers, **kwargs)
+
+    def post(self, path: str, headers: dict = None, **kwargs) -> requests.Response:
+        return self.request('POST', path, headers, **kwargs)
+
+    def put(self, path: str, headers: dict = None, **kwargs) -> requests.Response:
+        return self.request('PUT', path, headers, **kwargs)
+
+    def delete(self, path: str, headers: dict = None, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, headers, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+
+def get_pool(addr: str, port: str, protocol: str = 'http', **kwargs) -> HttpPool:
+    """Return the process-wide pool for the backend, creating it on first use.
+
+    Options passed in ``kwargs`` only take effect for the call that creates the pool.
+    """
+    key = (protocol, addr, str(port))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = HttpPool(addr, port, protocol, **kwargs)
+            _pools[key] = pool
+        return pool
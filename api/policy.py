@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+
+# (connect, read) seconds per endpoint, see api.http.endpoint_of
+DEFAULT_ENDPOINT_TIMEOUTS = {
+    'POST /v1/users/auth': (3.05, 5),
+    'GET /v1/advertisements/{id}': (3.05, 5),
+    'GET /v1/advertisements/batch': (3.05, 10),
+    'GET /v1/advertisements': (3.05, 10),
+    'GET /v1/users': (3.05, 5),
+}
+
+
+class BackendError(Exception):
+    """The backend failed to answer: a connection error, a timeout or a 5xx response."""
+
+
+class BackendUnavailable(BackendError):
+    """The circuit breaker is open, the backend is not called until it cools down."""
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter, only idempotent GETs are retried."""
+
+    def __init__(self, attempts: int = 3, backoff: float = 0.1, max_backoff: float = 2.0,
+                 statuses: tuple = (502, 503, 504)):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def attempts_for(self, method: str) -> int:
+        return self.attempts if method == 'GET' else 1
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """Opens after ``failure_threshold`` failures in a row and fails fast for ``reset_timeout``
+    seconds. After that one trial request is let through: its success closes the breaker,
+    its failure opens it again."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.clock() - self.opened_at < self.reset_timeout or self._trial:
+                raise BackendUnavailable('PetHome backend is unavailable')
+            self._trial = True
+
+    def success(self):
+        if self.failures == 0 and self.opened_at is None:
+            return
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._trial = False
+
+
+class Policy(object):
+    """Timeouts, retries and the circuit breaker applied to every request of an ``HttpPool``."""
+
+    def __init__(self, timeouts: dict = None, default_timeout=(3.05, 10),
+                 retry: RetryPolicy = None, breaker: CircuitBreaker = None):
+        self.timeouts = dict(DEFAULT_ENDPOINT_TIMEOUTS)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.default_timeout = default_timeout
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+    def timeout_for(self, endpoint: str):
+        return self.timeouts.get(endpoint, self.default_timeout)
+
+
+def parse_timeouts(spec: str) -> dict:
+    """'GET /v1/users=2,5;POST /v1/users/auth=3,10' -> {'GET /v1/users': (2.0, 5.0), ...}"""
+    timeouts = dict()
+    for item in spec.split(';'):
+        if item.strip() == '':
+            continue
+        endpoint, values = item.rsplit('=', 1)
+        connect, read = values.split(',')
+        timeouts[endpoint.strip()] = (float(connect), float(read))
+    return timeouts
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """Calls with the same key made while one is in flight wait for it and share its outcome.
+
+    Nothing is kept once the call returns, this is not a cache: a later call runs again.
+    """
+
+    def __init__(self):
+        self._calls = dict()
+        self._lock = threading.Lock()
+        # calls served by the call of another thread
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return ``(result of fn, whether it came from another caller)``, exceptions are shared too."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight(object):
+    """``SingleFlight`` for coroutines running on one event loop."""
+
+    def __init__(self):
+        self._calls = dict()
+        # calls served by the call of another coroutine
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Return ``(result of await fn, whether it came from another caller)``, exceptions are shared too."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # a cancelled follower must not cancel the call of the others
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved here, so asyncio does not log it when no one else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
@@ -1,39 +1,250 @@
-import requests
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from api import PetHome
+from api.auth import DEFAULT_TOKEN_TTL, REFRESH_MARGIN, AuthExpired, Credentials, token_expires_at
+from api.cache import TTLCache
+from api.http import HttpPool, conditional_headers, get_pool
+from api.models import Account, Advertisement, dumps, loads
+from api.policy import BackendError
+from api.singleflight import SingleFlight
+
+# upper bound of parallel single-ad requests when the backend has no bulk endpoint
+MAX_CONCURRENT_FETCHES = 8
+
+_fetch_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES, thread_name_prefix='pethome-fetch')
+
+
+def _checked(req):
+    if req.status_code == 401:
+        raise AuthExpired('The token is refused')
+    return req
+
+
+def _raise_for_backend(req, message: str):
+    if req.status_code >= 500:
+        raise BackendError(message)
 
 
 class PetHomeImpl(PetHome):
+    # None - not probed yet, True/False - whether /v1/advertisements/batch is served by the backend
+    bulk_supported = None
+    # ad details are the same for every user, so one cache serves the whole process
+    ad_cache = TTLCache(maxsize=1024, ttl=300)
+    # id -> (conditional headers, ad): revalidates ads that expired from ad_cache without a body
+    ad_validators = TTLCache(maxsize=4096, ttl=86400)
+    # seconds the account of a user is shown without asking the backend
+    account_ttl = 60
+    token_ttl = DEFAULT_TOKEN_TTL
+    # identical GETs in flight at the same time share one backend request
+    inflight = SingleFlight()
+
+    def __init__(self, username: str, password: str, addr: str, port: str, pool: HttpPool = None,
+                 token: str = None):
+        # auth is called from the base constructor, so the pool has to be ready before it
+        self.pool = pool if pool is not None else get_pool(addr, port)
+        self.headers = dict()
+        self.token_expires_at = 0
+        # a session restored from a token has no credentials and cannot re-authenticate
+        self._credentials = Credentials(username, password) if username is not None else None
+        self._auth_lock = threading.Lock()
+        self._refreshing = False
+        # write-through cache of the account of this user
+        self._account = None
+        self._account_validators = dict()
+        self._account_checked_at = 0
+        super().__init__(username, password, addr, port, token)
+
+    @property
+    def token(self) -> str:
+        return self._token
+
+    @token.setter
+    def token(self, value: str):
+        self._token = value
+        self.token_expires_at = token_expires_at(value, self.token_ttl)
+        self.headers = {'Authorization': f"Bearer {value}"}
 
-    def __init__(self, username: str, password: str, addr: str, port: str):
-        super().__init__(username, password, addr, port)
+    def _request(self, method: str, path: str, headers: dict = None, **kwargs):
+        """Authorized request, raises ``AuthExpired`` if the backend still answers 401 after it."""
+        return _checked(self._authorized(method, path, headers, **kwargs))
+
+    def _authorized(self, method: str, path: str, headers: dict = None, **kwargs):
+        """The token is refreshed ahead of its expiry and once more on 401."""
+        body = kwargs.pop('json', None)
+        if body is not None:
+            kwargs['data'] = dumps(body)
+            headers = dict(headers or (), **{'Content-Type': 'application/json'})
+        self._refresh_ahead()
+        token = self._token
+        req = self.pool.request(method, path, headers=self._headers_with(headers), **kwargs)
+        if req.status_code == 401 and self._credentials is not None:
+            self._reauth(token)
+            req = self.pool.request(method, path, headers=self._headers_with(headers), **kwargs)
+        return req
+
+    def _headers_with(self, headers: dict) -> dict:
+        return self.headers if headers is None else dict(self.headers, **headers)
+
+    def _get(self, path: str, per_user: bool = True, headers: dict = None, **kwargs):
+        """Coalesced GET. Only calls of the same user share a ``per_user`` response, other
+        responses are shared by everyone."""
+        body = kwargs.get('json')
+        key = (path,
+               json.dumps(body, sort_keys=True, separators=(',', ':')) if body is not None else None,
+               tuple(sorted(headers.items())) if headers else None,
+               self._token if per_user else None)
+        req, shared = self.inflight.do(key, self._authorized, 'GET', path, headers, **kwargs)
+        if shared and req.status_code == 401:
+            # the token of the caller that made the request was refused, ours may not be
+            req = self._authorized('GET', path, headers, **kwargs)
+        return _checked(req)
+
+    def _refresh_ahead(self):
+        if self._credentials is None:
+            return
+
+        left = self.token_expires_at - time.time()
+        if left <= 0:
+            # nothing to gain from sending an expired token
+            self._reauth(self._token)
+        elif left < REFRESH_MARGIN and not self._refreshing:
+            self._refreshing = True
+            _fetch_executor.submit(self._background_refresh, self._token)
+
+    def _background_refresh(self, stale_token: str):
+        try:
+            self._reauth(stale_token)
+        except Exception:
+            # the next request retries, synchronously once the token expired
+            pass
+        finally:
+            self._refreshing = False
+
+    def _reauth(self, stale_token: str):
+        """Single-flight re-authentication: concurrent callers wait for one auth request."""
+        with self._auth_lock:
+            if self._token != stale_token:
+                # someone else refreshed it while we were waiting
+                return
+            self.token = self.auth(self._credentials.username, self._credentials.password)
 
     def auth(self, username: str, password: str) -> str:
         payload = {
             "username": username,
             "password": password
         }
-        req = requests.post(f"{self.protocol}://{self.addr}:{self.port}/v1/users/auth", json=payload)
+        req = self.pool.post("/v1/users/auth", json=payload)
         if req.status_code == 200:
             resp = req.json()
             return resp['token']
 
+        if req.status_code in (401, 403):
+            raise AuthExpired('Authorization is failed')
+        if req.status_code >= 500:
+            raise BackendError('Authorization is failed')
         raise Exception('Authorization is failed')
 
-    def get_own_advertisements(self, page: int) -> list:
-        return self._get_advertisements('OWNER', page)
+    def get_own_advertisements(self, page: int, size: int = 4) -> list:
+        return self._get_advertisements('OWNER', page, size)
+
+    def get_other_advertisements(self, page: int, size: int = 4, cache: bool = True) -> list:
+        return self._get_advertisements('VIEWER', page, size, cache)
 
-    def get_other_advertisements(self, page: int) -> list:
-        return self._get_advertisements('VIEWER', page)
+    def get_advertisement_by(self, id: int, cache: bool = True) -> Advertisement:
+        """None if the backend has no such ad. Cached ads are shared, do not change them.
 
-    def get_advertisement_by(self, id: int) -> dict:
-        req = requests.get(f"{self.protocol}://{self.addr}:{self.port}/v1/advertisements/{id}",
-                           headers={'Authorization': f"Bearer {self.token}"})
+        While the backend fails, an expired cached version of the ad is returned if there is one.
+        ``cache=False`` neither reads nor fills the shared caches, for bulk walks such as the
+        index refresh that would otherwise evict the ads users are looking at.
+        """
+        if not cache:
+            req = self._get(f"/v1/advertisements/{id}", per_user=False)
+            _raise_for_backend(req, 'Cannot get advertisement')
+            return Advertisement.from_dict(loads(req.content), id) if req.status_code == 200 else None
 
-        resp = req.json()
-        return resp
+        ad = self.ad_cache.get(id)
+        if ad is not None:
+            return ad
 
-    def _get_advertisements(self, pov: str, page: int, size: int = 4) -> list:
+        validated = self.ad_validators.get(id)
+        try:
+            req = self._get(f"/v1/advertisements/{id}", per_user=False,
+                            headers=validated[0] if validated is not None else None)
+            _raise_for_backend(req, 'Cannot get advertisement')
+        except BackendError:
+            # while the backend is down the ad as it was last seen is better than none
+            stale = self.ad_cache.get(id, stale=True)
+            if stale is None and validated is not None:
+                stale = validated[1]
+            if stale is None:
+                raise
+            return stale
+        if req.status_code == 304 and validated is not None:
+            self.ad_cache.set(id, validated[1])
+            return validated[1]
+
+        if req.status_code != 200:
+            return None
+        ad = Advertisement.from_dict(loads(req.content), id)
+        self.ad_cache.set(id, ad)
+        validators = conditional_headers(req.headers)
+        if len(validators) != 0:
+            self.ad_validators.set(id, (validators, ad))
+        return ad
+
+    def get_advertisements_by(self, ids: list, cache: bool = True) -> list:
+        """``cache=False`` bypasses the shared caches, see ``get_advertisement_by``."""
+        cached = dict()
+        if cache:
+            for id in ids:
+                ad = self.ad_cache.get(id)
+                if ad is not None:
+                    cached[id] = ad
+
+        missing = [id for id in ids if id not in cached]
+        if len(missing) != 0:
+            for ad in self._fetch_advertisements(missing, cache):
+                cached[ad.id] = ad
+        return [cached[id] for id in ids if id in cached]
+
+    def _fetch_advertisements(self, ids: list, cache: bool = True) -> list:
+        if PetHomeImpl.bulk_supported is not False:
+            ads = self._get_advertisements_bulk(ids)
+            if ads is not None:
+                if cache:
+                    for ad in ads:
+                        self.ad_cache.set(ad.id, ad)
+                return ads
+
+        return [ad for ad in _fetch_executor.map(lambda id: self.get_advertisement_by(id, cache), ids)
+                if ad is not None]
+
+    def _get_advertisements_bulk(self, ids: list):
+        try:
+            req = self._get("/v1/advertisements/batch", per_user=False, json={"ids": ids})
+        except BackendError:
+            # the single ads can still be served from the cache as they were last seen
+            return None
+
+        if req.status_code >= 500:
+            # may be a passing failure, the ads are fetched one by one this time
+            return None
+
+        if req.status_code != 200:
+            # backends without the endpoint answer 404/405, or 400/422 when "batch" is taken for an id
+            PetHomeImpl.bulk_supported = False
+            return None
+
+        PetHomeImpl.bulk_supported = True
+        resp = loads(req.content)
+        by_id = {ad['id']: ad for ad in resp['advertisements']}
+        # keep the order of the page, the backend is free to return ads in any order
+        return [Advertisement.from_dict(by_id[id]) for id in ids if id in by_id]
+
+    def _get_advertisements(self, pov: str, page: int, size: int = 4, cache: bool = True) -> list:
         payload = {
             "pov": pov,
             "paged": {
@@ -41,73 +252,92 @@ class PetHomeImpl(PetHome):
                 "size": size
             }
         }
-        req = requests.get(f"{self.protocol}://{self.addr}:{self.port}/v1/advertisements",
-                           json=payload,
-                           headers={'Authorization': f"Bearer {self.token}"})
+        req = self._get("/v1/advertisements", json=payload)
 
         if req.status_code != 200:
+            _raise_for_backend(req, 'Cannot get advertisements')
             raise Exception('Cannot get advertisements')
 
-        resp = req.json()
-        ids = resp['ids']
-        ads = list()
-        for id in ids:
-            ad = self.get_advertisement_by(id)
-            ad['id'] = id
-            ads.append(ad)
-        return ads
+        resp = loads(req.content)
+        return self.get_advertisements_by(resp['ids'], cache)
 
-    def create_ad(self, data: dict) -> int:
-        req = requests.post(f"{self.protocol}://{self.addr}:{self.port}/v1/advertisements",
-                            json=data,
-                            headers={'Authorization': f"Bearer {self.token}"})
+    def create_ad(self, ad: Advertisement) -> int:
+        req = self._request('POST', "/v1/advertisements", json=ad.to_dict())
 
         if req.status_code != 200:
             raise Exception('Could not create advertisement')
 
-        resp = req.json()
+        resp = loads(req.content)
+        self._forget_ad(resp['id'])
         return resp['id']
 
-    def update_ad(self, data: dict, id: int) -> int:
-        req = requests.put(f"{self.protocol}://{self.addr}:{self.port}/v1/advertisements/{id}",
-                            json=data,
-                            headers={'Authorization': f"Bearer {self.token}"})
+    def update_ad(self, ad: Advertisement, id: int) -> int:
+        req = self._request('PUT', f"/v1/advertisements/{id}", json=ad.to_dict())
+        self._forget_ad(id)
 
         if req.status_code != 200:
             raise Exception('Could not update advertisement')
 
-        resp = req.json()
+        resp = loads(req.content)
         return resp['id']
 
     def delete_ad(self, id: int):
-        requests.delete(f"{self.protocol}://{self.addr}:{self.port}/v1/advertisements/{id}",
-                        headers={'Authorization': f"Bearer {self.token}"})
+        req = self._request('DELETE', f"/v1/advertisements/{id}")
+        self._forget_ad(id)
+
+        if not 200 <= req.status_code < 300:
+            raise Exception('Could not delete advertisement')
 
-    def get_account(self) -> dict:
-        req = requests.get(f"{self.protocol}://{self.addr}:{self.port}/v1/users",
-                           headers={'Authorization': f"Bearer {self.token}"})
+    def _forget_ad(self, id: int):
+        self.ad_cache.invalidate(id)
+        self.ad_validators.invalidate(id)
+
+    def get_account(self) -> Account:
+        """Served from memory for ``account_ttl`` seconds, then revalidated with the backend.
+        While the backend fails, the account is served as it was last seen."""
+        account = self._account
+        if account is not None and time.monotonic() - self._account_checked_at < self.account_ttl:
+            return account
+
+        try:
+            req = self._get("/v1/users", headers=self._account_validators if account is not None else None)
+            _raise_for_backend(req, 'Cannot get account')
+        except BackendError:
+            if account is None:
+                raise
+            # shown as it was last seen while the backend is down
+            return account
+        if req.status_code == 304 and account is not None:
+            self._account_checked_at = time.monotonic()
+            return account
+
+        if req.status_code != 200:
+            raise Exception('Cannot get account')
 
-        resp = req.json()
-        return resp
+        self._account = Account.from_dict(loads(req.content))
+        self._account_validators = conditional_headers(req.headers)
+        self._account_checked_at = time.monotonic()
+        return self._account
 
     def create_account(self, data: dict) -> int:
-        req = requests.post(f"{self.protocol}://{self.addr}:{self.port}/v1/users",
-                            json=data,
-                            headers={'Authorization': f"Bearer {self.token}"})
+        req = self._request('POST', "/v1/users", json=data)
 
         if req.status_code != 200:
             raise Exception('Could not register user')
 
-        resp = req.json()
+        resp = loads(req.content)
         return resp['id']
 
     def update_account(self, data: dict) -> int:
-        req = requests.put(f"{self.protocol}://{self.addr}:{self.port}/v1/users",
-                           json=data,
-                           headers={'Authorization': f"Bearer {self.token}"})
+        req = self._request('PUT', "/v1/users", json=data)
 
         if req.status_code != 200:
             raise Exception('Could not update user')
 
-        resp = req.json()
+        if self._account is not None:
+            # the backend has what was sent, no need to download it again
+            self._account = self._account.updated(data)
+            self._account_validators = dict()
+            self._account_checked_at = time.monotonic()
+        resp = loads(req.content)
         return resp['id']
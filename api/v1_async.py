@@ -0,0 +1,406 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from api import PetHome
+from api.auth import REFRESH_MARGIN, AuthExpired, Credentials, token_expires_at
+from api.http import DEFAULT_POOL_MAXSIZE, DEFAULT_TIMEOUT, conditional_headers, endpoint_of
+from api.models import Account, Advertisement, dumps, loads
+from api.policy import BackendError, Policy
+from api.singleflight import AsyncSingleFlight
+from api.v1 import MAX_CONCURRENT_FETCHES, PetHomeImpl, _checked, _raise_for_backend
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class Response(object):
+    """What is kept of an aiohttp response once its body is read."""
+    __slots__ = ('status_code', 'headers', 'content')
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+class AsyncHttpPool(object):
+    """Non-blocking counterpart of ``api.http.HttpPool``, under the same ``Policy``.
+
+    The ``aiohttp.ClientSession`` is created on first use, so the pool can be built outside of
+    the event loop it is later used from. Close it with ``await pool.close()``.
+    """
+
+    def __init__(self, addr: str, port: str, protocol: str = 'http',
+                 maxsize: int = DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, policy: Policy = None,
+                 keepalive_timeout: float = 30):
+        self.base_url = f"{protocol}://{addr}:{port}"
+        self.maxsize = maxsize
+        self.keepalive_timeout = keepalive_timeout
+        self.policy = policy if policy is not None else Policy(default_timeout=timeout)
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # at most maxsize connections, further requests wait for a free one
+            connector = aiohttp.TCPConnector(limit=self.maxsize, limit_per_host=self.maxsize,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(self, method: str, path: str, headers: dict = None, data: bytes = None) -> Response:
+        """Send the request under the pool policy.
+
+        Raises ``api.policy.BackendError`` when no response is received and
+        ``api.policy.BackendUnavailable`` while the circuit breaker is open.
+        """
+        policy = self.policy
+        breaker = policy.breaker
+        connect, read = policy.timeout_for(endpoint_of(method, path))
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        attempts = policy.retry.attempts_for(method)
+
+        for attempt in range(attempts):
+            breaker.check()
+            last = attempt + 1 == attempts
+            try:
+                resp = await self._send(method, path, headers, data, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.failure()
+                if last:
+                    raise BackendError(f'{method} {path} failed: {e!r}') from e
+            else:
+                if resp.status_code < 500:
+                    breaker.success()
+                    return resp
+                breaker.failure()
+                if last or resp.status_code not in policy.retry.statuses:
+                    return resp
+            await asyncio.sleep(policy.retry.delay(attempt))
+
+    async def _send(self, method: str, path: str, headers: dict, data: bytes, timeout) -> Response:
+        async with self._get_session().request(method, self.base_url + path, headers=headers, data=data,
+                                               timeout=timeout) as resp:
+            return Response(resp.status, resp.headers, await resp.read())
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncPetHomeImpl(PetHome):
+    """asyncio implementation of the ``PetHome`` interface with the semantics of ``PetHomeImpl``.
+
+    Every method is a coroutine. The constructor cannot await, so a logged in instance is made
+    with ``await AsyncPetHomeImpl.login(...)``; a session restored from its token is constructed
+    with ``token`` and no credentials, it cannot re-authenticate.
+    """
+    # None - not probed yet, True/False - whether /v1/advertisements/batch is served by the backend
+    bulk_supported = None
+    # the ads are the same as the blocking client sees, so both share its caches
+    ad_cache = PetHomeImpl.ad_cache
+    ad_validators = PetHomeImpl.ad_validators
+    account_ttl = PetHomeImpl.account_ttl
+    token_ttl = PetHomeImpl.token_ttl
+    inflight = AsyncSingleFlight()
+
+    def __init__(self, username: str, password: str, addr: str, port: str, pool: AsyncHttpPool = None,
+                 token: str = None):
+        # the base constructor is not called, it authenticates synchronously
+        self.addr = addr
+        self.port = port
+        self.protocol = 'http'
+        self.pool = pool if pool is not None else AsyncHttpPool(addr, port)
+        self.headers = dict()
+        self.token_expires_at = 0
+        self._token = None
+        self._credentials = Credentials(username, password) if username is not None else None
+        self._auth_lock = asyncio.Lock()
+        # the background refresh in progress, referenced so it is not collected before it is done
+        self._refresh = None
+        self._account = None
+        self._account_validators = dict()
+        self._account_checked_at = 0
+        if token is not None:
+            self.token = token
+
+    @classmethod
+    async def login(cls, username: str, password: str, addr: str, port: str, pool: AsyncHttpPool = None):
+        api = cls(username, password, addr, port, pool)
+        api.token = await api.auth(username, password)
+        return api
+
+    @property
+    def token(self) -> str:
+        return self._token
+
+    @token.setter
+    def token(self, value: str):
+        self._token = value
+        self.token_expires_at = token_expires_at(value, self.token_ttl)
+        self.headers = {'Authorization': f"Bearer {value}"}
+
+    async def _request(self, method: str, path: str, headers: dict = None, json=None) -> Response:
+        """Authorized request, raises ``AuthExpired`` if the backend still answers 401 after it."""
+        return _checked(await self._authorized(method, path, headers, json))
+
+    async def _authorized(self, method: str, path: str, headers: dict = None, json=None) -> Response:
+        """The token is refreshed ahead of its expiry and once more on 401."""
+        data = None
+        if json is not None:
+            data = dumps(json)
+            headers = dict(headers or (), **_JSON_HEADERS)
+        await self._refresh_ahead()
+        token = self._token
+        req = await self.pool.request(method, path, self._headers_with(headers), data)
+        if req.status_code == 401 and self._credentials is not None:
+            await self._reauth(token)
+            req = await self.pool.request(method, path, self._headers_with(headers), data)
+        return req
+
+    def _headers_with(self, headers: dict) -> dict:
+        return self.headers if headers is None else dict(self.headers, **headers)
+
+    async def _get(self, path: str, per_user: bool = True, headers: dict = None, json=None) -> Response:
+        """Coalesced GET, see ``PetHomeImpl._get``."""
+        key = (path,
+               _canonical(json) if json is not None else None,
+               tuple(sorted(headers.items())) if headers else None,
+               self._token if per_user else None)
+        req, shared = await self.inflight.do(key, self._authorized, 'GET', path, headers, json)
+        if shared and req.status_code == 401:
+            req = await self._authorized('GET', path, headers, json)
+        return _checked(req)
+
+    async def _refresh_ahead(self):
+        if self._credentials is None:
+            return
+
+        left = self.token_expires_at - time.time()
+        if left <= 0:
+            await self._reauth(self._token)
+        elif left < REFRESH_MARGIN and self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._background_refresh(self._token))
+
+    async def _background_refresh(self, stale_token: str):
+        try:
+            await self._reauth(stale_token)
+        except Exception:
+            # the next request retries, before sending once the token expired
+            pass
+        finally:
+            self._refresh = None
+
+    async def _reauth(self, stale_token: str):
+        """Single-flight re-authentication: concurrent callers wait for one auth request."""
+        async with self._auth_lock:
+            if self._token != stale_token:
+                return
+            self.token = await self.auth(self._credentials.username, self._credentials.password)
+
+    async def auth(self, username: str, password: str) -> str:
+        payload = {
+            "username": username,
+            "password": password
+        }
+        req = await self.pool.request('POST', "/v1/users/auth", _JSON_HEADERS, dumps(payload))
+        if req.status_code == 200:
+            return loads(req.content)['token']
+
+        if req.status_code in (401, 403):
+            raise AuthExpired('Authorization is failed')
+        if req.status_code >= 500:
+            raise BackendError('Authorization is failed')
+        raise Exception('Authorization is failed')
+
+    async def get_own_advertisements(self, page: int, size: int = 4) -> list:
+        return await self._get_advertisements('OWNER', page, size)
+
+    async def get_other_advertisements(self, page: int, size: int = 4, cache: bool = True) -> list:
+        return await self._get_advertisements('VIEWER', page, size, cache)
+
+    async def get_advertisement_by(self, id: int, cache: bool = True) -> Advertisement:
+        """None if the backend has no such ad, see ``PetHomeImpl.get_advertisement_by``."""
+        if not cache:
+            req = await self._get(f"/v1/advertisements/{id}", per_user=False)
+            _raise_for_backend(req, 'Cannot get advertisement')
+            return Advertisement.from_dict(loads(req.content), id) if req.status_code == 200 else None
+
+        ad = self.ad_cache.get(id)
+        if ad is not None:
+            return ad
+
+        validated = self.ad_validators.get(id)
+        try:
+            req = await self._get(f"/v1/advertisements/{id}", per_user=False,
+                                  headers=validated[0] if validated is not None else None)
+            _raise_for_backend(req, 'Cannot get advertisement')
+        except BackendError:
+            # while the backend is down the ad as it was last seen is better than none
+            stale = self.ad_cache.get(id, stale=True)
+            if stale is None and validated is not None:
+                stale = validated[1]
+            if stale is None:
+                raise
+            return stale
+        if req.status_code == 304 and validated is not None:
+            self.ad_cache.set(id, validated[1])
+            return validated[1]
+
+        if req.status_code != 200:
+            return None
+        ad = Advertisement.from_dict(loads(req.content), id)
+        self.ad_cache.set(id, ad)
+        validators = conditional_headers(req.headers)
+        if len(validators) != 0:
+            self.ad_validators.set(id, (validators, ad))
+        return ad
+
+    async def get_advertisements_by(self, ids: list, cache: bool = True) -> list:
+        cached = dict()
+        if cache:
+            for id in ids:
+                ad = self.ad_cache.get(id)
+                if ad is not None:
+                    cached[id] = ad
+
+        missing = [id for id in ids if id not in cached]
+        if len(missing) != 0:
+            for ad in await self._fetch_advertisements(missing, cache):
+                cached[ad.id] = ad
+        return [cached[id] for id in ids if id in cached]
+
+    async def _fetch_advertisements(self, ids: list, cache: bool = True) -> list:
+        if AsyncPetHomeImpl.bulk_supported is not False:
+            ads = await self._get_advertisements_bulk(ids)
+            if ads is not None:
+                if cache:
+                    for ad in ads:
+                        self.ad_cache.set(ad.id, ad)
+                return ads
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+        async def fetch(id):
+            async with semaphore:
+                return await self.get_advertisement_by(id, cache)
+
+        return [ad for ad in await asyncio.gather(*[fetch(id) for id in ids]) if ad is not None]
+
+    async def _get_advertisements_bulk(self, ids: list):
+        try:
+            req = await self._get("/v1/advertisements/batch", per_user=False, json={"ids": ids})
+        except BackendError:
+            return None
+
+        if req.status_code >= 500:
+            return None
+
+        if req.status_code != 200:
+            AsyncPetHomeImpl.bulk_supported = False
+            return None
+
+        AsyncPetHomeImpl.bulk_supported = True
+        resp = loads(req.content)
+        by_id = {ad['id']: ad for ad in resp['advertisements']}
+        return [Advertisement.from_dict(by_id[id]) for id in ids if id in by_id]
+
+    async def _get_advertisements(self, pov: str, page: int, size: int = 4, cache: bool = True) -> list:
+        payload = {
+            "pov": pov,
+            "paged": {
+                "current": page,
+                "size": size
+            }
+        }
+        req = await self._get("/v1/advertisements", json=payload)
+
+        if req.status_code != 200:
+            _raise_for_backend(req, 'Cannot get advertisements')
+            raise Exception('Cannot get advertisements')
+
+        resp = loads(req.content)
+        return await self.get_advertisements_by(resp['ids'], cache)
+
+    async def create_ad(self, ad: Advertisement) -> int:
+        req = await self._request('POST', "/v1/advertisements", json=ad.to_dict())
+
+        if req.status_code != 200:
+            raise Exception('Could not create advertisement')
+
+        resp = loads(req.content)
+        self._forget_ad(resp['id'])
+        return resp['id']
+
+    async def update_ad(self, ad: Advertisement, id: int) -> int:
+        req = await self._request('PUT', f"/v1/advertisements/{id}", json=ad.to_dict())
+        self._forget_ad(id)
+
+        if req.status_code != 200:
+            raise Exception('Could not update advertisement')
+
+        resp = loads(req.content)
+        return resp['id']
+
+    async def delete_ad(self, id: int):
+        req = await self._request('DELETE', f"/v1/advertisements/{id}")
+        self._forget_ad(id)
+
+        if not 200 <= req.status_code < 300:
+            raise Exception('Could not delete advertisement')
+
+    def _forget_ad(self, id: int):
+        self.ad_cache.invalidate(id)
+        self.ad_validators.invalidate(id)
+
+    async def get_account(self) -> Account:
+        """Served from memory for ``account_ttl`` seconds, then revalidated with the backend."""
+        account = self._account
+        if account is not None and time.monotonic() - self._account_checked_at < self.account_ttl:
+            return account
+
+        try:
+            req = await self._get("/v1/users", headers=self._account_validators if account is not None else None)
+            _raise_for_backend(req, 'Cannot get account')
+        except BackendError:
+            if account is None:
+                raise
+            # shown as it was last seen while the backend is down
+            return account
+        if req.status_code == 304 and account is not None:
+            self._account_checked_at = time.monotonic()
+            return account
+
+        if req.status_code != 200:
+            raise Exception('Cannot get account')
+
+        self._account = Account.from_dict(loads(req.content))
+        self._account_validators = conditional_headers(req.headers)
+        self._account_checked_at = time.monotonic()
+        return self._account
+
+    async def create_account(self, data: dict) -> int:
+        req = await self._request('POST', "/v1/users", json=data)
+
+        if req.status_code != 200:
+            raise Exception('Could not register user')
+
+        return loads(req.content)['id']
+
+    async def update_account(self, data: dict) -> int:
+        req = await self._request('PUT', "/v1/users", json=data)
+
+        if req.status_code != 200:
+            raise Exception('Could not update user')
+
+        if self._account is not None:
+            self._account = self._account.updated(data)
+            self._account_validators = dict()
+            self._account_checked_at = time.monotonic()
+        return loads(req.content)['id']
+
+
+def _canonical(body) -> str:
+    return json.dumps(body, sort_keys=True, separators=(',', ':'))
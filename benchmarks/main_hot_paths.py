@@ -0,0 +1,171 @@
+"""Per-update CPU cost of the message flow in main.py, with the bot and the backend mocked out."""
+import os
+import sys
+
+os.environ.setdefault('PET_HOME_TOKEN', '123:benchmark')
+os.environ.setdefault('PET_HOME_ADDR', '127.0.0.1')
+os.environ.setdefault('PET_HOME_PORT', '1')
+
+import main  # noqa: E402
+from api.models import Account, Advertisement  # noqa: E402
+from benchmarks import runner  # noqa: E402
+from bot.pager import Pager  # noqa: E402
+
+USER_ID = 42
+CHAT_ID = 42
+MSG_ID = 1000
+
+AD = Advertisement.from_dict({
+    'id': 7,
+    'pet-name': 'Джеррі',
+    'signs': ['Сіре вушко', 'чорний носик'],
+    'age': 3,
+    'type': 'FOUND',
+    'location': {'city': 'Київ', 'district': "Солом'янський", 'street': 'Берегівська'},
+    'date': {'day': 13, 'month': 5, 'year': 2021}
+})
+ACCOUNT = Account.from_dict({
+    'firstname': 'Тарас',
+    'lastname': 'Шевченко',
+    'username': 'shevchenko_ua',
+    'phone-numbers': '0501112233, 0504445566',
+    'email-addresses': 't.shevchenko@test1.ua, tshev@test2.ua'
+})
+AD_TEXT = '''Джеррі
+Сіре вушко, чорний носик
+3
+знайшов
+Київ, Солом'янський, Берегівська
+13.05.2021'''
+ACCOUNT_TEXT = '''Ім'я: Тарас
+Фамілія: Шевченко
+Юзернейм: shevchenko_ua
+Моб. телефони: 0501112233, 0504445566
+Email адреси: t.shevchenko@test1.ua, tshev@test2.ua'''
+
+
+class Obj(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class MockOutbound(object):
+    """Encodes the markup like Outbound does, the network is not touched."""
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        if reply_markup is not None:
+            reply_markup.to_json()
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        pass
+
+    def delete_message(self, chat_id, message_id):
+        pass
+
+
+class MockApi(object):
+    token = 'token'
+
+    def create_ad(self, data):
+        return 1
+
+    def update_ad(self, data, id):
+        return id
+
+    def update_account(self, data):
+        return 1
+
+    def get_account(self):
+        return ACCOUNT
+
+    def get_own_advertisements(self, page, size=4):
+        return [Advertisement(i, AD.pet_name, AD.signs, AD.age, AD.type, AD.location, AD.date)
+                for i in range(size)] if page == 1 else []
+
+    get_other_advertisements = get_own_advertisements
+
+
+def _message(text):
+    message = Obj(text=text, from_user={'id': USER_ID}, chat_id=CHAT_ID, message_id=MSG_ID + 1)
+    return Obj(message=message, callback_query=None, effective_user=Obj(id=USER_ID))
+
+
+def _callback(data):
+    query = Obj(data=data, from_user={'id': USER_ID}, message=Obj(chat=Obj(id=CHAT_ID)),
+                answer=lambda text=None: True)
+    return Obj(callback_query=query, message=None, effective_user=Obj(id=USER_ID))
+
+
+def _user(action):
+    u = main.users.get(USER_ID)
+    if u is None:
+        u = main.User(MSG_ID)
+        u.api = MockApi()
+        main.users[USER_ID] = u
+    u.current_action = action
+    return u
+
+
+def _with_pager(u):
+    pager = Pager(u.api.get_own_advertisements)
+    pager.current()
+    u.cache['paged'] = pager
+    return u
+
+
+context = Obj(bot=None, dispatcher=None)
+main.outbound = MockOutbound()
+
+
+def msg_create_ad():
+    _user(main.Action.CREATE_AD)
+    main.msg_handler(_message(AD_TEXT), context)
+
+
+def msg_edit_ad():
+    _with_pager(_user(main.Action.EDIT_AD))
+    main.msg_handler(_message(AD_TEXT), context)
+
+
+def msg_update_account():
+    _user(main.Action.UPDATE_ACCOUNT)
+    main.msg_handler(_message(ACCOUNT_TEXT), context)
+
+
+_display_update = _callback(main.Action.GET_LIST_OF_ADVERTISEMENTS.value)
+
+
+def display_ad():
+    u = _with_pager(_user(main.Action.GET_LIST_OF_ADVERTISEMENTS))
+    main._display_other_ad(_display_update, context, u)
+
+
+def display_main_page():
+    _user(main.Action.MAIN)
+    main._display_main_page(context, USER_ID, CHAT_ID)
+
+
+_route_updates = [_callback(d) for d in (main.Action.VIEW_AD.value,
+                                          main.Action.CREATE_AD.value,
+                                          main.Action.UPDATE_ACCOUNT.value,
+                                          main.Action.MAIN.value)]
+
+
+def route_callback_queries():
+    _user(main.Action.MAIN)
+    for update in _route_updates:
+        main.call_query_handler(update, context)
+
+
+CASES = {
+    'msg_handler.CREATE_AD': msg_create_ad,
+    'msg_handler.EDIT_AD': msg_edit_ad,
+    'msg_handler.UPDATE_ACCOUNT': msg_update_account,
+    '_display_ad': display_ad,
+    '_display_main_page': display_main_page,
+    'call_query_handler x4': route_callback_queries,
+}
+
+if __name__ == '__main__':
+    sys.exit(runner.main('main_hot_paths', CASES))
@@ -0,0 +1,65 @@
+"""Incremental matching on a 100k ad corpus: indexing one ad and finding its matches."""
+import itertools
+import random
+import sys
+
+from api.models import Advertisement
+from benchmarks import runner
+from bot.matching import MatchingIndex
+
+CORPUS_SIZE = 100000
+
+_CITIES = ['Київ', 'Львів', 'Одеса', 'Харків', 'Дніпро', 'Вінниця', 'Полтава', 'Чернігів']
+_DISTRICTS = ['Центральний', 'Північний', 'Південний', 'Східний', 'Західний']
+_SIGNS = ['сіре вушко', 'чорний носик', 'білий хвіст', 'рудий', 'без нашийника', 'кульгає',
+          'плямистий', 'довга шерсть', 'короткий хвіст', 'синій нашийник', 'великий', 'маленький',
+          'біла лапка', 'чорна пляма на спині', 'зелені очі', 'жовті очі', 'пухнастий']
+_TYPES = ['LOST', 'FOUND', 'OBSERVED']
+
+_rnd = random.Random(20)
+_ids = itertools.count(1)
+
+
+def _ad() -> Advertisement:
+    return Advertisement.from_dict({
+        'id': next(_ids),
+        'pet-name': 'Рекс',
+        'signs': _rnd.sample(_SIGNS, _rnd.randint(1, 4)),
+        'age': _rnd.randint(1, 15),
+        'type': _rnd.choice(_TYPES),
+        'location': {'city': _rnd.choice(_CITIES), 'district': _rnd.choice(_DISTRICTS), 'street': 'Шевченка'},
+        'date': {'day': _rnd.randint(1, 28), 'month': _rnd.randint(1, 12), 'year': _rnd.randint(2019, 2021)}
+    })
+
+
+index = MatchingIndex()
+index.add_many(_ad() for _ in range(CORPUS_SIZE))
+_probes = [_ad() for _ in range(100)]
+_probe = itertools.cycle(_probes)
+
+
+def add_and_remove():
+    ad = next(_probe)
+    index.add(ad)
+    index.remove(ad.id)
+
+
+def match():
+    index.matches(next(_probe))
+
+
+def create_flow():
+    ad = next(_probe)
+    index.add(ad)
+    index.matches(ad)
+    index.remove(ad.id)
+
+
+CASES = {
+    'add+remove (100k)': add_and_remove,
+    'matches (100k)': match,
+    'add+matches (100k)': create_flow,
+}
+
+if __name__ == '__main__':
+    sys.exit(runner.main('matching', CASES))
@@ -0,0 +1,138 @@
+"""bot.parsing against the split-based parsers msg_handler used before, on large message corpora."""
+import random
+import sys
+
+from benchmarks import runner
+from bot.parsing import AdType, parse_account, parse_ad
+
+CORPUS_SIZE = 10000
+
+_NAMES = ['Джеррі', 'Барсик', 'Рекс', 'Мурка', 'Бублик', 'Лорд', 'Сніжок']
+_SIGNS = ['Сіре вушко', 'чорний носик', 'білий хвіст', 'рудий', 'без нашийника', 'кульгає']
+_PLACES = [("Київ", "Солом'янський", "Берегівська"), ("Львів", "Франківський", "Наукова"),
+           ("Одеса", "Приморський", "Дерибасівська")]
+
+
+def _ad_message(rnd: random.Random) -> str:
+    city, district, street = rnd.choice(_PLACES)
+    return '\n'.join([
+        rnd.choice(_NAMES),
+        ', '.join(rnd.sample(_SIGNS, rnd.randint(1, 4))),
+        str(rnd.randint(1, 15)),
+        rnd.choice([t.value for t in AdType]),
+        f'{city}, {district}, {street} {rnd.randint(1, 200)}',
+        f'{rnd.randint(1, 28)}.{rnd.randint(1, 12):02}.{rnd.randint(2015, 2021)}',
+    ])
+
+
+def _account_message(rnd: random.Random) -> str:
+    n = rnd.randint(100, 999)
+    return '\n'.join([
+        f"Ім'я: {rnd.choice(_NAMES)}",
+        "Фамілія: Шевченко",
+        f"Юзернейм: user_{n}",
+        f"Моб. телефони: 0501112{n}, 0504445{n}",
+        f"Email адреси: user{n}@test1.ua, u{n}@test2.ua",
+    ])
+
+
+def _broken_ad(rnd: random.Random) -> str:
+    lines = _ad_message(rnd).split('\n')
+    lines[rnd.choice([2, 3, 5])] = 'щось не те'
+    return '\n'.join(lines)
+
+
+_rnd = random.Random(17)
+AD_CORPUS = [_ad_message(_rnd) for _ in range(CORPUS_SIZE)]
+BROKEN_AD_CORPUS = [_broken_ad(_rnd) for _ in range(CORPUS_SIZE)]
+ACCOUNT_CORPUS = [_account_message(_rnd) for _ in range(CORPUS_SIZE)]
+
+
+def _legacy_ad_type(ua_name: str):
+    ua_name = ua_name.strip().lower()
+    for t in AdType:
+        if t.value == ua_name:
+            return t
+
+    raise Exception('Could not map from UA name to type')
+
+
+def legacy_parse_ad(account_data: str) -> dict:
+    lines = account_data.split('\n')
+    pet_name = lines[0].strip()
+    signs = [x.strip() for x in lines[1].split(',')]
+    age = int(lines[2])
+    ad_type = _legacy_ad_type(lines[3]).name
+    split_location = lines[4].split(',')
+    location = {
+        "city": split_location[0].strip(),
+        "district": split_location[1].strip(),
+        "street": split_location[2].strip()
+    }
+    d_data = lines[5].split('.')
+    d = {
+        'day': int(d_data[0]),
+        'month': int(d_data[1]),
+        'year': int(d_data[2])
+    }
+    return {
+        "pet-name": pet_name,
+        "signs": signs,
+        "age": age,
+        "type": ad_type,
+        "location": location,
+        "date": d
+    }
+
+
+def legacy_parse_account(account_data: str) -> dict:
+    lines = account_data.split('\n')
+    data = dict()
+    for line in lines:
+        spl = line.split(':')
+        key = spl[0].strip().lower()
+        value = spl[1].strip()
+        data[key] = value
+
+    new_data = dict()
+    for key in data.keys():
+        if key == "ім'я":
+            new_data['firstname'] = data[key]
+        if key == "фамілія":
+            new_data['lastname'] = data[key]
+        if key == "юзернейм":
+            new_data['username'] = data[key]
+        if key == "моб. телефони":
+            new_data['phone-numbers'] = data[key]
+        if key == "email адреси":
+            new_data['email-addresses'] = data[key]
+    return new_data
+
+
+def _run(parse, corpus):
+    def case():
+        for text in corpus:
+            try:
+                parse(text)
+            except Exception:
+                pass
+    return case
+
+
+# both parsers must agree on well-formed messages before their speed is compared
+for _text in AD_CORPUS:
+    assert parse_ad(_text) == legacy_parse_ad(_text), _text
+for _text in ACCOUNT_CORPUS:
+    assert parse_account(_text) == legacy_parse_account(_text), _text
+
+CASES = {
+    'ad.legacy': _run(legacy_parse_ad, AD_CORPUS),
+    'ad.table': _run(parse_ad, AD_CORPUS),
+    'ad.broken.legacy': _run(legacy_parse_ad, BROKEN_AD_CORPUS),
+    'ad.broken.table': _run(parse_ad, BROKEN_AD_CORPUS),
+    'account.legacy': _run(legacy_parse_account, ACCOUNT_CORPUS),
+    'account.table': _run(parse_account, ACCOUNT_CORPUS),
+}
+
+if __name__ == '__main__':
+    sys.exit(runner.main('parsing', CASES))
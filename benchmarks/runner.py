@@ -0,0 +1,99 @@
+"""Runs benchmark cases, keeps named baselines and flags regressions against them.
+
+A benchmark module exposes ``CASES``: a dict of case name -> zero argument callable.
+
+    python -m benchmarks.main_hot_paths --save baseline
+    python -m benchmarks.main_hot_paths --compare baseline --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def measure(fn, repeat: int = 5, min_time: float = 0.2) -> float:
+    """Best time of one call in nanoseconds."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def _baseline_path(suite: str, name: str) -> str:
+    return os.path.join(BASELINES_DIR, f'{suite}.{name}.json')
+
+
+def save(suite: str, name: str, results: dict):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    data = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }
+    with open(_baseline_path(suite, name), 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load(suite: str, name: str):
+    path = _baseline_path(suite, name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(suite: str, cases: dict, argv=None) -> int:
+    parser = argparse.ArgumentParser(prog=f'python -m benchmarks.{suite}')
+    parser.add_argument('cases', nargs='*', help='run only these cases')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='NAME', help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare with a stored baseline')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    baseline = load(suite, args.compare) if args.compare else None
+    if args.compare and baseline is None:
+        print(f'No baseline "{args.compare}" for {suite}', file=sys.stderr)
+        return 2
+
+    results = dict()
+    regressions = list()
+    for name, fn in cases.items():
+        if args.cases and name not in args.cases:
+            continue
+        ns = measure(fn, args.repeat)
+        results[name] = ns
+        line = f'{name:40} {ns / 1000:12.2f} us'
+        if baseline is not None and name in baseline['results']:
+            before = baseline['results'][name]
+            change = ns / before - 1
+            line += f'   {change:+7.1%} vs {baseline["commit"]}'
+            if change > args.threshold:
+                line += '   REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        save(suite, args.save, results)
+        print(f'Saved baseline "{args.save}"')
+
+    if len(regressions) != 0:
+        print(f'{len(regressions)} regression(s): {", ".join(regressions)}', file=sys.stderr)
+        return 1
+    return 0
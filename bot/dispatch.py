@@ -0,0 +1,73 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedExecutor(object):
+    """Runs tasks on a bounded pool of worker threads.
+
+    Tasks submitted with the same key run one at a time in the order of submission, tasks of
+    different keys run in parallel. When ``max_pending`` tasks are waiting, ``submit`` blocks
+    until one of them is done.
+    """
+
+    def __init__(self, workers: int = 16, max_pending: int = 1000, name: str = 'keyed-worker'):
+        # key -> tasks not run yet, a key is present while it has a task queued or running
+        self._tasks = dict()
+        self._ready = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, name=f'{name}-{i}', daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, key, fn, *args):
+        self._slots.acquire()
+        with self._lock:
+            tasks = self._tasks.get(key)
+            if tasks is None:
+                self._tasks[key] = deque([(fn, args)])
+                self._ready.put(key)
+            else:
+                tasks.append((fn, args))
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(tasks) for tasks in self._tasks.values())
+
+    def shutdown(self, timeout: float = 10):
+        """Let the queued tasks finish, for at most ``timeout`` seconds, and stop the workers."""
+        deadline = time.monotonic() + timeout
+        while self.pending() != 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for _ in self._threads:
+            self._ready.put(None)
+        for t in self._threads:
+            t.join(max(deadline - time.monotonic(), 0))
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+
+            with self._lock:
+                fn, args = self._tasks[key].popleft()
+
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception('Task of %s failed', key)
+            finally:
+                self._slots.release()
+                with self._lock:
+                    if len(self._tasks[key]) == 0:
+                        del self._tasks[key]
+                    else:
+                        # one task at a time per key, other keys get their turn in between
+                        self._ready.put(key)
@@ -0,0 +1,171 @@
+"""In-memory index of advertisements, to filter them without paging through the backend.
+
+Ads are kept by id with inverted indexes on type, city and (city, district) and a list of
+ids sorted by date, so a query only touches the ads that can match.
+"""
+import bisect
+import datetime
+import logging
+import threading
+
+from api.models import Advertisement
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value) -> str:
+    return str(value).strip().lower()
+
+
+def date_key(ad: Advertisement) -> int:
+    return ad.date.ordinal()
+
+
+class AdIndex(object):
+    """Subclasses add indexes by extending ``INDEXES`` and ``_postings``."""
+    INDEXES = ('type', 'city', 'district')
+
+    def __init__(self):
+        self._ads = dict()
+        # index name -> key -> set of ids
+        self._indexes = {name: dict() for name in self.INDEXES}
+        # normalized city / (city, district) -> name as the last indexed ad spells it
+        self._names = dict()
+        # (date ordinal, id) in ascending order
+        self._dates = list()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._ads)
+
+    def _postings(self, ad: Advertisement):
+        """(index name, key) pairs the ad is listed under."""
+        city = normalize(ad.location.city)
+        yield 'type', ad.type
+        yield 'city', city
+        yield 'district', (city, normalize(ad.location.district))
+
+    def __contains__(self, id):
+        return id in self._ads
+
+    def get(self, id):
+        return self._ads.get(id)
+
+    def add(self, ad: Advertisement):
+        """Index the ad or replace the indexed version of it."""
+        with self._lock:
+            id = ad.id
+            old = self._ads.get(id)
+            if old is not None:
+                if old == ad:
+                    return
+                self._remove(id)
+            self._ads[id] = ad
+            for name, key in self._postings(ad):
+                self._indexes[name].setdefault(key, set()).add(id)
+            city = str(ad.location.city).strip()
+            district = str(ad.location.district).strip()
+            self._names[city.lower()] = city
+            self._names[(city.lower(), district.lower())] = district
+            bisect.insort(self._dates, (date_key(ad), id))
+
+    def add_many(self, ads):
+        with self._lock:
+            for ad in ads:
+                self.add(ad)
+
+    def remove(self, id):
+        with self._lock:
+            if id in self._ads:
+                self._remove(id)
+
+    def retain(self, ids) -> int:
+        """Drop the ads not in ``ids``, return how many were dropped."""
+        with self._lock:
+            gone = [id for id in self._ads if id not in ids]
+            for id in gone:
+                self._remove(id)
+            return len(gone)
+
+    def _remove(self, id):
+        ad = self._ads.pop(id)
+        for name, key in self._postings(ad):
+            ids = self._indexes[name].get(key)
+            if ids is not None:
+                ids.discard(id)
+                if len(ids) == 0:
+                    del self._indexes[name][key]
+        entry = (date_key(ad), id)
+        i = bisect.bisect_left(self._dates, entry)
+        if i < len(self._dates) and self._dates[i] == entry:
+            del self._dates[i]
+
+    def query(self, type: str = None, city: str = None, district: str = None,
+              since: datetime.date = None, until: datetime.date = None) -> list:
+        """Ads matching every given criterion, newest first."""
+        with self._lock:
+            candidates = None
+            if type is not None:
+                candidates = self._indexes['type'].get(type, set())
+            if city is not None:
+                city = normalize(city)
+                key = (city, normalize(district)) if district is not None else city
+                ids = self._indexes['district' if district is not None else 'city'].get(key, set())
+                candidates = ids if candidates is None else candidates & ids
+
+            lo = bisect.bisect_left(self._dates, (since.toordinal(),)) if since is not None else 0
+            hi = bisect.bisect_left(self._dates, (until.toordinal() + 1,)) if until is not None \
+                else len(self._dates)
+
+            if candidates is None:
+                return [self._ads[id] for _, id in reversed(self._dates[lo:hi])]
+            if len(candidates) < hi - lo:
+                # fewer matches than dates in range: sort the matches instead of scanning the range
+                first = since.toordinal() if since is not None else 0
+                last = until.toordinal() if until is not None else datetime.date.max.toordinal()
+                found = [(date_key(self._ads[id]), id) for id in candidates]
+                found = [entry for entry in found if first <= entry[0] <= last]
+                found.sort(reverse=True)
+                return [self._ads[id] for _, id in found]
+            return [self._ads[id] for _, id in reversed(self._dates[lo:hi]) if id in candidates]
+
+    def cities(self, type: str = None, limit: int = None) -> list:
+        """``[(city, number of ads)]``, the most common first."""
+        return self._facet('city', lambda key: True, type, limit)
+
+    def districts(self, city: str, type: str = None, limit: int = None) -> list:
+        city = normalize(city)
+        return self._facet('district', lambda key: key[0] == city, type, limit)
+
+    def _facet(self, name: str, match, type: str, limit: int) -> list:
+        with self._lock:
+            of_type = self._indexes['type'].get(type, set()) if type is not None else None
+            counts = list()
+            for key, ids in self._indexes[name].items():
+                if not match(key):
+                    continue
+                n = len(ids) if of_type is None else len(ids & of_type)
+                if n != 0:
+                    counts.append((self._names.get(key, key), n))
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return counts[:limit] if limit is not None else counts
+
+
+def refresh(index: AdIndex, fetch, page_size: int = 50) -> int:
+    """Walk every page of ``fetch(page, size)`` into the index and drop the ads that are gone.
+
+    Returns the number of indexed ads.
+    """
+    seen = set()
+    page = 1
+    while True:
+        ads = fetch(page, page_size)
+        if len(ads) == 0:
+            break
+        index.add_many(ads)
+        seen.update(ad.id for ad in ads)
+        page += 1
+    dropped = index.retain(seen)
+    if dropped != 0:
+        logger.info('Dropped %s ads from the index', dropped)
+    return len(seen)
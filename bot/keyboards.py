@@ -0,0 +1,73 @@
+"""Inline keyboards built once and shared by every user.
+
+Telegram objects are rebuilt and re-encoded on every ``editMessageText`` otherwise. A
+``FrozenMarkup`` keeps its rows in tuples and encodes itself to JSON only once, so the same
+instance can be handed to any number of concurrent edits.
+"""
+import threading
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+class FrozenMarkup(InlineKeyboardMarkup):
+    """Immutable ``InlineKeyboardMarkup`` with a cached ``to_json``."""
+    # PTB warns about attributes that end up in the instance __dict__, a slot does not
+    __slots__ = ('_json',)
+
+    def __init__(self, rows):
+        super().__init__(tuple(tuple(row) for row in rows))
+        self._json = None
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = super().to_json()
+        return self._json
+
+
+def button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text, callback_data=callback_data)
+
+
+class Keyboards(object):
+    """Named keyboards: static ones built at registration, parameterised ones built on first use.
+
+    ``factory(name)`` registers ``fn(*params) -> rows``. The markups it produces are kept per
+    ``params`` in an LRU of ``max_variants`` entries, e.g. one per page indicator shown.
+    """
+
+    def __init__(self, max_variants: int = 256):
+        self.max_variants = max_variants
+        self._static = dict()
+        self._factories = dict()
+        self._variants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, rows) -> FrozenMarkup:
+        markup = FrozenMarkup(rows)
+        self._static[name] = markup
+        return markup
+
+    def factory(self, name: str):
+        def decorator(fn):
+            self._factories[name] = fn
+            return fn
+        return decorator
+
+    def __getitem__(self, name: str) -> FrozenMarkup:
+        return self._static[name]
+
+    def get(self, name: str, *params) -> FrozenMarkup:
+        key = (name,) + params
+        with self._lock:
+            markup = self._variants.get(key)
+            if markup is not None:
+                self._variants.move_to_end(key)
+                return markup
+
+        markup = FrozenMarkup(self._factories[name](*params))
+        with self._lock:
+            self._variants[key] = markup
+            if len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+        return markup
@@ -0,0 +1,138 @@
+"""Matching of lost pets with found or observed ones.
+
+Candidates are only looked up inside a block of the same city and the opposite ad type,
+through an inverted index of the tokens of their signs, so an ad is compared with a handful
+of ads that share words with it instead of the whole corpus.
+"""
+import heapq
+import re
+from collections import Counter
+
+from api.models import Advertisement
+from bot.index import AdIndex, date_key, normalize
+
+# ad type -> types of the ads that can be about the same pet
+COUNTERPARTS = {
+    'LOST': ('FOUND', 'OBSERVED'),
+    'FOUND': ('LOST',),
+    'OBSERVED': ('LOST',),
+}
+
+_WORD = re.compile(r'\w+')
+# words are cut to this many letters, so "чорний", "чорна" and "чорного" are one token
+STEM_LENGTH = 4
+MIN_TOKEN_LENGTH = 3
+
+
+def sign_tokens(ad: Advertisement) -> frozenset:
+    return frozenset(word[:STEM_LENGTH] for sign in ad.signs for word in _WORD.findall(sign.lower())
+                     if len(word) >= MIN_TOKEN_LENGTH)
+
+
+class MatchingIndex(AdIndex):
+    """``AdIndex`` that also finds likely matches of an ad and knows the chats owning ads.
+
+    score = 0.5 * Jaccard similarity of the sign tokens + 0.3 * date proximity within
+    ``max_days`` + 0.2 if the district is the same.
+    """
+    INDEXES = AdIndex.INDEXES + ('sign',)
+
+    def __init__(self, threshold: float = 0.4, max_days: int = 60, max_postings: int = 5000,
+                 max_candidates: int = 200):
+        super().__init__()
+        self.threshold = threshold
+        self.max_days = max_days
+        # tokens listed in more ads of a block than this say nothing about the pet
+        self.max_postings = max_postings
+        self.max_candidates = max_candidates
+        # the two are kept over edits of the ad, they are dropped once the ad leaves the index
+        # ad id -> chat to notify about its matches
+        self._owners = dict()
+        # ad id -> ids of the ads it was reported to match, both ways
+        self._notified = dict()
+
+    def _postings(self, ad: Advertisement):
+        yield from super()._postings(ad)
+        block = (ad.type, normalize(ad.location.city))
+        for token in sign_tokens(ad):
+            yield 'sign', block + (token,)
+
+    def remove(self, id):
+        with self._lock:
+            super().remove(id)
+            self._forget(id)
+
+    def retain(self, ids) -> int:
+        with self._lock:
+            dropped = super().retain(ids)
+            for id in [id for id in self._owners if id not in self._ads]:
+                self._forget(id)
+            for id in [id for id in self._notified if id not in self._ads]:
+                self._forget(id)
+            return dropped
+
+    def _forget(self, id):
+        self._owners.pop(id, None)
+        for other in self._notified.pop(id, ()):
+            reported = self._notified.get(other)
+            if reported is not None:
+                reported.discard(id)
+
+    def new_matches(self, id, matches: list) -> list:
+        """The ``matches`` of the ad not reported before, they are recorded as reported now."""
+        with self._lock:
+            reported = self._notified.setdefault(id, set())
+            found = [(score, other) for score, other in matches if other.id not in reported]
+            for _, other in found:
+                reported.add(other.id)
+                self._notified.setdefault(other.id, set()).add(id)
+            return found
+
+    def set_owner(self, id, chat_id: int):
+        with self._lock:
+            if id in self._ads:
+                self._owners[id] = chat_id
+
+    def owner(self, id):
+        return self._owners.get(id)
+
+    def matches(self, ad: Advertisement, limit: int = 5, owner: int = None) -> list:
+        """``[(score, ad)]`` of the indexed ads likely about the same pet, the best first.
+
+        Ads known to belong to ``owner`` are left out, nobody needs their own ads matched.
+        """
+        tokens = sign_tokens(ad)
+        if len(tokens) == 0:
+            return []
+        city = normalize(ad.location.city)
+        district = normalize(ad.location.district)
+        day = date_key(ad)
+
+        shared = Counter()
+        with self._lock:
+            signs = self._indexes['sign']
+            for other_type in COUNTERPARTS.get(ad.type, ()):
+                for token in tokens:
+                    ids = signs.get((other_type, city, token))
+                    if ids is not None and len(ids) <= self.max_postings:
+                        shared.update(ids)
+            shared.pop(ad.id, None)
+            if owner is not None:
+                for id in [id for id in shared if self._owners.get(id) == owner]:
+                    del shared[id]
+            candidates = [(id, n, self._ads[id])
+                          for id, n in heapq.nlargest(self.max_candidates, shared.items(), key=lambda item: item[1])]
+
+        found = list()
+        for id, n, other in candidates:
+            days = abs(date_key(other) - day)
+            if days > self.max_days:
+                continue
+            other_tokens = sign_tokens(other)
+            score = 0.5 * n / (len(tokens) + len(other_tokens) - n) + 0.3 * (1 - days / self.max_days)
+            if normalize(other.location.district) == district:
+                score += 0.2
+            if score >= self.threshold:
+                found.append((score, other))
+        found.sort(key=lambda item: item[0], reverse=True)
+        return found[:limit]
@@ -0,0 +1,168 @@
+"""Minimal Prometheus-style metrics: counters, gauges and histograms served as text over HTTP."""
+import bisect
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if len(names) == 0:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            return [f'{self.name}{_labels(self.labels, k)} {v}' for k, v in self._values.items()]
+
+
+class Gauge(object):
+    """Value read from ``fn`` at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def collect(self) -> list:
+        return [f'{self.name} {self.fn()}']
+
+
+class CounterFunc(Gauge):
+    """Monotonic value kept elsewhere, e.g. the hit counter of a cache, read at scrape time."""
+    kind = 'counter'
+
+
+class _NoopTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_noop_timer = _NoopTimer()
+
+
+class _Timer(object):
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        return False
+
+
+class Histogram(object):
+    """Distribution of durations. With ``sample_rate`` < 1 only that share of ``time`` calls is measured."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 sample_rate: float = 1.0):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.sample_rate = sample_rate
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def time(self, *label_values):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return _noop_timer
+        return _Timer(self, label_values)
+
+    def observe(self, value: float, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = [0] * (len(self.buckets) + 2)
+                self._values[label_values] = data
+            data[i] += 1
+            data[-1] += value
+
+    def collect(self) -> list:
+        lines = list()
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        names = self.labels + ('le',)
+        for label_values, data in items:
+            total = 0
+            for le, count in zip(self.buckets + ('+Inf',), data[:-1]):
+                total += count
+                lines.append(f'{self.name}_bucket{_labels(names, label_values + (le,))} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {data[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {total}')
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = list()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        lines = list()
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+def start_http_server(registry: Registry, port: int, addr: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve ``registry`` on ``http://addr:port/metrics`` from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            data = registry.exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,242 @@
+import logging
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one per second in a chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+# threads calling Telegram, every call waits a round trip
+SENDERS = 8
+# how many messages remember their latest render
+RENDERED_SIZE = 10000
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if it is available now."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Outbound(object):
+    """Rate limited queue of new messages, message edits and deletions sent to Telegram.
+
+    A pending edit of a message is replaced by a newer edit of the same message, so only the
+    latest render is sent. An edit with the same text and keyboard as the latest render queued,
+    in flight or sent to the message is dropped. ``senders`` threads make the calls, one call per
+    chat at a time, so the operations of a chat are sent in the order they were queued.
+    A chat under flood control is put aside until Telegram lets it send again.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST, senders: int = SENDERS):
+        self.bot = None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.senders = senders
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = dict()
+        # (kind, chat_id, message_id) -> kwargs of the call, in the order of queueing
+        self._pending = OrderedDict()
+        # (chat_id, message_id) -> (text, markup) of the latest edit queued, in flight or sent
+        self._rendered = OrderedDict()
+        # chats with a call in flight
+        self._busy = set()
+        # chat_id -> monotonic time before which flood control forbids sending to the chat
+        self._not_before = dict()
+        # new messages are never coalesced, each gets its own key
+        self._sends = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._workers = list()
+
+    def start(self, bot):
+        self.bot = bot
+        self._running = True
+        self._workers = [threading.Thread(target=self._run, name=f'telegram-outbound-{i}', daemon=True)
+                         for i in range(self.senders)]
+        for t in self._workers:
+            t.start()
+
+    def stop(self, timeout: float = 5):
+        """Send what is queued, for at most ``timeout`` seconds, and stop the workers."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (len(self._pending) != 0 or len(self._busy) != 0) and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            if len(self._pending) != 0:
+                logger.warning('Dropped %s Telegram calls not sent in time', len(self._pending))
+                self._pending.clear()
+            self._running = False
+            self._cond.notify_all()
+        for t in self._workers:
+            t.join(max(deadline - time.monotonic(), 0))
+
+    def qsize(self) -> int:
+        return len(self._pending)
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str, reply_markup=None):
+        markup = reply_markup.to_json() if reply_markup is not None else None
+        key = ('edit', chat_id, message_id)
+        with self._cond:
+            if self._rendered.get((chat_id, message_id)) == (text, markup):
+                # already queued, being sent or shown, whatever the edits in between were
+                return
+            self._pending[key] = dict(chat_id=chat_id, message_id=message_id, text=text,
+                                      reply_markup=reply_markup, _markup=markup)
+            self._render(chat_id, message_id, (text, markup))
+            self._cond.notify()
+
+    def send_message(self, chat_id: int, text: str, reply_markup=None):
+        with self._cond:
+            self._pending[('send', chat_id, next(self._sends))] = dict(chat_id=chat_id, text=text,
+                                                                      reply_markup=reply_markup)
+            self._cond.notify()
+
+    def delete_message(self, chat_id: int, message_id: int):
+        with self._cond:
+            # editing a message that is going to be deleted is pointless
+            self._pending.pop(('edit', chat_id, message_id), None)
+            self._rendered.pop((chat_id, message_id), None)
+            self._pending[('delete', chat_id, message_id)] = dict(chat_id=chat_id, message_id=message_id)
+            self._cond.notify()
+
+    def _next(self):
+        """Pop the first operation that can be sent now or return the seconds to wait, None to
+        wait for a call in flight."""
+        now = time.monotonic()
+        wait = self._global.wait_time(now)
+        if wait > 0:
+            return None, wait
+
+        wait = None
+        blocked = set(self._busy)
+        for key in self._pending:
+            chat_id = key[1]
+            if chat_id in blocked:
+                continue
+
+            not_before = self._not_before.get(chat_id)
+            if not_before is not None:
+                if not_before > now:
+                    blocked.add(chat_id)
+                    wait = not_before - now if wait is None else min(wait, not_before - now)
+                    continue
+                del self._not_before[chat_id]
+
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chats[chat_id] = bucket
+
+            chat_wait = bucket.wait_time(now)
+            if chat_wait > 0:
+                blocked.add(chat_id)
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+
+            bucket.take()
+            self._global.take()
+            self._busy.add(chat_id)
+            return (key, self._pending.pop(key)), 0
+
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    op = None
+                    if len(self._pending) != 0:
+                        op, wait = self._next()
+                    if op is not None:
+                        break
+                    self._cond.wait(wait if len(self._pending) != 0 else None)
+                # wakes up stop() waiting for the queue to drain
+                self._cond.notify_all()
+
+            try:
+                self._send(*op)
+            finally:
+                with self._cond:
+                    self._busy.discard(op[0][1])
+                    # the next operation of the chat can go
+                    self._cond.notify_all()
+            self._forget_idle_chats()
+
+    def _send(self, key, kwargs):
+        kind, chat_id, message_id = key
+        markup = kwargs.pop('_markup', None)
+        try:
+            if kind == 'edit':
+                self.bot.edit_message_text(**kwargs)
+            elif kind == 'send':
+                self.bot.send_message(**kwargs)
+            else:
+                self.bot.delete_message(**kwargs)
+        except RetryAfter as e:
+            logger.warning('Flood control in chat %s, retrying in %s seconds', chat_id, e.retry_after)
+            with self._cond:
+                self._not_before[chat_id] = time.monotonic() + e.retry_after
+                if kind == 'edit':
+                    kwargs['_markup'] = markup
+                # a newer edit queued meanwhile wins, either way the chat resumes with it
+                self._pending.setdefault(key, kwargs)
+                self._pending.move_to_end(key, last=False)
+        except BadRequest as e:
+            if kind == 'edit' and 'not modified' in str(e).lower():
+                return
+            logger.warning('Could not %s message %s in chat %s: %s', kind, message_id, chat_id, e)
+            self._failed(key, kwargs, markup)
+        except Exception as e:
+            logger.warning('Could not %s message %s in chat %s: %s', kind, message_id, chat_id, e)
+            self._failed(key, kwargs, markup)
+
+    def _failed(self, key, kwargs, markup):
+        """The message does not show a failed edit, the same render has to be sent again."""
+        kind, chat_id, message_id = key
+        if kind != 'edit':
+            return
+        with self._cond:
+            if self._rendered.get((chat_id, message_id)) == (kwargs['text'], markup):
+                del self._rendered[(chat_id, message_id)]
+
+    def _render(self, chat_id: int, message_id: int, render):
+        key = (chat_id, message_id)
+        self._rendered[key] = render
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > RENDERED_SIZE:
+            self._rendered.popitem(last=False)
+
+    def _forget_idle_chats(self):
+        # a full bucket is the same as a new one, so there is no need to keep it
+        if len(self._chats) <= RENDERED_SIZE:
+            return
+        with self._cond:
+            now = time.monotonic()
+            for chat_id in [c for c, b in self._chats.items() if now - b.updated_at > b.capacity / b.rate]:
+                del self._chats[chat_id]
+            for chat_id in [c for c, t in self._not_before.items() if t <= now]:
+                del self._not_before[chat_id]
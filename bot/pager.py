@@ -0,0 +1,250 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+PAGE_SIZE = 4
+# how many pages after the current one are loaded in the background
+PREFETCH_DEPTH = 1
+# the read-ahead starts once the user reaches this ad of the page, counting from 0; most users
+# look at the first ads of a list and leave, so opening a list only loads its first page
+PREFETCH_AT = 2
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='pager-prefetch')
+
+
+class Pager(object):
+    """Read-ahead window over a paged list of advertisements.
+
+    ``fetch(page, size)`` returns the ads of a page. The pager keeps the current page, the one
+    before it for "<" and loads up to ``depth`` pages after it in the background once the user
+    reaches ad ``prefetch_at`` of the current page, so turning a page is normally served from
+    memory.
+
+    Writes of the user are applied to the loaded pages with ``remove``, ``insert`` and
+    ``patch``, the way the backend applies them to its list, instead of loading them again.
+    """
+
+    def __init__(self, fetch, size: int = PAGE_SIZE, depth: int = PREFETCH_DEPTH,
+                 page: int = 1, current_ad: int = 0, prefetch_at: int = PREFETCH_AT):
+        self.fetch = fetch
+        self.size = size
+        self.depth = depth
+        self.prefetch_at = prefetch_at
+        self.page = page
+        self.current_ad = current_ad
+        self._pages = dict()
+        # loaded pages that lent their first ads to the pages before them, their tail is missing
+        self._short = set()
+        self._lock = threading.Lock()
+
+    @property
+    def ads(self) -> list:
+        return self._get(self.page)
+
+    def current(self):
+        if self.current_ad >= len(self.ads):
+            self._backfill()
+        ads = self.ads
+        while len(ads) == 0 and self.page > 1:
+            # the list got shorter than the page the user was on
+            self.page -= 1
+            ads = self.ads
+            self.current_ad = max(len(ads) - 1, 0)
+        if len(ads) == 0:
+            return None
+        self.current_ad = min(self.current_ad, len(ads) - 1)
+        return ads[self.current_ad]
+
+    def next(self) -> bool:
+        if self.current_ad + 1 >= len(self.ads):
+            self._backfill()
+        if self.current_ad + 1 < len(self.ads):
+            self.current_ad += 1
+            self._read_ahead()
+            return True
+
+        next_ads = self._get(self.page + 1)
+        if len(next_ads) == 0:
+            # new ads may show up later, so an empty tail page is not remembered
+            self._forget(self.page + 1)
+            return False
+
+        self.page += 1
+        self.current_ad = 0
+        self._read_ahead()
+        return True
+
+    def prev(self) -> bool:
+        if self.current_ad > 0:
+            self.current_ad -= 1
+            return True
+
+        if self.page <= 1:
+            return False
+
+        prev_ads = self._get(self.page - 1)
+        self.page -= 1
+        self.current_ad = max(len(prev_ads) - 1, 0)
+        self._read_ahead()
+        return True
+
+    def remove(self, id) -> bool:
+        """Drop the ad from the loaded pages, the ads after it move one place back.
+
+        Returns False if the ad is not loaded, the pages are loaded again then.
+        """
+        with self._lock:
+            window = self._window()
+            if window is not None:
+                first, ads, complete = window
+                at = next((i for i, ad in enumerate(ads) if ad.id == id), None)
+                if at is not None:
+                    del ads[at]
+                    position = (self.page - 1) * self.size + self.current_ad
+                    if first + at < position:
+                        position -= 1
+                    self._rebuild(first, ads, complete, position)
+                    found = True
+                elif complete and first == 0:
+                    # every ad of the list is loaded and this one is not among them
+                    return False
+                else:
+                    found = False
+            else:
+                found = False
+            if not found:
+                self._pages.clear()
+                self._short.clear()
+        self._read_ahead()
+        return found
+
+    def insert(self, ad) -> bool:
+        """Add a created ad after the last one, where the backend lists the ads of a user.
+
+        Returns False if the end of the list is not loaded, the ad is found there once it is.
+        """
+        with self._lock:
+            window = self._window()
+            if window is None or not window[2]:
+                return False
+            first, ads, complete = window
+            ads.append(ad)
+            self._rebuild(first, ads, complete, (self.page - 1) * self.size + self.current_ad)
+            return True
+
+    def _window(self):
+        """``(position of the first ad, ads, whether the list ends there)`` of the loaded pages
+        around the current one, None if the current page is not loaded.
+
+        The pages after it are dropped, they are rebuilt from the window or loaded again.
+        """
+        for page in [p for p, future in self._pages.items() if not future.done()]:
+            del self._pages[page]
+        pages = self._loaded()
+        if self.page not in pages:
+            return None
+        first = self.page
+        while first - 1 in pages and first - 1 not in self._short:
+            first -= 1
+        last = self.page
+        while last not in self._short and last + 1 in pages:
+            last += 1
+        for page in [p for p in self._pages if p > last]:
+            del self._pages[page]
+        ads = [ad for page in range(first, last + 1) for ad in pages[page]]
+        complete = last not in self._short and len(pages[last]) < self.size
+        return (first - 1) * self.size, ads, complete
+
+    def _rebuild(self, first: int, ads: list, complete: bool, position: int):
+        """Cut the window back into pages and put the cursor on ``position``."""
+        if complete:
+            position = min(position, len(ads) + first - 1)
+        position = max(position, 0)
+        self.page = position // self.size + 1
+        self.current_ad = position % self.size
+
+        page = first // self.size + 1
+        self._short.clear()
+        for i in range(0, len(ads) + 1, self.size):
+            chunk = ads[i:i + self.size]
+            if len(chunk) < self.size and not complete:
+                # the ads after the window are not loaded, so the tail of this page is missing
+                if len(chunk) != 0 and page == self.page:
+                    self._short.add(page)
+                else:
+                    self._pages.pop(page, None)
+                    break
+            future = Future()
+            future.set_result(chunk)
+            self._pages[page] = future
+            if len(chunk) < self.size:
+                break
+            page += 1
+
+    def patch(self, ad) -> bool:
+        """Replace the loaded version of an edited ad."""
+        with self._lock:
+            for ads in self._loaded().values():
+                for i, loaded in enumerate(ads):
+                    if loaded.id == ad.id:
+                        ads[i] = ad
+                        return True
+        return False
+
+    def _backfill(self):
+        """Load the tail of the current page if it lent ads to the pages before it."""
+        if self.page in self._short:
+            self._short.discard(self.page)
+            self._forget(self.page)
+
+    def _loaded(self) -> dict:
+        """page -> ads of the pages loaded without an error, the lists are the cached ones."""
+        return {page: future.result() for page, future in self._pages.items()
+                if future.done() and future.exception() is None}
+
+    def _get(self, page: int) -> list:
+        with self._lock:
+            future = self._pages.get(page)
+            if future is None:
+                future = Future()
+                self._pages[page] = future
+                load_now = True
+            else:
+                load_now = False
+
+        if load_now:
+            self._load(page, future)
+            self._read_ahead()
+
+        try:
+            return future.result()
+        except Exception:
+            # let the next attempt go to the backend again
+            self._forget(page)
+            raise
+
+    def _load(self, page: int, future: Future):
+        try:
+            future.set_result(self.fetch(page, self.size))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _read_ahead(self):
+        # the page after the current one is kept even without read-ahead, next() is loading it
+        keep = range(max(self.page - 1, 1), self.page + max(self.depth, 1) + 1)
+        with self._lock:
+            for page in list(self._pages.keys()):
+                if page not in keep:
+                    del self._pages[page]
+            self._short.intersection_update(keep)
+
+            if self.current_ad < min(self.prefetch_at, self.size - 1):
+                return
+            for page in range(self.page + 1, self.page + self.depth + 1):
+                if page not in self._pages:
+                    future = Future()
+                    self._pages[page] = future
+                    _prefetch_executor.submit(self._load, page, future)
+
+    def _forget(self, page: int):
+        with self._lock:
+            self._pages.pop(page, None)
@@ -0,0 +1,142 @@
+"""Parsers of the ad and account templates users send as plain messages.
+
+Both templates are described by tables of per-line converters, so a message is checked in one
+pass and every wrong field is reported at once.
+"""
+import calendar
+import re
+from enum import Enum
+
+
+class AdType(Enum):
+    FOUND = 'знайшов'
+    LOST = 'загубив'
+    OBSERVED = 'спостерігаю'
+
+    @staticmethod
+    def get_by(ua_name: str):
+        t = _AD_TYPES.get(ua_name.strip().lower())
+        if t is None:
+            raise Exception('Could not map from UA name to type')
+        return t
+
+
+_AD_TYPES = {t.value: t for t in AdType}
+_AD_TYPE_NAMES = {t.value: t.name for t in AdType}
+
+
+class ParseError(Exception):
+    """``errors`` maps the label of every wrong field to what is expected in it."""
+
+    def __init__(self, errors: dict):
+        super().__init__(errors)
+        self.errors = errors
+
+    def describe(self) -> str:
+        return '\n'.join(f'{label}: {message}' for label, message in self.errors.items())
+
+
+def _text(line: str) -> str:
+    value = line.strip()
+    if value == '':
+        raise ValueError
+    return value
+
+
+def _signs(line: str) -> list:
+    signs = [x.strip() for x in line.split(',')]
+    if signs[0] == '':
+        raise ValueError
+    return signs
+
+
+def _ad_type(line: str) -> str:
+    return _AD_TYPE_NAMES[line.strip().lower()]
+
+
+def _location(line: str) -> dict:
+    city, district, street = line.split(',', 2)
+    return {'city': city.strip(), 'district': district.strip(), 'street': street.strip()}
+
+
+# spaces around the dots and two-digit years were accepted by the split-based parser before
+_DATE = re.compile(r'\s*(\d{1,2})\s*\.\s*(\d{1,2})\s*\.\s*(\d{4}|\d{2})\s*')
+# days in a month of a leap year, February 29th of other years is checked separately
+_MONTH_DAYS = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _date(line: str) -> dict:
+    day, month, year = map(int, _DATE.fullmatch(line).groups())
+    if year < 100:
+        year += 2000
+    if not 1 <= month <= 12 or not 1 <= day <= _MONTH_DAYS[month] \
+            or (month == 2 and day == 29 and not calendar.isleap(year)):
+        raise ValueError
+    return {'day': day, 'month': month, 'year': year}
+
+
+# (request body key, template label, converter of the line, what is expected in it);
+# a converter raises ValueError, KeyError or AttributeError when the line does not fit
+AD_FIELDS = (
+    ('pet-name', "Ім'я тварини", _text, "не може бути порожнім"),
+    ('signs', "Ознаки тварини", _signs, "ознаки через кому"),
+    ('age', "Приблизний вік", int, "тільки цілі числа"),
+    ('type', "Тип оголошення", _ad_type, ', '.join(_AD_TYPES)),
+    ('location', "Місце", _location, "місто, район, вулиця"),
+    ('date', "Дата", _date, "день.місяць.рік"),
+)
+
+# lower-cased template key -> request body key
+ACCOUNT_FIELDS = {
+    "ім'я": 'firstname',
+    "фамілія": 'lastname',
+    "юзернейм": 'username',
+    "моб. телефони": 'phone-numbers',
+    "email адреси": 'email-addresses',
+}
+
+
+def parse_ad(text: str) -> dict:
+    """Request body of ``PetHome.create_ad`` / ``update_ad`` from the ad template, raises ``ParseError``."""
+    lines = text.split('\n', len(AD_FIELDS))
+    body = dict()
+    errors = None
+    for line, (key, label, convert, expected) in zip(lines, AD_FIELDS):
+        try:
+            body[key] = convert(line)
+        except (ValueError, KeyError, AttributeError):
+            if errors is None:
+                errors = dict()
+            errors[label] = expected
+    if len(lines) < len(AD_FIELDS):
+        if errors is None:
+            errors = dict()
+        for key, label, convert, expected in AD_FIELDS[len(lines):]:
+            errors[label] = expected
+    if errors is not None:
+        raise ParseError(errors)
+    return body
+
+
+def parse_account(text: str) -> dict:
+    """Request body of ``PetHome.update_account`` from the account template, raises ``ParseError``.
+
+    Only the fields present in the message are returned, unknown keys are ignored.
+    """
+    body = dict()
+    errors = None
+    for n, line in enumerate(text.split('\n'), 1):
+        key, colon, value = line.partition(':')
+        if colon == '':
+            if line.strip() == '':
+                continue
+            if errors is None:
+                errors = dict()
+            errors[f"Рядок {n}"] = "ключ: значення"
+            continue
+        field = ACCOUNT_FIELDS.get(key.strip().lower())
+        if field is not None:
+            body[field] = value.strip()
+    if errors is not None:
+        raise ParseError(errors)
+    return body
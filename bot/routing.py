@@ -0,0 +1,59 @@
+PARAM_SEPARATOR = ':'
+
+
+class CallbackRouter(object):
+    """Routes a callback query to exactly one handler by its data.
+
+    Exact routes are called as ``handler(update, context, user)``. Parameterised callback data
+    looks like ``<prefix>:<param>`` and is routed by the prefix, the handler gets the param as
+    the last argument: ``handler(update, context, user, param)``.
+    The query is answered once here, handlers must not answer it again.
+    """
+
+    def __init__(self, resolve_user, expired_text: str = None):
+        self.resolve_user = resolve_user
+        self.expired_text = expired_text
+        self._routes = dict()
+        self._prefixes = dict()
+
+    def route(self, *data: str):
+        def decorator(handler):
+            for d in data:
+                self._routes[d] = handler
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str):
+        def decorator(handler):
+            self._prefixes[prefix] = handler
+            return handler
+        return decorator
+
+    def resolve(self, data: str):
+        """Return ``(handler, args)`` for the callback data or ``(None, ())``."""
+        handler = self._routes.get(data)
+        if handler is not None:
+            return handler, ()
+
+        prefix, sep, param = data.partition(PARAM_SEPARATOR)
+        if sep:
+            handler = self._prefixes.get(prefix)
+            if handler is not None:
+                return handler, (param,)
+
+        return None, ()
+
+    def __call__(self, update, context):
+        query = update.callback_query
+        handler, args = self.resolve(query.data or '')
+        if handler is None:
+            query.answer()
+            return
+
+        u = self.resolve_user(query.from_user['id'])
+        if u is None:
+            query.answer(text=self.expired_text)
+            return
+
+        query.answer()
+        handler(update, context, u, *args)
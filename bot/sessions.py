@@ -0,0 +1,260 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(object):
+    """Mapping of telegram user id -> ``User``, used in place of a plain dict.
+
+    Handlers mutate the ``User`` objects they got from the store, so after an update is
+    processed ``touch`` has to be called to let persistent backends know it changed.
+
+    At most ``max_sessions`` users are kept in memory, the least recently used one leaves
+    first. ``evict_idle`` removes the users not seen for ``idle_timeout`` seconds. What
+    happens to a user that left memory is up to the backend, see ``_evicted``.
+    """
+
+    def __init__(self, idle_timeout: float = None, max_sessions: int = None):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        # least recently used first
+        self._users = OrderedDict()
+        self._last_seen = dict()
+        self._lock = threading.RLock()
+
+    def get(self, user_id: int, default=None):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                self._seen(user_id)
+                return user
+
+        user = self._load(user_id)
+        if user is None:
+            return default
+
+        with self._lock:
+            # another thread may have loaded or replaced it in the meantime
+            current = self._users.get(user_id)
+            if current is not None:
+                self._seen(user_id)
+                return current
+            self._keep(user_id, user)
+            return user
+
+    def __setitem__(self, user_id: int, user):
+        with self._lock:
+            self._keep(user_id, user)
+        self.touch(user_id)
+
+    def __delitem__(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._last_seen.pop(user_id, None)
+            self._deleted(user_id)
+
+    def __getitem__(self, user_id: int):
+        user = self.get(user_id)
+        if user is None:
+            raise KeyError(user_id)
+        return user
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def evict_idle(self) -> int:
+        """Move out of memory the users idle for longer than ``idle_timeout``."""
+        if self.idle_timeout is None:
+            return 0
+
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+        with self._lock:
+            while len(self._users) != 0:
+                user_id = next(iter(self._users))
+                if self._last_seen[user_id] > deadline:
+                    break
+                self._evict(user_id)
+                evicted += 1
+        return evicted
+
+    def touch(self, user_id: int):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def _load(self, user_id: int):
+        return None
+
+    def _evicted(self, user_id: int, user):
+        pass
+
+    def _deleted(self, user_id: int):
+        pass
+
+    def _seen(self, user_id: int):
+        self._users.move_to_end(user_id)
+        self._last_seen[user_id] = time.monotonic()
+
+    def _keep(self, user_id: int, user):
+        self._users[user_id] = user
+        self._seen(user_id)
+        while self.max_sessions is not None and len(self._users) > self.max_sessions:
+            self._evict(next(iter(self._users)))
+
+    def _evict(self, user_id: int):
+        user = self._users.pop(user_id)
+        del self._last_seen[user_id]
+        self._evicted(user_id, user)
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions that live only as long as the process.
+
+    When ``dumps``/``loads`` are given, evicted users are kept as their serialized form (up
+    to ``max_sessions`` of them) and come back on the next update, otherwise they are gone.
+    """
+
+    def __init__(self, dumps=None, loads=None, idle_timeout: float = None, max_sessions: int = None):
+        super().__init__(idle_timeout, max_sessions)
+        self.dumps = dumps
+        self.loads = loads
+        self._compact = OrderedDict()
+
+    def _load(self, user_id: int):
+        with self._lock:
+            data = self._compact.pop(user_id, None)
+        if data is None:
+            return None
+        return self.loads(data)
+
+    def _evicted(self, user_id: int, user):
+        if self.dumps is None:
+            return
+        self._compact[user_id] = self.dumps(user)
+        while self.max_sessions is not None and len(self._compact) > self.max_sessions:
+            self._compact.popitem(last=False)
+
+    def _deleted(self, user_id: int):
+        self._compact.pop(user_id, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """Sessions kept in memory and written behind to a SQLite file.
+
+    ``dumps(user) -> str`` and ``loads(str) -> user`` define the stored format. Changed
+    sessions are collected and written in one transaction every ``flush_interval`` seconds,
+    or earlier once ``batch_size`` of them are pending. Evicted users are only dropped from
+    memory and are read back from the file on their next update.
+    """
+
+    def __init__(self, path: str, dumps, loads, flush_interval: float = 1.0, batch_size: int = 100,
+                 idle_timeout: float = None, max_sessions: int = None):
+        super().__init__(idle_timeout, max_sessions)
+        self.dumps = dumps
+        self.loads = loads
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._dirty = set()
+        # serialized users that were evicted before their changes were written
+        self._pending = dict()
+        self._deleted_ids = set()
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)')
+        self._db.commit()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._flusher = threading.Thread(target=self._flush_loop, name='session-flusher', daemon=True)
+        self._flusher.start()
+
+    def touch(self, user_id: int):
+        with self._lock:
+            if user_id not in self._users:
+                return
+            self._dirty.add(user_id)
+            if len(self._dirty) + len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            now = time.time()
+            # a user changed after it was evicted is written as it is now, not as it was then
+            data = dict(self._pending)
+            data.update((user_id, self.dumps(self._users[user_id])) for user_id in self._dirty)
+            rows = [(user_id, d, now) for user_id, d in data.items()]
+            deleted = [(user_id,) for user_id in self._deleted_ids]
+            self._dirty.clear()
+            self._pending.clear()
+            self._deleted_ids.clear()
+
+        if len(rows) == 0 and len(deleted) == 0:
+            return
+
+        with self._db_lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)',
+                                     rows)
+                self._db.executemany('DELETE FROM sessions WHERE user_id = ?', deleted)
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def _load(self, user_id: int):
+        with self._lock:
+            if user_id in self._deleted_ids:
+                return None
+            data = self._pending.get(user_id)
+
+        if data is None:
+            with self._db_lock:
+                row = self._db.execute('SELECT data FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+            data = row[0]
+        return self.loads(data)
+
+    def _evicted(self, user_id: int, user):
+        if user_id in self._dirty:
+            self._dirty.discard(user_id)
+            self._pending[user_id] = self.dumps(user)
+
+    def _keep(self, user_id: int, user):
+        self._deleted_ids.discard(user_id)
+        if self._pending.pop(user_id, None) is not None:
+            # its unwritten changes now live in memory again
+            self._dirty.add(user_id)
+        super()._keep(user_id, user)
+
+    def _deleted(self, user_id: int):
+        self._dirty.discard(user_id)
+        self._pending.pop(user_id, None)
+        self._deleted_ids.add(user_id)
+        self._wakeup.set()
+
+    def _flush_loop(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write sessions')
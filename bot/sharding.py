@@ -0,0 +1,149 @@
+"""Worker processes owning disjoint slices of the users.
+
+The ``Supervisor`` starts ``target(shard, shards, queue)`` in every worker process and puts
+each item into the queue of the shard its key maps to, so all updates of a user are handled
+by one process, in order. Crashed workers are started again on the same queue.
+
+``broadcast`` puts an item into every queue instead, for state all the workers need, like the
+ad index walked once in the supervisor. The last broadcast item is also handed to the workers
+started afterwards, so a restarted worker does not wait for the next one.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(key, shards: int) -> int:
+    return key % shards if key is not None else 0
+
+
+def serve(queue, handle):
+    """Loop of a worker: ``handle`` every item until the ``None`` sentinel is received."""
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        try:
+            handle(item)
+        except Exception:
+            logger.exception('Could not handle %r', item)
+
+
+class Supervisor(object):
+
+    def __init__(self, target, workers: int, queue_size: int = 1000, check_interval: float = 1.0,
+                 start_method: str = 'spawn'):
+        self.target = target
+        self.workers = workers
+        self.queue_size = queue_size
+        self.check_interval = check_interval
+        self._mp = multiprocessing.get_context(start_method)
+        self._queues = list()
+        self._processes = list()
+        # held while routing and while the workers are replaced, so no item goes to a stale shard
+        self._lock = threading.RLock()
+        self._running = False
+        self._watcher = None
+        self._broadcast = None
+
+    def start(self):
+        with self._lock:
+            self._running = True
+            self._spawn_all()
+        self._watcher = threading.Thread(target=self._watch, name='shard-watcher', daemon=True)
+        self._watcher.start()
+
+    def submit(self, key, item):
+        """Queue the item for the shard of ``key``, waiting while that queue is full."""
+        while True:
+            with self._lock:
+                try:
+                    self._queues[shard_of(key, self.workers)].put_nowait(item)
+                    return
+                except queue.Full:
+                    pass
+            # the lock is not held here, so a crashed worker of the full queue can be restarted
+            time.sleep(0.01)
+
+    def broadcast(self, item):
+        """Queue the item for every shard, waiting while a queue is full."""
+        with self._lock:
+            self._broadcast = item
+            queues = list(self._queues)
+        for q in queues:
+            while True:
+                with self._lock:
+                    # the workers were replaced meanwhile, the new ones got the item when started
+                    if q not in self._queues:
+                        break
+                    try:
+                        q.put_nowait(item)
+                        break
+                    except queue.Full:
+                        pass
+                time.sleep(0.01)
+
+    def scale(self, workers: int, timeout: float = 10):
+        """Run ``workers`` processes instead of the current ones.
+
+        The running workers handle what is queued for them and exit, then every key is mapped
+        to a shard again, so a user can move to another process. Items submitted meanwhile wait.
+        """
+        with self._lock:
+            logger.info('Rebalancing from %s to %s workers', self.workers, workers)
+            self._stop_all(timeout)
+            self.workers = workers
+            self._spawn_all()
+
+    def stop(self, timeout: float = 10):
+        with self._lock:
+            self._running = False
+            self._stop_all(timeout)
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def _spawn_all(self):
+        self._queues = [self._mp.Queue(self.queue_size) for _ in range(self.workers)]
+        self._processes = [self._spawn(shard) for shard in range(self.workers)]
+
+    def _spawn(self, shard: int):
+        if self._broadcast is not None:
+            try:
+                self._queues[shard].put_nowait(self._broadcast)
+            except queue.Full:
+                # a restarted worker with a full queue, the next broadcast reaches it
+                pass
+        process = self._mp.Process(target=self.target, args=(shard, self.workers, self._queues[shard]),
+                                   name=f'shard-{shard}', daemon=True)
+        process.start()
+        return process
+
+    def _stop_all(self, timeout: float):
+        for q in self._queues:
+            try:
+                q.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning('Worker %s did not stop in time, terminating it', process.name)
+                process.terminate()
+                process.join()
+        self._processes = list()
+
+    def _watch(self):
+        while self._running:
+            time.sleep(self.check_interval)
+            with self._lock:
+                if not self._running:
+                    return
+                for shard, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        logger.warning('Worker %s exited with %s, restarting it', process.name, process.exitcode)
+                        self._processes[shard] = self._spawn(shard)
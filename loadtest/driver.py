@@ -0,0 +1,159 @@
+"""Load test of the bot against a fake Telegram Bot API and a fake PetHome backend.
+
+Every simulated user goes through /start, login, browsing other ads, creating an ad and
+editing it. The bot runs in this process with its real handlers, only the two HTTP APIs
+it talks to are stubs.
+
+    python -m loadtest.driver --users 2000 --concurrency 200 --backend-latency 0.02
+
+Bot settings are taken from the environment as usual (PET_HOME_DISPATCH=concurrent etc.),
+the Telegram rate limits are raised unless they are set explicitly.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loadtest.fake_pethome import FakePetHome
+from loadtest.fake_telegram import FakeTelegram
+
+AD_TEMPLATE = '''Джеррі
+Сіре вушко, чорний носик
+3
+знайшов
+Київ, Солом'янський, Берегівська
+13.05.2021'''
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.latencies = list()
+        self.timeouts = 0
+        self.updates = 0
+        self.lock = threading.Lock()
+
+
+def _step(telegram: FakeTelegram, stats: Stats, user_id: int, send, timeout: float):
+    """Push one update and wait for the bot to answer it with a message or an edit."""
+    before = telegram.responses_count(user_id)
+    update_id = send()
+    response = telegram.wait_response(user_id, before, timeout)
+    delivered_at = telegram.delivered_at.get(update_id)
+    with stats.lock:
+        stats.updates += 1
+        if response is None:
+            stats.timeouts += 1
+        elif delivered_at is not None:
+            stats.latencies.append(response[0] - delivered_at)
+    return response
+
+
+def simulate_user(telegram: FakeTelegram, stats: Stats, user_id: int, browse: int, timeout: float):
+    response = _step(telegram, stats, user_id, lambda: telegram.push_message(user_id, '/start'), timeout)
+    if response is None:
+        return
+    # the message /start sent, every later screen is an edit of it
+    msg_id = response[3]
+
+    def callback(data):
+        return _step(telegram, stats, user_id, lambda: telegram.push_callback(user_id, msg_id, data), timeout)
+
+    def message(text):
+        return _step(telegram, stats, user_id, lambda: telegram.push_message(user_id, text), timeout)
+
+    callback('authorization')
+    message(f'user{user_id}')
+    message('secret')
+
+    callback('view_ad')
+    callback('get_list_of_advertisements')
+    for _ in range(browse):
+        callback('next_ad')
+    callback('main')
+
+    callback('create_advertisement')
+    message(AD_TEMPLATE)
+
+    callback('view_ad')
+    callback('get_list_of_created_advertisements')
+    callback('edit_ad')
+    message(AD_TEMPLATE.replace('Джеррі', 'Том'))
+
+
+def _percentile(values: list, p: float) -> float:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='users simulated at the same time')
+    parser.add_argument('--browse', type=int, default=6, help='">" taps per user')
+    parser.add_argument('--seed-ads', type=int, default=200)
+    parser.add_argument('--backend-latency', type=float, default=0.0, help='seconds added to every backend call')
+    parser.add_argument('--backend-jitter', type=float, default=0.0)
+    parser.add_argument('--bulk', action='store_true', help='serve /v1/advertisements/batch')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for a response')
+    args = parser.parse_args(argv)
+
+    backend = FakePetHome(args.backend_latency, args.backend_jitter, args.seed_ads, args.bulk)
+    backend_host, backend_port = backend.start()
+    telegram = FakeTelegram()
+    tg_host, tg_port = telegram.start()
+
+    os.environ.setdefault('PET_HOME_TOKEN', '123:loadtest')
+    os.environ['PET_HOME_ADDR'] = backend_host
+    os.environ['PET_HOME_PORT'] = str(backend_port)
+    os.environ['PET_HOME_TELEGRAM_BASE_URL'] = f'http://{tg_host}:{tg_port}/bot'
+    os.environ.setdefault('PET_HOME_TG_GLOBAL_RATE', '1000000')
+    os.environ.setdefault('PET_HOME_TG_CHAT_RATE', '1000000')
+    os.environ.setdefault('PET_HOME_TG_CHAT_BURST', '1000000')
+
+    import main as bot
+
+    updater = bot.build_updater()
+    bot.outbound.start(updater.bot)
+    updater.start_polling(poll_interval=0, timeout=1)
+
+    stats = Stats()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for user_id in range(100000, 100000 + args.users):
+            pool.submit(simulate_user, telegram, stats, user_id, args.browse, args.timeout)
+    elapsed = time.monotonic() - started
+
+    updater.stop()
+    if bot.dispatch_pool is not None:
+        bot.dispatch_pool.shutdown()
+    bot.outbound.stop()
+    bot.users.close()
+    backend.stop()
+    telegram.stop()
+
+    latencies = stats.latencies
+    print(f'users:                  {args.users}')
+    print(f'updates:                {stats.updates} in {elapsed:.2f}s')
+    print(f'updates/sec:            {stats.updates / elapsed:.1f}')
+    print(f'handler latency p50:    {_percentile(latencies, 0.50) * 1000:.1f} ms')
+    print(f'handler latency p99:    {_percentile(latencies, 0.99) * 1000:.1f} ms')
+    if len(latencies) != 0:
+        print(f'handler latency mean:   {statistics.mean(latencies) * 1000:.1f} ms')
+    print(f'timeouts:               {stats.timeouts}')
+    print(f'backend calls/update:   {backend.total_calls() / max(stats.updates, 1):.2f}')
+    for route, count in backend.calls.most_common():
+        print(f'  {route:40} {count}')
+    print('telegram calls:')
+    for method, count in telegram.calls.most_common():
+        print(f'  {method:40} {count}')
+    return 0 if stats.timeouts == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
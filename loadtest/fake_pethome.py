@@ -0,0 +1,185 @@
+"""In-memory PetHome backend with the routes used by ``api/v1.py`` and configurable latency."""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_AD_PATH = re.compile(r'^/v1/advertisements/(\d+)$')
+
+CITIES = {
+    'Київ': ["Солом'янський", 'Печерський', 'Оболонський', 'Подільський'],
+    'Львів': ['Галицький', 'Франківський', 'Личаківський'],
+    'Одеса': ['Приморський', 'Київський', 'Малиновський'],
+}
+SIGNS = ['сіре вушко', 'чорний носик', 'білі лапи', 'рудий хвіст', 'нашийник', 'плямистий', 'кульгає']
+
+
+def random_ad(owner: str) -> dict:
+    city = random.choice(list(CITIES.keys()))
+    return {
+        'pet-name': random.choice(['Джеррі', 'Том', 'Барсик', 'Рекс', 'Мурка']),
+        'signs': random.sample(SIGNS, 2),
+        'age': random.randint(1, 12),
+        'type': random.choice(['FOUND', 'LOST', 'OBSERVED']),
+        'location': {
+            'city': city,
+            'district': random.choice(CITIES[city]),
+            'street': 'Берегівська'
+        },
+        'date': {'day': random.randint(1, 28), 'month': random.randint(1, 12), 'year': 2021},
+        '_owner': owner
+    }
+
+
+class FakePetHome(object):
+    """Any username/password pair logs in, unknown users are created on the fly."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed_ads: int = 0, bulk: bool = False):
+        self.latency = latency
+        self.jitter = jitter
+        self.bulk = bulk
+        self.calls = Counter()
+        self.accounts = dict()
+        self.ads = dict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        for i in range(seed_ads):
+            ad = random_ad('seed')
+            # consecutive ads must render differently, an identical edit is never sent
+            ad['pet-name'] += f' #{i}'
+            self._add_ad(ad)
+        self.server = None
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def start(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-pethome', daemon=True).start()
+        return self.server.server_address
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _add_ad(self, ad: dict) -> int:
+        with self._lock:
+            id = self._next_id
+            self._next_id += 1
+            self.ads[id] = ad
+        return id
+
+    def handle(self, method: str, path: str, token: str, body):
+        """Return ``(status, response body)``."""
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+
+        username = token[len('token-'):] if token and token.startswith('token-') else None
+
+        if path == '/v1/users/auth' and method == 'POST':
+            username = body['username']
+            with self._lock:
+                self.accounts.setdefault(username, _account(username))
+            return 200, {'token': f'token-{username}'}
+
+        if path == '/v1/users' and method == 'POST':
+            with self._lock:
+                self.accounts[body['username']] = dict(_account(body['username']), **body)
+            return 200, {'id': len(self.accounts)}
+
+        if username is None or username not in self.accounts:
+            return 401, {'error': 'unauthorized'}
+
+        if path == '/v1/users':
+            if method == 'GET':
+                return 200, self.accounts[username]
+            if method == 'PUT':
+                with self._lock:
+                    self.accounts[username].update(body)
+                return 200, {'id': 1}
+
+        if path == '/v1/advertisements':
+            if method == 'POST':
+                return 200, {'id': self._add_ad(dict(body, _owner=username))}
+            if method == 'GET':
+                page, size = body['paged']['current'], body['paged']['size']
+                owner = body['pov'] == 'OWNER'
+                with self._lock:
+                    ids = [id for id, ad in self.ads.items() if (ad['_owner'] == username) == owner]
+                return 200, {'ids': ids[(page - 1) * size:page * size]}
+
+        if path == '/v1/advertisements/batch' and method == 'GET':
+            if not self.bulk:
+                return 404, {'error': 'not found'}
+            with self._lock:
+                ads = [dict(_public(self.ads[id]), id=id) for id in body['ids'] if id in self.ads]
+            return 200, {'advertisements': ads}
+
+        match = _AD_PATH.match(path)
+        if match is not None:
+            id = int(match.group(1))
+            with self._lock:
+                ad = self.ads.get(id)
+                if ad is None:
+                    return 404, {'error': 'not found'}
+                if method == 'GET':
+                    return 200, _public(ad)
+                if ad['_owner'] != username:
+                    return 403, {'error': 'forbidden'}
+                if method == 'PUT':
+                    self.ads[id] = dict(body, _owner=username)
+                    return 200, {'id': id}
+                if method == 'DELETE':
+                    del self.ads[id]
+                    return 200, {'id': id}
+
+        return 404, {'error': 'not found'}
+
+
+def _account(username: str) -> dict:
+    return {
+        'firstname': 'Тарас',
+        'lastname': 'Шевченко',
+        'username': username,
+        'phone-numbers': '0501112233',
+        'email-addresses': f'{username}@test.ua'
+    }
+
+
+def _public(ad: dict) -> dict:
+    return {k: v for k, v in ad.items() if k != '_owner'}
+
+
+def _make_handler(backend: FakePetHome):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _serve(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            auth = self.headers.get('Authorization') or ''
+            token = auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+            path = self.path.split('?')[0]
+            route = f'{self.command} {_AD_PATH.sub("/v1/advertisements/{id}", path)}'
+            with backend._lock:
+                backend.calls[route] += 1
+
+            status, resp = backend.handle(self.command, path, token, body)
+            data = json.dumps(resp, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,177 @@
+"""Stub of the Telegram Bot API: hands out queued updates and records what the bot sends."""
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'PetHome', 'username': 'pethome_bot'}
+# methods whose calls show the result of an update to the user
+RESPONSE_METHODS = ('sendMessage', 'editMessageText')
+
+
+class FakeTelegram(object):
+
+    def __init__(self):
+        self.calls = Counter()
+        self._updates = deque()
+        self._next_update_id = 1
+        self._next_message_id = 1000
+        self._next_query_id = 1
+        self._lock = threading.Lock()
+        self._has_updates = threading.Condition(self._lock)
+        # chat id -> [(monotonic time, method, params, message id)] of the responses sent to the chat
+        self._responses = defaultdict(list)
+        self._responded = threading.Condition(self._lock)
+        # update id -> monotonic time the bot received it with getUpdates
+        self.delivered_at = dict()
+        self.server = None
+
+    def start(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True).start()
+        return self.server.server_address
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_message(self, user_id: int, text: str) -> int:
+        with self._lock:
+            message = {
+                'message_id': self._new_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': _user(user_id),
+                'text': text
+            }
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            return self._push({'message': message})
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> int:
+        with self._lock:
+            query = {
+                'id': str(self._next_query_id),
+                'from': _user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': '...'
+                }
+            }
+            self._next_query_id += 1
+            return self._push({'callback_query': query})
+
+    def responses_count(self, chat_id: int) -> int:
+        with self._lock:
+            return len(self._responses[chat_id])
+
+    def wait_response(self, chat_id: int, after: int, timeout: float):
+        """Wait for a response to the chat with index ``after`` and return it, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self._responses[chat_id]) <= after:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self._responded.wait(left)
+            return self._responses[chat_id][after]
+
+    def _push(self, update: dict) -> int:
+        update['update_id'] = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._has_updates.notify_all()
+        return update['update_id']
+
+    def _new_message_id(self) -> int:
+        self._next_message_id += 1
+        return self._next_message_id
+
+    def call(self, method: str, params: dict):
+        with self._lock:
+            self.calls[method] += 1
+
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('deleteWebhook', 'setWebhook', 'answerCallbackQuery', 'deleteMessage'):
+            return True
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method in RESPONSE_METHODS:
+            with self._lock:
+                chat_id = int(params['chat_id'])
+                message_id = int(params['message_id']) if 'message_id' in params else self._new_message_id()
+                self._responses[chat_id].append((time.monotonic(), method, params, message_id))
+                self._responded.notify_all()
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', '')
+            }
+        return True
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        # long polling, but short enough for the bot to stop quickly
+        timeout = min(float(params.get('timeout') or 0), 1.0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self._updates) != 0 and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            while len(self._updates) == 0:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                self._has_updates.wait(left)
+
+            updates = list(self._updates)[:limit]
+            now = time.monotonic()
+            for update in updates:
+                self.delivered_at.setdefault(update['update_id'], now)
+            return updates
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+
+def _make_handler(telegram: FakeTelegram):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _serve(self):
+            # /bot<token>/<method>
+            method = self.path.split('?')[0].rsplit('/', 1)[-1]
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if 'json' in (self.headers.get('Content-Type') or ''):
+                params = json.loads(raw) if raw else dict()
+            else:
+                params = dict(parse_qsl(raw.decode()))
+
+            result = telegram.call(method, params)
+            data = json.dumps({'ok': True, 'result': result}, ensure_ascii=False).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -1,19 +1,113 @@
 #!/usr/bin python3
 # -*- coding: utf-8 -*-
 # This program is dedicated to the public domain under the CC0 license.
+import datetime
+import json
 import logging
 import os
+import signal
+import threading
+import time
 from enum import Enum
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler
+from telegram import Bot, Update
+from telegram.utils.request import Request
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, TypeHandler, \
+    Dispatcher, JobQueue
 
 from api import PetHome
+from api.cache import TTLCache
+from api.auth import AuthExpired
+from api.http import get_pool
+from api.models import Account, Advertisement
+from api.policy import BackendError, CircuitBreaker, Policy, RetryPolicy, parse_timeouts
 from api.v1 import PetHomeImpl
+from bot import metrics
+from bot.dispatch import KeyedExecutor
+from bot.index import refresh
+from bot.keyboards import FrozenMarkup, Keyboards, button
+from bot.matching import MatchingIndex
+from bot.outbound import Outbound
+from bot.pager import Pager
+from bot.parsing import ParseError, parse_account, parse_ad
+from bot.routing import PARAM_SEPARATOR, CallbackRouter
+from bot.sharding import Supervisor, serve
+from bot.sessions import MemorySessionStore, SqliteSessionStore
 
 PET_HOME_TOKEN = os.environ['PET_HOME_TOKEN']
+# Bot API address, only changed to run the bot against a fake Telegram (see loadtest)
+PET_HOME_TELEGRAM_BASE_URL = os.environ.get('PET_HOME_TELEGRAM_BASE_URL')
 PET_HOME_ADDR = os.environ['PET_HOME_ADDR']
 PET_HOME_PORT = os.environ['PET_HOME_PORT']
+PET_HOME_POOL_SIZE = int(os.environ.get('PET_HOME_POOL_SIZE', 32))
+PET_HOME_CONNECT_TIMEOUT = float(os.environ.get('PET_HOME_CONNECT_TIMEOUT', 3.05))
+PET_HOME_READ_TIMEOUT = float(os.environ.get('PET_HOME_READ_TIMEOUT', 10))
+# per-endpoint (connect, read) timeouts, e.g. 'GET /v1/advertisements/{id}=3.05,5;POST /v1/users/auth=3.05,5'
+PET_HOME_ENDPOINT_TIMEOUTS = os.environ.get('PET_HOME_ENDPOINT_TIMEOUTS', '')
+# attempts of an idempotent GET, the backoff between them doubles from PET_HOME_RETRY_BACKOFF
+PET_HOME_RETRY_ATTEMPTS = int(os.environ.get('PET_HOME_RETRY_ATTEMPTS', 3))
+PET_HOME_RETRY_BACKOFF = float(os.environ.get('PET_HOME_RETRY_BACKOFF', 0.1))
+PET_HOME_RETRY_MAX_BACKOFF = float(os.environ.get('PET_HOME_RETRY_MAX_BACKOFF', 2))
+# failures in a row that stop calls to the backend for PET_HOME_BREAKER_RESET seconds
+PET_HOME_BREAKER_THRESHOLD = int(os.environ.get('PET_HOME_BREAKER_THRESHOLD', 5))
+PET_HOME_BREAKER_RESET = float(os.environ.get('PET_HOME_BREAKER_RESET', 30))
+PET_HOME_PAGE_SIZE = int(os.environ.get('PET_HOME_PAGE_SIZE', 4))
+PET_HOME_PREFETCH_DEPTH = int(os.environ.get('PET_HOME_PREFETCH_DEPTH', 1))
+# the pages after the current one are loaded once the user reaches this ad of the page, from 0
+PET_HOME_PREFETCH_AT = int(os.environ.get('PET_HOME_PREFETCH_AT', 2))
+PET_HOME_AD_CACHE_SIZE = int(os.environ.get('PET_HOME_AD_CACHE_SIZE', 1024))
+PET_HOME_AD_CACHE_TTL = float(os.environ.get('PET_HOME_AD_CACHE_TTL', 300))
+# how long the ETag / Last-Modified of an ad expired from the cache are kept to revalidate it
+PET_HOME_AD_VALIDATORS_TTL = float(os.environ.get('PET_HOME_AD_VALIDATORS_TTL', 86400))
+# seconds an account is shown from memory before it is revalidated with the backend
+PET_HOME_ACCOUNT_TTL = float(os.environ.get('PET_HOME_ACCOUNT_TTL', 60))
+# assumed lifetime of backend tokens that do not carry their expiry
+PET_HOME_TOKEN_TTL = float(os.environ.get('PET_HOME_TOKEN_TTL', 3600))
+# 'polling' or 'webhook'
+PET_HOME_MODE = os.environ.get('PET_HOME_MODE', 'polling')
+PET_HOME_WEBHOOK_LISTEN = os.environ.get('PET_HOME_WEBHOOK_LISTEN', '0.0.0.0')
+PET_HOME_WEBHOOK_PORT = int(os.environ.get('PET_HOME_WEBHOOK_PORT', 8443))
+# public https URL Telegram posts updates to, the secret path is appended to it
+PET_HOME_WEBHOOK_URL = os.environ.get('PET_HOME_WEBHOOK_URL', '')
+PET_HOME_WEBHOOK_SECRET = os.environ.get('PET_HOME_WEBHOOK_SECRET', PET_HOME_TOKEN)
+PET_HOME_WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('PET_HOME_WEBHOOK_MAX_CONNECTIONS', 40))
+PET_HOME_DRAIN_TIMEOUT = float(os.environ.get('PET_HOME_DRAIN_TIMEOUT', 10))
+# 'memory' or 'sqlite'
+PET_HOME_SESSION_STORE = os.environ.get('PET_HOME_SESSION_STORE', 'memory')
+PET_HOME_SESSION_DB = os.environ.get('PET_HOME_SESSION_DB', 'sessions.db')
+PET_HOME_SESSION_FLUSH_INTERVAL = float(os.environ.get('PET_HOME_SESSION_FLUSH_INTERVAL', 1.0))
+PET_HOME_SESSION_BATCH_SIZE = int(os.environ.get('PET_HOME_SESSION_BATCH_SIZE', 100))
+PET_HOME_SESSION_IDLE_TIMEOUT = float(os.environ.get('PET_HOME_SESSION_IDLE_TIMEOUT', 3600))
+PET_HOME_MAX_SESSIONS = int(os.environ.get('PET_HOME_MAX_SESSIONS', 10000))
+PET_HOME_SESSION_EVICT_INTERVAL = float(os.environ.get('PET_HOME_SESSION_EVICT_INTERVAL', 60))
+# messages per second sent to Telegram, overall and per chat
+PET_HOME_TG_GLOBAL_RATE = float(os.environ.get('PET_HOME_TG_GLOBAL_RATE', 30))
+PET_HOME_TG_CHAT_RATE = float(os.environ.get('PET_HOME_TG_CHAT_RATE', 1))
+PET_HOME_TG_CHAT_BURST = float(os.environ.get('PET_HOME_TG_CHAT_BURST', 3))
+# threads sending the queued Telegram calls, each call of a chat waits for the previous one
+PET_HOME_TG_SENDERS = int(os.environ.get('PET_HOME_TG_SENDERS', 8))
+# 'serial' handles updates one by one in the dispatcher, 'concurrent' handles users in parallel
+PET_HOME_DISPATCH = os.environ.get('PET_HOME_DISPATCH', 'serial')
+PET_HOME_DISPATCH_WORKERS = int(os.environ.get('PET_HOME_DISPATCH_WORKERS', 16))
+PET_HOME_DISPATCH_QUEUE = int(os.environ.get('PET_HOME_DISPATCH_QUEUE', 1000))
+# worker processes, users are split between them by id; 1 runs everything in this process.
+# SIGUSR1 adds a worker, use the sqlite session store so sessions survive the move of users
+PET_HOME_WORKERS = int(os.environ.get('PET_HOME_WORKERS', 1))
+PET_HOME_WORKER_QUEUE = int(os.environ.get('PET_HOME_WORKER_QUEUE', 1000))
+# /metrics is served on this port when it is not 0
+PET_HOME_METRICS_PORT = int(os.environ.get('PET_HOME_METRICS_PORT', 0))
+PET_HOME_METRICS_ADDR = os.environ.get('PET_HOME_METRICS_ADDR', '127.0.0.1')
+# share of handler calls that are timed
+PET_HOME_METRICS_SAMPLE_RATE = float(os.environ.get('PET_HOME_METRICS_SAMPLE_RATE', 1.0))
+# account the ad index is refreshed with; without it the index only learns the ads users browse
+PET_HOME_INDEX_USERNAME = os.environ.get('PET_HOME_INDEX_USERNAME')
+PET_HOME_INDEX_PASSWORD = os.environ.get('PET_HOME_INDEX_PASSWORD')
+PET_HOME_INDEX_REFRESH_INTERVAL = float(os.environ.get('PET_HOME_INDEX_REFRESH_INTERVAL', 300))
+PET_HOME_INDEX_PAGE_SIZE = int(os.environ.get('PET_HOME_INDEX_PAGE_SIZE', 50))
+# lost/found ads scoring at least this are reported to their owners, see bot.matching
+PET_HOME_MATCH_THRESHOLD = float(os.environ.get('PET_HOME_MATCH_THRESHOLD', 0.4))
+PET_HOME_MATCH_MAX_DAYS = int(os.environ.get('PET_HOME_MATCH_MAX_DAYS', 60))
+PET_HOME_MATCH_LIMIT = int(os.environ.get('PET_HOME_MATCH_LIMIT', 3))
 
 
 class Action(Enum):
@@ -36,42 +130,204 @@ class Action(Enum):
     BACK = 'back'
 
 
-class AdType(Enum):
-    FOUND = 'знайшов'
-    LOST = 'загубив'
-    OBSERVED = 'спостерігаю'
-
-    @staticmethod
-    def get_by(ua_name: str):
-        ua_name = ua_name.strip().lower()
-        for t in AdType:
-            if t.value == ua_name:
-                return t
-
-        raise Exception('Could not map from UA name to type')
-
-
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
+# one keep-alive pool to the backend, shared by the api objects of all users
+pool = get_pool(PET_HOME_ADDR, PET_HOME_PORT,
+                maxsize=PET_HOME_POOL_SIZE,
+                timeout=(PET_HOME_CONNECT_TIMEOUT, PET_HOME_READ_TIMEOUT),
+                policy=Policy(parse_timeouts(PET_HOME_ENDPOINT_TIMEOUTS),
+                              (PET_HOME_CONNECT_TIMEOUT, PET_HOME_READ_TIMEOUT),
+                              RetryPolicy(PET_HOME_RETRY_ATTEMPTS, PET_HOME_RETRY_BACKOFF,
+                                          PET_HOME_RETRY_MAX_BACKOFF),
+                              CircuitBreaker(PET_HOME_BREAKER_THRESHOLD, PET_HOME_BREAKER_RESET)))
+PetHomeImpl.ad_cache = TTLCache(PET_HOME_AD_CACHE_SIZE, PET_HOME_AD_CACHE_TTL)
+PetHomeImpl.ad_validators = TTLCache(4 * PET_HOME_AD_CACHE_SIZE, PET_HOME_AD_VALIDATORS_TTL)
+PetHomeImpl.account_ttl = PET_HOME_ACCOUNT_TTL
+PetHomeImpl.token_ttl = PET_HOME_TOKEN_TTL
+
+# every edit and deletion goes through it to stay under the Telegram flood limits
+outbound = Outbound(PET_HOME_TG_GLOBAL_RATE, PET_HOME_TG_CHAT_RATE, PET_HOME_TG_CHAT_BURST, PET_HOME_TG_SENDERS)
+
+# updates of one user are handled in order, different users in parallel; None in serial mode
+dispatch_pool = None
+
+# ads for the filters and the lost/found matching, see refresh_index
+# In the sharded mode the owners of the ads are only known to the worker of their user, the
+# owners of the other shards are not notified about the matches of their ads.
+ad_index = MatchingIndex(PET_HOME_MATCH_THRESHOLD, PET_HOME_MATCH_MAX_DAYS)
+_index_api: PetHome = None
+# key of the worker queue items carrying the ads of the supervisor index
+_INDEX_SNAPSHOT = 'ad_index_snapshot'
+
 
 class User(object):
+    __slots__ = ('msg_id', 'chat_id', 'cache', 'api', 'current_action', 'own_ads_indexed')
 
-    def __init__(self, msg_id):
+    def __init__(self, msg_id, chat_id: int = None):
         self.msg_id = msg_id
+        # chat the matches of the user's ads are reported to
+        self.chat_id = chat_id
         self.cache = dict()
         self.api: PetHome = None
         self.current_action = Action.WELCOME
+        # whether every ad of the user went through the index in this session, see _register_own_ads
+        self.own_ads_indexed = False
 
     def clear_cache(self):
         self.cache = dict()
 
 
-# {12345: {'action': Action.LOGIN_ENTERING, 'cache': dict()}}
-users = dict()
+# cache entries that are never written to the session store
+_TRANSIENT_CACHE_KEYS = ('paged', 'own_paged')
+
+
+def _own_ads_listed(u: User) -> bool:
+    return u.current_action in (Action.GET_LIST_OF_CREATED_ADVERTISEMENTS, Action.EDIT_AD)
+
+
+def _indexing(fetch):
+    """Wrap a page fetch so the ads it returns are added to the ad index."""
+    def fetch_and_index(page, size):
+        ads = fetch(page, size)
+        ad_index.add_many(ads)
+        return ads
+    return fetch_and_index
+
+
+def _owned(fetch, chat_id: int):
+    """Wrap a page fetch of the user's own ads, so their matches can be reported to the chat."""
+    def fetch_and_index(page, size):
+        ads = fetch(page, size)
+        ad_index.add_many(ads)
+        for ad in ads:
+            ad_index.set_owner(ad.id, chat_id)
+        return ads
+    return fetch_and_index
+
+
+def _filter_criteria(flt: dict) -> dict:
+    criteria = {k: flt[k] for k in ('type', 'city', 'district') if k in flt}
+    if 'days' in flt:
+        criteria['since'] = datetime.date.today() - datetime.timedelta(days=flt['days'])
+    return criteria
+
+
+def _filtered(flt: dict):
+    """Page fetch over the ads of the index matching the user filter, taken on the first call."""
+    found = None
+
+    def fetch(page, size):
+        nonlocal found
+        if found is None:
+            found = ad_index.query(**_filter_criteria(flt))
+        return found[(page - 1) * size:page * size]
+    return fetch
+
+
+def _own_ads_fetch(u: User):
+    if u.chat_id is None:
+        # a session stored before the chat was kept, its ads get their owner once listed again
+        return _indexing(u.api.get_own_advertisements)
+    return _owned(u.api.get_own_advertisements, u.chat_id)
+
+
+def _other_ads_fetch(u: User):
+    flt = u.cache.get('filter')
+    if flt:
+        return _filtered(flt)
+    return _indexing(u.api.get_other_advertisements)
+
+
+def dump_user(u: User) -> str:
+    cache = {k: v for k, v in u.cache.items() if k not in _TRANSIENT_CACHE_KEYS}
+    token = u.api.token if u.api is not None else None
+    state = [u.msg_id, u.current_action.value, token, cache]
+    pager = u.cache.get('paged')
+    state += [pager.page, pager.current_ad] if pager is not None else [None, None]
+    state.append(u.chat_id)
+    return json.dumps(state, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_user(data: str, api: PetHome = None) -> User:
+    """A session restored without ``api`` only has its token, it cannot re-authenticate and the
+    user is asked to log in again once the token expires."""
+    state = json.loads(data)
+    u = User(state[0])
+    u.current_action = Action(state[1])
+    if api is not None:
+        u.api = api
+    elif state[2] is not None:
+        u.api = PetHomeImpl(None, None, PET_HOME_ADDR, PET_HOME_PORT, pool, token=state[2])
+    u.cache = state[3]
+    if len(state) > 6:
+        u.chat_id = state[6]
+    if len(state) > 4 and state[4] is not None and u.api is not None:
+        # pages are not stored, the pager loads them again on first use
+        ad_generator = _own_ads_fetch(u) if _own_ads_listed(u) else _other_ads_fetch(u)
+        u.cache['paged'] = Pager(ad_generator, PET_HOME_PAGE_SIZE, PET_HOME_PREFETCH_DEPTH, state[4], state[5],
+                                 PET_HOME_PREFETCH_AT)
+    return u
+
+
+def _create_session_store():
+    if PET_HOME_SESSION_STORE == 'sqlite':
+        return SqliteSessionStore(PET_HOME_SESSION_DB, dump_user, load_user,
+                                  flush_interval=PET_HOME_SESSION_FLUSH_INTERVAL,
+                                  batch_size=PET_HOME_SESSION_BATCH_SIZE,
+                                  idle_timeout=PET_HOME_SESSION_IDLE_TIMEOUT,
+                                  max_sessions=PET_HOME_MAX_SESSIONS)
+    # idle users are kept serialized like in the SQLite store, loaded pages are dropped and fetched
+    # again on wake up, and the user logs in again once the token expires
+    return MemorySessionStore(dump_user, load_user,
+                              idle_timeout=PET_HOME_SESSION_IDLE_TIMEOUT,
+                              max_sessions=PET_HOME_MAX_SESSIONS)
+
+
+# {12345: User}
+users = _create_session_store()
+
+registry = metrics.Registry()
+handler_updates = registry.register(metrics.Counter(
+    'pethome_bot_updates_total', 'Updates handled, by handler', ('handler',)))
+handler_seconds = registry.register(metrics.Histogram(
+    'pethome_bot_handler_seconds', 'Time spent in handlers, sampled', ('handler',),
+    sample_rate=PET_HOME_METRICS_SAMPLE_RATE))
+backend_requests = registry.register(metrics.Counter(
+    'pethome_backend_requests_total', 'Requests to the PetHome backend', ('endpoint', 'status')))
+backend_seconds = registry.register(metrics.Histogram(
+    'pethome_backend_request_seconds', 'Duration of requests to the PetHome backend', ('endpoint',)))
+registry.register(metrics.Gauge(
+    'pethome_bot_sessions', 'Sessions kept in memory', lambda: len(users)))
+registry.register(metrics.CounterFunc(
+    'pethome_ad_cache_hits_total', 'Ads served from the shared ad cache', lambda: PetHomeImpl.ad_cache.hits))
+registry.register(metrics.CounterFunc(
+    'pethome_ad_cache_misses_total', 'Ads not found in the shared ad cache', lambda: PetHomeImpl.ad_cache.misses))
+registry.register(metrics.CounterFunc(
+    'pethome_backend_coalesced_total', 'GETs served by an identical request already in flight',
+    lambda: PetHomeImpl.inflight.shared))
+registry.register(metrics.Gauge(
+    'pethome_backend_circuit_open', '1 while calls to the backend fail fast',
+    lambda: int(pool.policy.breaker.is_open)))
+registry.register(metrics.Gauge(
+    'pethome_bot_outbound_queue', 'Telegram calls waiting to be sent', lambda: outbound.qsize()))
+registry.register(metrics.Gauge(
+    'pethome_ad_index_size', 'Ads in the local ad index', lambda: len(ad_index)))
+registry.register(metrics.Gauge(
+    'pethome_bot_dispatch_queue', 'Updates waiting for a dispatch worker',
+    lambda: dispatch_pool.pending() if dispatch_pool is not None else 0))
+
+
+def _observe_backend_call(endpoint, status, seconds):
+    backend_requests.inc(endpoint, status)
+    backend_seconds.observe(seconds, endpoint)
+
+
+pool.observer = _observe_backend_call
 # use next lines for debug
 # _tg_number = <USER TG ID>
 # _msg_id = 300
@@ -81,84 +337,171 @@ users = dict()
 # _tmp_user.current_action = Action.MAIN
 # users[_tg_number] = _tmp_user
 
-# button constans
-_main = InlineKeyboardButton("На головну 🔙", callback_data=Action.MAIN.value)
+# callback data -> the only handler of it, see call_query_handler
+router = CallbackRouter(users.get, expired_text="Сесія завершилась, натисніть /start")
+
+# keyboards are built once and shared by all users, see bot.keyboards
+keyboards = Keyboards()
+_main = button("На головну 🔙", Action.MAIN.value)
+keyboards.register('start', [
+    [button("Реєстрація", Action.REGISTRATION.value), button("Авторизація", Action.AUTHORIZATION.value)]
+])
+keyboards.register('main', [
+    [
+        button("Створити", Action.CREATE_AD.value),
+        button("Оголошення", Action.VIEW_AD.value),
+        button("Акаунт", Action.VIEW_OWN_ACCOUNT.value),
+    ]
+])
+keyboards.register('back', [[_main]])
+keyboards.register('view_ad', [
+    [
+        button("Свої", Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value),
+        button("Інші", Action.GET_LIST_OF_ADVERTISEMENTS.value),
+    ],
+    [_main]
+])
+keyboards.register('account', [[button("Оновити", Action.UPDATE_ACCOUNT.value)], [_main]])
+
+
+# position shown on an empty list
+_NO_POSITION = '·'
+
+
+@keyboards.factory('own_ad')
+def _own_ad_keyboard(position: str):
+    rows = [[button("<", 'prev_ad'), button(position, 'noop'), button(">", 'next_ad')]]
+    if position != _NO_POSITION:
+        rows.append([button("Редагувати", Action.EDIT_AD.value), button("Видалити", 'delete_ad')])
+    rows.append([_main])
+    return rows
+
+
+@keyboards.factory('other_ad')
+def _other_ad_keyboard(position: str):
+    return [
+        [button("<", 'prev_ad'), button(position, 'noop'), button(">", 'next_ad')],
+        [button("Фільтр 🔍", 'filter')],
+        [_main]
+    ]
+
+
+# message templates
+_AD_TEMPLATE = '''<Ім'я тварини>
+<Ознаки тварини> (ознаки через кому)
+<Приблизний вік> (тільки цілі числа)
+<Тип оголошення> (знайшов, загубив, спостерігаю)
+<Місце> (місто, район, вулиця)
+<Дата> (день.місяць.рік)
+Приклад:
+Джеррі
+Сіре вушко, чорний носик
+3
+знайшов
+Київ, Солом'янський, Берегівська
+13.05.2021'''
+_CREATE_AD_TEXT = f"Надішліть необхідну інформацію згідно шаблону:\n{_AD_TEMPLATE}"
+_EDIT_AD_TEXT = f"Надішліть необхідну інформацію згідно шаблону для оновлення:\n{_AD_TEMPLATE}"
+_UPDATE_ACCOUNT_TEXT = '''Надішлліть інформацію використовуючи шаблон:
+Ім'я: Тарас
+Фамілія: Шевченко
+Юзернейм: shevchenko_ua
+Моб. телефони: 0501112233, 0504445566
+Email адреси: t.shevchenko@test1.ua, tshev@test2.ua'''
+_NOTHING_FOUND_TEXT = "Пробач,я нічого не знайшов :("
+_AD_GONE_TEXT = "Оголошення вже немає. Оголошення не було оновлено"
+_UNAVAILABLE_TEXT = "Сервіс тимчасово недоступний, спробуйте пізніше"
+_SESSION_EXPIRED_TEXT = "Сесія застаріла. Пришліть логін, щоб увійти знову"
+
+
+def _display_unavailable(chat_id, u: User):
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=_UNAVAILABLE_TEXT,
+                               reply_markup=keyboards['back'])
+
+
+def _display_login(chat_id, u: User):
+    """The backend no longer accepts the session of the user, ask for the login again."""
+    u.api = None
+    u.clear_cache()
+    u.current_action = Action.LOGIN_ENTERING
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=_SESSION_EXPIRED_TEXT)
 
 
 def _display_main_page(context, user_id, chat_id, text = "Головна"):
     u: User = users[user_id]
+    own_pager = u.cache.get('paged') if _own_ads_listed(u) else u.cache.get('own_paged')
     u.current_action = Action.MAIN
     u.clear_cache()
-    keyboard = [
-        [
-            InlineKeyboardButton("Створити", callback_data=Action.CREATE_AD.value),
-            InlineKeyboardButton("Оголошення", callback_data=Action.VIEW_AD.value),
-            InlineKeyboardButton("Акаунт", callback_data=Action.VIEW_OWN_ACCOUNT.value),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    context.bot.editMessageText(chat_id=chat_id,
-                                message_id=u.msg_id,
-                                text=text,
-                                reply_markup=reply_markup)
+    if own_pager is not None:
+        # the loaded own ads are kept, writes of the user are applied to them in place
+        u.cache['own_paged'] = own_pager
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=text,
+                               reply_markup=keyboards['main'])
 
 
 def msg_handler(update, context):
     user = update.message.from_user
     user_id = user['id']
-    u: User = users[user_id]
+    u: User = users.get(user_id)
+    if u is None:
+        update.message.reply_text("Сесія завершилась, натисніть /start")
+        return
     action = u.current_action
     chat_id = update.message.chat_id
 
     if action == Action.LOGIN_ENTERING:
         username = update.message.text
         u.cache['username'] = username
-        context.bot.delete_message(chat_id=chat_id,
-                                   message_id=update.message.message_id)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text="Я отримав твій логін. Чекаю на пароль")
+        outbound.delete_message(chat_id=chat_id,
+                                message_id=update.message.message_id)
+        outbound.edit_message_text(chat_id=chat_id,
+                                   message_id=u.msg_id,
+                                   text="Я отримав твій логін. Чекаю на пароль")
         u.current_action = Action.PASSWORD_ENTERING
         return
 
     if action == Action.PASSWORD_ENTERING:
         password = update.message.text
-        context.bot.delete_message(chat_id=chat_id,
-                                   message_id=update.message.message_id)
-        u.cache['password'] = password
+        outbound.delete_message(chat_id=chat_id,
+                                message_id=update.message.message_id)
 
+        # the password stays only inside the api object, which needs it to re-authenticate
         try:
             api: PetHome = PetHomeImpl(
                 u.cache['username'],
-                u.cache['password'],
+                password,
                 PET_HOME_ADDR,
-                PET_HOME_PORT
+                PET_HOME_PORT,
+                pool
             )
+        except BackendError:
+            u.current_action = Action.LOGIN_ENTERING
+            outbound.edit_message_text(chat_id=chat_id,
+                                       message_id=u.msg_id,
+                                       text=_UNAVAILABLE_TEXT)
+            return
         except Exception:
             u.current_action = Action.LOGIN_ENTERING
-            context.bot.editMessageText(chat_id=chat_id,
-                                        message_id=u.msg_id,
-                                        text="Неправильний логін або пароль")
+            outbound.edit_message_text(chat_id=chat_id,
+                                       message_id=u.msg_id,
+                                       text="Неправильний логін або пароль")
             return
 
         del u.cache['username']
-        del u.cache['password']
 
         u.api = api
         u.current_action = Action.MAIN
 
-        keyboard = [
-            [
-                InlineKeyboardButton("Створити", callback_data=Action.CREATE_AD.value),
-                InlineKeyboardButton("Оголошення", callback_data=Action.VIEW_AD.value),
-                InlineKeyboardButton("Акаунт", callback_data=Action.VIEW_OWN_ACCOUNT.value),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text="Головна",
-                                    reply_markup=reply_markup)
+        outbound.edit_message_text(chat_id=chat_id,
+                                   message_id=u.msg_id,
+                                   text="Головна",
+                                   reply_markup=keyboards['main'])
         return
 
     if action == Action.CREATE_AD:
@@ -171,40 +514,31 @@ def msg_handler(update, context):
 13.05.2021
         '''
         text = 'Оголошення успішно створено!'
+        ad = None
         try:
-            account_data: str = update.message.text
-            lines = account_data.split('\n')
-            pet_name = lines[0].strip()
-            signs = [x.strip() for x in lines[1].split(',')]
-            age = int(lines[2])
-            ad_type = AdType.get_by(lines[3]).name
-            split_location = lines[4].split(',')
-            location = {
-                "city": split_location[0].strip(),
-                "district": split_location[1].strip(),
-                "street": split_location[2].strip()
-            }
-            d_data = lines[5].split('.')
-            d = {
-                'day': int(d_data[0]),
-                'month': int(d_data[1]),
-                'year': int(d_data[2])
-            }
-            req_body = {
-                "pet-name": pet_name,
-                "signs": signs,
-                "age": age,
-                "type": ad_type,
-                "location": location,
-                "date": d
-            }
-            u.api.create_ad(req_body)
+            created = Advertisement.from_dict(parse_ad(update.message.text))
+            created.id = u.api.create_ad(created)
+            ad = created
+            own_pager = u.cache.get('own_paged')
+            if own_pager is not None:
+                own_pager.insert(ad)
+        except ParseError as e:
+            text = f"Сталася помилка. Оголошення не створено\n{e.describe()}"
+        except BackendError:
+            text = _UNAVAILABLE_TEXT
+        except AuthExpired:
+            outbound.delete_message(chat_id=chat_id,
+                                    message_id=update.message.message_id)
+            _display_login(chat_id, u)
+            return
         except Exception:
             text = "Сталася помилка. Оголошення не створено"
 
-        context.bot.delete_message(chat_id=chat_id,
-                                   message_id=update.message.message_id)
+        outbound.delete_message(chat_id=chat_id,
+                                message_id=update.message.message_id)
         _display_main_page(context, user_id, chat_id, text)
+        if ad is not None:
+            _own_ad_saved(u, ad, chat_id)
 
     if action == Action.UPDATE_ACCOUNT:
         """ Template
@@ -216,100 +550,109 @@ def msg_handler(update, context):
         """
         text = 'Акаунт успішно оновлено!'
         try:
-            account_data: str = update.message.text
-            lines = account_data.split('\n')
-            data = dict()
-            for line in lines:
-                spl = line.split(':')
-                key = spl[0].strip().lower()
-                value = spl[1].strip()
-                data[key] = value
-
-            new_data = dict()
-            for key in data.keys():
-                if key == "ім'я":
-                    new_data['firstname'] = data[key]
-                if key == "фамілія":
-                    new_data['lastname'] = data[key]
-                if key == "юзернейм":
-                    new_data['username'] = data[key]
-                if key == "моб. телефони":
-                    new_data['phone-numbers'] = data[key]
-                if key == "email адреси":
-                    new_data['email-addresses'] = data[key]
-
+            new_data = parse_account(update.message.text)
             u.api.update_account(new_data)
+        except ParseError as e:
+            text = f"Сталася помилка. Акаунт не оновлено\n{e.describe()}"
+        except BackendError:
+            text = _UNAVAILABLE_TEXT
+        except AuthExpired:
+            outbound.delete_message(chat_id=chat_id,
+                                    message_id=update.message.message_id)
+            _display_login(chat_id, u)
+            return
         except Exception:
             text = "Сталася помилка. Акаунт не оновлено"
 
-        context.bot.delete_message(chat_id=chat_id,
-                                   message_id=update.message.message_id)
+        outbound.delete_message(chat_id=chat_id,
+                                message_id=update.message.message_id)
         _display_main_page(context, user_id, chat_id, text)
 
 
     if action == Action.EDIT_AD:
-        paged = u.cache['paged']
-        ads = paged['ads']
-        i = paged['current_ad']
-
-        current_ad = ads[i]
-        current_ad_id = current_ad['id']
+        current_ad = _current_own_ad(u)
+        if current_ad is None:
+            outbound.delete_message(chat_id=chat_id,
+                                    message_id=update.message.message_id)
+            _display_main_page(context, user_id, chat_id, _AD_GONE_TEXT)
+            return
+        current_ad_id = current_ad.id
 
+        ad = None
         try:
-                account_data: str = update.message.text
-                lines = account_data.split('\n')
-                pet_name = lines[0].strip()
-                signs = [x.strip() for x in lines[1].split(',')]
-                age = int(lines[2])
-                ad_type = AdType.get_by(lines[3]).name
-                split_location = lines[4].split(',')
-                location = {
-                    "city": split_location[0].strip(),
-                    "district": split_location[1].strip(),
-                    "street": split_location[2].strip()
-                }
-                d_data = lines[5].split('.')
-                d = {
-                    'day': int(d_data[0]),
-                    'month': int(d_data[1]),
-                    'year': int(d_data[2])
-                }
-                req_body = {
-                    "pet-name": pet_name,
-                    "signs": signs,
-                    "age": age,
-                    "type": ad_type,
-                    "location": location,
-                    "date": d
-                }
-
-                updated_ad = u.api.update_ad(req_body, current_ad_id)
+                edited = Advertisement.from_dict(parse_ad(update.message.text), current_ad_id)
+
+                updated_ad = u.api.update_ad(edited, current_ad_id)
+                ad = edited
+                u.cache['paged'].patch(ad)
                 text = "Оголошення успішно оновлено"
 
+        except ParseError as e:
+            text = f"Сталася помилка. Оголошення не було оновлено\n{e.describe()}"
+        except BackendError:
+            text = _UNAVAILABLE_TEXT
+        except AuthExpired:
+            outbound.delete_message(chat_id=chat_id,
+                                    message_id=update.message.message_id)
+            _display_login(chat_id, u)
+            return
         except Exception:
             text = "Сталася помилка. Оголошення не було оновлено"
 
-        context.bot.delete_message(chat_id=chat_id,
-                                   message_id=update.message.message_id)
+        outbound.delete_message(chat_id=chat_id,
+                                message_id=update.message.message_id)
         _display_main_page(context, user_id, chat_id, text)
+        if ad is not None:
+            _own_ad_saved(u, ad, chat_id)
+
+
+def _register_own_ads(u: User, chat_id: int):
+    """Let the index know every ad of the user, the ones not listed in this session included.
+
+    Done once a session, the ads the user creates later are registered as they are saved.
+    """
+    if u.own_ads_indexed:
+        return
+    fetch = _owned(u.api.get_own_advertisements, chat_id)
+    page = 1
+    try:
+        while len(fetch(page, PET_HOME_INDEX_PAGE_SIZE)) == PET_HOME_INDEX_PAGE_SIZE:
+            page += 1
+        u.own_ads_indexed = True
+    except Exception as e:
+        # the user already has the answer, matching goes on with the owners known so far
+        logger.warning('Could not list the ads of %s: %s', chat_id, e)
+
+
+def _own_ad_saved(u: User, ad: Advertisement, chat_id: int):
+    """Index the ad the user has just created or edited and report its new likely matches.
+
+    A pair of ads is reported once, editing the ad again only reports the matches it did not have.
+    """
+    ad_index.add(ad)
+    ad_index.set_owner(ad.id, chat_id)
+    _register_own_ads(u, chat_id)
+    matches = ad_index.new_matches(ad.id, ad_index.matches(ad, PET_HOME_MATCH_LIMIT, owner=chat_id))
+    if len(matches) == 0:
+        return
+
+    for _, other in matches:
+        owner = ad_index.owner(other.id)
+        if owner is not None and owner != chat_id:
+            outbound.send_message(owner, f"Можливий збіг для вашого оголошення «{other.pet_name}»:\n"
+                                         f"{_ad_text(ad)}")
+    outbound.send_message(chat_id, "Схожі оголошення:\n" + "\n".join(_ad_text(other) for _, other in matches))
 
 
 # Define a few command handlers. These usually take the two arguments update and
 # context. Error handlers also receive the raised TelegramError object in error.
 def start(update, context):
     """Send a message when the command /start is issued."""
-    keyboard = [
-        [
-            InlineKeyboardButton("Реєстрація", callback_data=Action.REGISTRATION.value),
-            InlineKeyboardButton("Авторизація", callback_data=Action.AUTHORIZATION.value),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     chat_id = update.message.chat_id
-    msg = context.bot.send_message(chat_id, 'Привіт! Обери дію', reply_markup=reply_markup)
+    msg = context.bot.send_message(chat_id, 'Привіт! Обери дію', reply_markup=keyboards['start'])
 
     main_id = msg.message_id
-    u = User(main_id)
+    u = User(main_id, chat_id)
     user_id = update.message.from_user['id']
     users[user_id] = u
 
@@ -329,403 +672,583 @@ def error(update, context):
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
 
-def authorization(update, context):
-    query = update.callback_query
-    query.answer()
+def refresh_index(context) -> bool:
+    """Bring the ad index up to date with the backend, return whether it worked.
+
+    The walk bypasses the shared ad cache, every ad passing through it would evict the ads users
+    are looking at. In the sharded mode only the supervisor walks the backend, the workers get
+    a snapshot of its index, see _broadcast_index.
+    """
+    global _index_api
+    try:
+        if _index_api is None:
+            _index_api = PetHomeImpl(PET_HOME_INDEX_USERNAME, PET_HOME_INDEX_PASSWORD,
+                                     PET_HOME_ADDR, PET_HOME_PORT, pool)
+        indexed = refresh(ad_index, lambda page, size: _index_api.get_other_advertisements(page, size, cache=False),
+                          PET_HOME_INDEX_PAGE_SIZE)
+        logger.info('Ad index refreshed, %s ads', indexed)
+        return True
+    except Exception as e:
+        logger.warning('Ad index refresh failed: %s', e)
+        return False
 
-    if Action.AUTHORIZATION.value == query.data:
-        user_id = query.from_user['id']
-        u: User = users[user_id]
-        u.current_action = Action.LOGIN_ENTERING
-        chat_id = query.message.chat.id
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text="Пришліть логін")
 
+def evict_idle_sessions(context):
+    evicted = users.evict_idle()
+    if evicted != 0:
+        logger.info('Evicted %s idle sessions, %s left in memory', evicted, len(users))
 
-def main_page(update, context):
+
+def touch_session(update, context):
+    """Let the session store know the user could have been changed by the update."""
+    if update.effective_user is not None:
+        users.touch(update.effective_user.id)
+
+
+def _run_handler(handler, update, context):
+    try:
+        handler(update, context)
+    except Exception as e:
+        context.dispatcher.dispatch_error(update, e)
+
+
+def in_user_order(handler):
+    """Hand the update over to the dispatch pool, queued behind the other updates of its user."""
+    def wrapper(update, context):
+        if dispatch_pool is None:
+            return handler(update, context)
+        user_id = update.effective_user.id if update.effective_user is not None else None
+        dispatch_pool.submit(user_id, _run_handler, handler, update, context)
+    return wrapper
+
+
+@router.route(Action.AUTHORIZATION.value)
+def authorization(update, context, u: User):
     query = update.callback_query
-    query.answer()
+    u.current_action = Action.LOGIN_ENTERING
+    chat_id = query.message.chat.id
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text="Пришліть логін")
+
 
-    if Action.MAIN.value == query.data:
-        user_id = update.callback_query.from_user['id']
-        chat_id = update.callback_query.message.chat.id
-        _display_main_page(context, user_id, chat_id)
+@router.route(Action.MAIN.value)
+def main_page(update, context, u: User):
+    query = update.callback_query
+    user_id = query.from_user['id']
+    chat_id = query.message.chat.id
+    _display_main_page(context, user_id, chat_id)
 
 
-def view_ad(update, context):
+@router.route(Action.VIEW_AD.value)
+def view_ad(update, context, u: User):
     query = update.callback_query
-    query.answer()
-
-    if Action.VIEW_AD.value == query.data:
-        user_id = query.from_user['id']
-        u: User = users[user_id]
-        chat_id = query.message.chat.id
-        keyboard = [
-            [
-                InlineKeyboardButton("Свої", callback_data=Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value),
-                InlineKeyboardButton("Інші", callback_data=Action.GET_LIST_OF_ADVERTISEMENTS.value),
-            ],
-            [
-                _main
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text="Чиї оголошення хочете подивитись?",
-                                    reply_markup=reply_markup)
-
-
-def _display_ad(update, context, keyboard, ad_generator):
-    user_id = update.callback_query.from_user['id']
-    u: User = users[user_id]
+    chat_id = query.message.chat.id
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text="Чиї оголошення хочете подивитись?",
+                               reply_markup=keyboards['view_ad'])
+
+
+def _ad_text(ad: Advertisement) -> str:
+    return f'''
+Pet name: {ad.pet_name}
+Signs: {', '.join(ad.signs)}
+Age: {ad.age}
+Location: {ad.location}
+Date: {ad.date}
+        '''
+
+
+def _display_ad(update, context, u: User, keyboard: str, ad_generator, notice: str = None):
+    """Show the current ad of the user's pager with the ``keyboard`` variant for its position."""
     chat_id = update.callback_query.message.chat.id
 
-    if u.cache.get('paged', None) is None:
-        u.cache['paged'] = {
-            'page': 1,
-            'current_ad': 0,
-            'ads': ad_generator(1)
-        }
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    paged = u.cache['paged']
-    ads = paged['ads']
-    if len(ads) == 0:
-        msg_txt = "Пробач,я нічого не знайшов :("
+    pager = u.cache.get('paged', None)
+    if pager is None:
+        pager = Pager(ad_generator, PET_HOME_PAGE_SIZE, PET_HOME_PREFETCH_DEPTH, prefetch_at=PET_HOME_PREFETCH_AT)
+        u.cache['paged'] = pager
+    ad = pager.current()
+    if ad is None:
+        msg_txt = _NOTHING_FOUND_TEXT
+        position = _NO_POSITION
     else:
-        i = paged['current_ad']
-        ad = ads[i]
-        msg_txt = f'''
-Pet name: {ad['pet-name']}
-Signs: {ad['signs']}
-Age: {ad['age']}
-Location: {ad['location']['city']}, {ad['location']['district']}, {ad['location']['street']}
-Date: {ad['date']['day']}.{ad['date']['month']}.{ad['date']['year']}
-        '''
+        msg_txt = _ad_text(ad)
+        position = str((pager.page - 1) * pager.size + pager.current_ad + 1)
+    if notice is not None:
+        msg_txt = f"{notice}\n{msg_txt}"
 
-    context.bot.editMessageText(chat_id=chat_id,
-                                message_id=u.msg_id,
-                                text=msg_txt,
-                                reply_markup=reply_markup)
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=msg_txt,
+                               reply_markup=keyboards.get(keyboard, position))
 
 
-def _display_own_ad(update, context):
-    user_id = update.callback_query.from_user['id']
-    u: User = users[user_id]
+def _display_own_ad(update, context, u: User, notice: str = None):
     u.current_action = Action.GET_LIST_OF_CREATED_ADVERTISEMENTS
-    keyboard = [
-        [
-            InlineKeyboardButton("<", callback_data='prev_ad'),
-            InlineKeyboardButton("Редагувати", callback_data=Action.EDIT_AD.value),
-            InlineKeyboardButton(">", callback_data='next_ad'),
-        ],
-        [
-            InlineKeyboardButton("Видалити", callback_data='delete_ad'),
-        ],
-        [
-            _main
-        ]
-    ]
-    _display_ad(update, context, keyboard, u.api.get_own_advertisements)
+    if 'paged' not in u.cache and 'own_paged' in u.cache:
+        u.cache['paged'] = u.cache.pop('own_paged')
+    u.chat_id = update.callback_query.message.chat.id
+    _display_ad(update, context, u, 'own_ad', _own_ads_fetch(u), notice)
 
 
-def _display_other_ad(update, context):
-    user_id = update.callback_query.from_user['id']
-    u: User = users[user_id]
+def _display_other_ad(update, context, u: User, notice: str = None):
     u.current_action = Action.GET_LIST_OF_ADVERTISEMENTS
-    keyboard = [
-        [
-            InlineKeyboardButton("<", callback_data='prev_ad'),
-            InlineKeyboardButton(">", callback_data='next_ad'),
-        ],
-        [
-            _main
-        ]
-    ]
-    _display_ad(update, context, keyboard, u.api.get_other_advertisements)
+    _display_ad(update, context, u, 'other_ad', _other_ads_fetch(u), notice)
 
 
-def view_created_ads(update, context):
-    query = update.callback_query
-    query.answer()
+@router.route(Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+def view_created_ads(update, context, u: User):
+    _display_own_ad(update, context, u)
 
-    if Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value == query.data:
-        _display_own_ad(update, context)
 
+@router.route(Action.GET_LIST_OF_ADVERTISEMENTS.value)
+def view_other_ads(update, context, u: User):
+    _display_other_ad(update, context, u)
 
-def view_other_ads(update, context):
-    query = update.callback_query
-    query.answer()
 
-    if Action.GET_LIST_OF_ADVERTISEMENTS.value == query.data:
-        _display_other_ad(update, context)
+@router.route('next_ad', 'prev_ad')
+def iterate_on_ads(update, context, u: User):
+    if u.current_action == Action.GET_LIST_OF_ADVERTISEMENTS:
+        _iterate_on_ads(update, context, u, _display_other_ad)
 
+    if u.current_action == Action.GET_LIST_OF_CREATED_ADVERTISEMENTS:
+        _iterate_on_ads(update, context, u, _display_own_ad)
 
-def iterate_on_ads(update, context):
+
+def _iterate_on_ads(update, context, u: User, renderer):
     query = update.callback_query
-    query.answer()
-    user_id = query.from_user['id']
-    u: User = users[user_id]
+    pager = u.cache['paged']
+    try:
+        if 'next_ad' == query.data:
+            pager.next()
+        elif 'prev_ad' == query.data:
+            pager.prev()
+        else:
+            return
+    except BackendError:
+        # keep showing the ad the user is on, it is already in memory
+        renderer(update, context, u, _UNAVAILABLE_TEXT)
+        return
+    renderer(update, context, u)
 
-    if u.current_action == Action.GET_LIST_OF_ADVERTISEMENTS:
-        _iterate_on_ads(update, context, u.api.get_other_advertisements, _display_other_ad)
 
-    if u.current_action == Action.GET_LIST_OF_CREATED_ADVERTISEMENTS:
-        _iterate_on_ads(update, context, u.api.get_own_advertisements, _display_own_ad)
+_FILTER_TYPES = (('FOUND', "Знайшли"), ('LOST', "Загубили"), ('OBSERVED', "Бачили"))
+_FILTER_DAYS = ((7, "Тиждень"), (30, "Місяць"), (365, "Рік"))
+# criterion -> values the buttons offer, callback data is sent by the client and can be forged
+_FILTER_CHOICES = {
+    'type': {t for t, _ in _FILTER_TYPES},
+    'days': {str(days) for days, _ in _FILTER_DAYS},
+}
+# cities or districts offered as buttons, the most common first
+_FILTER_FACETS = 6
+# bytes Telegram accepts as callback data
+_CALLBACK_DATA_LIMIT = 64
 
 
+def _filter_button(text: str, param: str, selected: bool):
+    data = f'filter{PARAM_SEPARATOR}{param}'
+    if len(data.encode()) > _CALLBACK_DATA_LIMIT:
+        return None
+    return button(f"✅ {text}" if selected else text, data)
 
 
-def _iterate_on_ads(update, context, ad_generator, renderer):
-    query = update.callback_query
-    query.answer()
-    user_id = query.from_user['id']
-    u: User = users[user_id]
-    if 'next_ad' == query.data:
-        paged = u.cache['paged']
-        ads = paged['ads']
-        i = paged['current_ad']
+def _rows_of(buttons: list, width: int = 3) -> list:
+    buttons = [b for b in buttons if b is not None]
+    return [buttons[i:i + width] for i in range(0, len(buttons), width)]
 
-        if i + 1 < len(ads):
-            u.cache['paged']['current_ad'] = i + 1
-        else:
-            next_page = paged['page'] + 1
-            next_ads = ad_generator(next_page)
-
-            if len(next_ads) != 0:
-                u.cache['paged'] = {
-                    'page': next_page,
-                    'current_ad': 0,
-                    'ads': next_ads
-                }
-        renderer(update, context)
-        return
 
-    if 'prev_ad' == query.data:
-        paged = u.cache['paged']
-        i = paged['current_ad']
+def _filter_keyboard(flt: dict, found: int) -> FrozenMarkup:
+    rows = _rows_of([_filter_button(label, f'type:{t}', flt.get('type') == t) for t, label in _FILTER_TYPES])
+    if 'city' in flt:
+        rows += _rows_of([_filter_button(flt['city'], f"city:{flt['city']}", True)])
+        rows += _rows_of([_filter_button(name, f'district:{name}', flt.get('district') == name)
+                          for name, _ in ad_index.districts(flt['city'], flt.get('type'), _FILTER_FACETS)])
+    else:
+        rows += _rows_of([_filter_button(name, f'city:{name}', False)
+                          for name, _ in ad_index.cities(flt.get('type'), _FILTER_FACETS)])
+    rows += _rows_of([_filter_button(label, f'days:{days}', flt.get('days') == days) for days, label in _FILTER_DAYS])
+    rows.append([button(f"Показати ({found})", 'filter:show'), button("Скинути", 'filter:reset')])
+    rows.append([_main])
+    return FrozenMarkup(rows)
+
+
+def _display_filter(update, u: User):
+    flt = u.cache.get('filter') or dict()
+    found = len(ad_index.query(**_filter_criteria(flt)))
+    outbound.edit_message_text(chat_id=update.callback_query.message.chat.id,
+                               message_id=u.msg_id,
+                               text=f"Фільтр оголошень\nЗнайдено: {found}",
+                               reply_markup=_filter_keyboard(flt, found))
+
+
+@router.route('filter')
+def filter_menu(update, context, u: User):
+    _display_filter(update, u)
+
+
+@router.prefix('filter')
+def change_filter(update, context, u: User, param: str):
+    """``filter:<criterion>:<value>`` toggles the criterion, ``filter:show`` lists the matching ads."""
+    name, _, value = param.partition(PARAM_SEPARATOR)
+    flt = dict(u.cache.get('filter') or dict())
+    if name == 'show':
+        u.cache.pop('paged', None)
+        _display_other_ad(update, context, u)
+        return
 
-        if i - 1 >= 0:
-            u.cache['paged']['current_ad'] = i - 1
+    if name == 'reset':
+        flt = dict()
+    elif name in ('type', 'city', 'district', 'days'):
+        if name in _FILTER_CHOICES and value not in _FILTER_CHOICES[name]:
+            logger.warning('Unknown value of the %s filter: %r', name, value)
+            _display_filter(update, u)
+            return
+        if name == 'days':
+            value = int(value)
+        if flt.get(name) == value:
+            del flt[name]
         else:
-            if paged['page'] > 1:
-                prev_page = paged['page'] - 1
-                prev_ads = ad_generator(prev_page)
-
-                if prev_page >= 0:
-                    u.cache['paged'] = {
-                        'page': prev_page,
-                        'current_ad': 0,
-                        'ads': prev_ads
-                    }
-        renderer(update, context)
-        return
+            flt[name] = value
+        if name == 'city':
+            flt.pop('district', None)
+    u.cache['filter'] = flt
+    _display_filter(update, u)
 
-def update_ad(update, context):
-    query = update.callback_query
-    user_id = query.from_user['id']
-    u:User = users[user_id]
-
-    if Action.EDIT_AD.value == query.data:
-        u.current_action = Action.EDIT_AD
-        chat_id = query.message.chat.id
-        text = '''
-    Надішліть необхідну інформацію згідно шаблону для оновлення:
-    <Ім'я тварини>
-    <Ознаки тварини> (ознаки через кому)
-    <Приблизний вік> (тільки цілі числа)
-    <Тип оголошення> (знайшов, загубив, спостерігаю)
-    <Місце> (місто, район, вулиця)
-    <Дата> (день.місяць.рік)
-    Приклад:
-    Джеррі
-    Сіре вушко, чорний носик
-    3
-    знайшов
-    Київ, Солом'янський, Берегівська
-    13.05.2021
-    '''
-        keyboard = [
-            [
-                _main
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text=text,
-                                    reply_markup=reply_markup)
-
-
-
-
-
-
-
-
-def delete_ad(update, context):
-    query = update.callback_query
-    query.answer()
-    user_id = query.from_user['id']
-    u: User = users[user_id]
 
-    if 'delete_ad' == query.data:
-        paged = u.cache['paged']
-        ads = paged['ads']
-        i = paged['current_ad']
-        ad = ads[i]
-        ad_id = ad['id']
+def _current_own_ad(u: User):
+    """The own ad the user is on, None if the list is empty or was never opened."""
+    pager = u.cache.get('paged')
+    if pager is None or not _own_ads_listed(u):
+        return None
+    return pager.current()
+
 
+@router.route(Action.EDIT_AD.value)
+def update_ad(update, context, u: User):
+    query = update.callback_query
+    if _current_own_ad(u) is None:
+        # a button of an older render of the list
+        _display_own_ad(update, context, u)
+        return
+    u.current_action = Action.EDIT_AD
+    chat_id = query.message.chat.id
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=_EDIT_AD_TEXT,
+                               reply_markup=keyboards['back'])
+
+
+@router.route('delete_ad')
+def delete_ad(update, context, u: User):
+    ad = _current_own_ad(u)
+    if ad is None:
+        _display_own_ad(update, context, u)
+        return
+    ad_id = ad.id
+
+    try:
         u.api.delete_ad(ad_id)
-        u.cache['paged'] = {
-            'page': 1,
-            'current_ad': 0,
-            'ads': u.api.get_own_advertisements(1)
-        }
+    except (BackendError, AuthExpired):
+        raise
+    except Exception:
+        # the ad is still there, keep showing it
+        _display_own_ad(update, context, u, "Сталася помилка. Оголошення не видалено")
+        return
+    ad_index.remove(ad_id)
+    u.cache['paged'].remove(ad_id)
 
-        _display_own_ad(update, context)
+    _display_own_ad(update, context, u)
 
 
-def create_ad(update, context):
+@router.route(Action.CREATE_AD.value)
+def create_ad(update, context, u: User):
     query = update.callback_query
-    query.answer()
-    user_id = query.from_user['id']
-    u: User = users[user_id]
+    u.current_action = Action.CREATE_AD
+    chat_id = query.message.chat.id
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=_CREATE_AD_TEXT,
+                               reply_markup=keyboards['back'])
 
-    if Action.CREATE_AD.value == query.data:
-        u.current_action = Action.CREATE_AD
-        chat_id = query.message.chat.id
-        text = '''
-Надішліть необхідну інформацію згідно шаблону:
-<Ім'я тварини>
-<Ознаки тварини> (ознаки через кому)
-<Приблизний вік> (тільки цілі числа)
-<Тип оголошення> (знайшов, загубив, спостерігаю)
-<Місце> (місто, район, вулиця)
-<Дата> (день.місяць.рік)
-Приклад:
-Джеррі
-Сіре вушко, чорний носик
-3
-знайшов
-Київ, Солом'янський, Берегівська
-13.05.2021
-'''
-        keyboard = [
-            [
-                _main
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text=text,
-                                    reply_markup=reply_markup)
-
-
-def display_own_account(update, context):
+
+@router.route(Action.VIEW_OWN_ACCOUNT.value)
+def display_own_account(update, context, u: User):
     query = update.callback_query
-    query.answer()
-    user_id = query.from_user['id']
-    u: User = users[user_id]
+    chat_id = query.message.chat.id
+    u.current_action = Action.VIEW_OWN_ACCOUNT
+    account: Account = u.api.get_account()
+    txt = f"""
+Ім'я: {account.firstname}
+Фамілія: {account.lastname}
+Юзернейм: {account.username}
+Моб. телефони: {account.phone_numbers}
+Email адреси: {account.email_addresses}
+    """
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=txt,
+                               reply_markup=keyboards['account'])
+
+
+@router.route(Action.UPDATE_ACCOUNT.value)
+def update_account(update, context, u: User):
+    query = update.callback_query
+    chat_id = query.message.chat.id
+    u.current_action = Action.UPDATE_ACCOUNT
+    outbound.edit_message_text(chat_id=chat_id,
+                               message_id=u.msg_id,
+                               text=_UPDATE_ACCOUNT_TEXT,
+                               reply_markup=keyboards['back'])
 
-    if Action.VIEW_OWN_ACCOUNT.value == query.data:
-        chat_id = query.message.chat.id
-        u.current_action = Action.VIEW_OWN_ACCOUNT
-        keyboard = [
-            [
-                InlineKeyboardButton("Оновити", callback_data=Action.UPDATE_ACCOUNT.value),
-            ],
-            [
-                _main
-            ]
-        ]
-        account = u.api.get_account()
-        txt = f"""
-Ім'я: {account['firstname']}
-Фамілія: {account['lastname']}
-Юзернейм: {account['username']}
-Моб. телефони: {account['phone-numbers']}
-Email адреси: {account['email-addresses']}
-        """
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text=txt,
-                                    reply_markup=reply_markup)
 
+@router.route('noop')
+def noop(update, context, u: User):
+    """Buttons that only show something, like the position in the ad list."""
 
-def update_account(update, context):
-    query = update.callback_query
-    query.answer()
-    user_id = query.from_user['id']
-    u: User = users[user_id]
 
-    if Action.UPDATE_ACCOUNT.value == query.data:
-        chat_id = query.message.chat.id
-        u.current_action = Action.UPDATE_ACCOUNT
-        keyboard = [
-            [
-                _main
-            ]
-        ]
-        txt = f"""
-Надішлліть інформацію використовуючи шаблон:
-Ім'я: Тарас
-Фамілія: Шевченко
-Юзернейм: shevchenko_ua
-Моб. телефони: 0501112233, 0504445566
-Email адреси: t.shevchenko@test1.ua, tshev@test2.ua
-"""
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.editMessageText(chat_id=chat_id,
-                                    message_id=u.msg_id,
-                                    text=txt,
-                                    reply_markup=reply_markup)
+def call_query_handler(update, context):
+    handler, _ = router.resolve(update.callback_query.data or '')
+    label = handler.__name__ if handler is not None else 'unrouted'
+    handler_updates.inc(label)
+    with handler_seconds.time(label):
+        try:
+            router(update, context)
+        except BackendError:
+            query = update.callback_query
+            u = users.get(query.from_user['id'])
+            if u is not None:
+                _display_unavailable(query.message.chat.id, u)
+        except AuthExpired:
+            query = update.callback_query
+            u = users.get(query.from_user['id'])
+            if u is not None:
+                _display_login(query.message.chat.id, u)
+
+
+def timed_msg_handler(update, context):
+    u = users.get(update.message.from_user['id'])
+    label = f"msg_handler:{u.current_action.value if u is not None else 'no_session'}"
+    handler_updates.inc(label)
+    with handler_seconds.time(label):
+        try:
+            msg_handler(update, context)
+        except BackendError as e:
+            logger.warning('Backend failed during a message of %s: %s', update.message.from_user['id'], e)
+            if u is not None:
+                _display_unavailable(update.message.chat_id, u)
+        except AuthExpired:
+            if u is not None:
+                _display_login(update.message.chat_id, u)
+
+
+def _drain(updater):
+    """Stop taking new updates and give the queued ones a chance to be processed."""
+    # the polling loop exits on its next round, the dispatcher keeps running
+    updater.running = False
+    if updater.httpd is not None:
+        updater.httpd.shutdown()
+
+    deadline = time.monotonic() + PET_HOME_DRAIN_TIMEOUT
+    while not updater.dispatcher.update_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def _serve_until_stopped(updater):
+    """Block until SIGINT, SIGTERM or SIGABRT, then drain the queued updates and stop the updater.
+
+    ``Updater.idle()`` is not used: it stops the dispatcher before calling a user signal handler,
+    so nothing would be left to drain.
+    """
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+    while not stopping.wait(1):
+        pass
+    logger.info('Stopping, draining the queued updates')
+    _drain(updater)
+    updater.stop()
+
+
+def _check_mode():
+    if PET_HOME_MODE == 'webhook' and not PET_HOME_WEBHOOK_URL.strip():
+        raise Exception('PET_HOME_WEBHOOK_URL must be set when PET_HOME_MODE is webhook')
+
+
+def _start_updater(updater):
+    if PET_HOME_MODE == 'webhook':
+        updater.start_webhook(listen=PET_HOME_WEBHOOK_LISTEN,
+                              port=PET_HOME_WEBHOOK_PORT,
+                              url_path=PET_HOME_WEBHOOK_SECRET,
+                              webhook_url=f"{PET_HOME_WEBHOOK_URL.rstrip('/')}/{PET_HOME_WEBHOOK_SECRET}",
+                              max_connections=PET_HOME_WEBHOOK_MAX_CONNECTIONS)
+        return
 
+    if PET_HOME_MODE != 'polling':
+        logger.warning('Unknown PET_HOME_MODE "%s", falling back to polling', PET_HOME_MODE)
+    updater.start_polling()
 
-def call_query_handler(update, context):
-    ad_handlers = [view_ad, view_created_ads, view_other_ads, iterate_on_ads, delete_ad, create_ad, update_ad]
-    user_handlers = [authorization, display_own_account, update_account]
-    service_handlers = [main_page]
 
-    for f in ad_handlers + user_handlers + service_handlers:
-        f(update, context)
+def _telegram_connections() -> int:
+    """Bot API connections: the outbound senders, the handlers answering callback queries
+    and the 4 + 4 the Updater takes for its own workers and getUpdates."""
+    handlers = PET_HOME_DISPATCH_WORKERS if PET_HOME_DISPATCH == 'concurrent' else 1
+    return PET_HOME_TG_SENDERS + handlers + 8
 
 
-def main():
-    """Start the bot."""
-    # Create the Updater and pass it your bot's token.
-    # Make sure to set use_context=True to use the new context based callbacks
-    # Post version 12 this will no longer be necessary
-    updater = Updater(PET_HOME_TOKEN, use_context=True)
+def _create_dispatch_pool():
+    global dispatch_pool
+    if PET_HOME_DISPATCH == 'concurrent' and dispatch_pool is None:
+        dispatch_pool = KeyedExecutor(PET_HOME_DISPATCH_WORKERS, PET_HOME_DISPATCH_QUEUE, 'dispatch')
 
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
 
+def register_handlers(dp, job_queue):
     # on different commands - answer in Telegram
-    dp.add_handler(CommandHandler("start", start))
+    dp.add_handler(CommandHandler("start", in_user_order(start)))
     dp.add_handler(CommandHandler("help", help))
     # dp.add_handler(MessageHandler(Filters.text & (~Filters.command), echo))
-    dp.add_handler(CallbackQueryHandler(call_query_handler))
+    dp.add_handler(CallbackQueryHandler(in_user_order(call_query_handler)))
     # dp.add_handler(CallbackQueryHandler(authorization))
     # dp.add_handler(CallbackQueryHandler(view_ad))
     # dp.add_handler(CallbackQueryHandler(view_created_ads))
 
     # on noncommand i.e message - echo the message on Telegram
-    dp.add_handler(MessageHandler(Filters.text, msg_handler))
+    dp.add_handler(MessageHandler(Filters.text, in_user_order(timed_msg_handler)))
+
+    # runs after the handlers above, for every update
+    dp.add_handler(TypeHandler(Update, in_user_order(touch_session)), group=1)
 
     # log all errors
     dp.add_error_handler(error)
 
-    # Start the Bot
-    updater.start_polling()
+    job_queue.run_repeating(evict_idle_sessions, interval=PET_HOME_SESSION_EVICT_INTERVAL)
+
+
+def build_updater() -> Updater:
+    """Create the Updater with all the handlers registered, without starting it."""
+    _create_dispatch_pool()
+
+    # Create the Updater and pass it your bot's token.
+    # Make sure to set use_context=True to use the new context based callbacks
+    # Post version 12 this will no longer be necessary
+    updater = Updater(PET_HOME_TOKEN, use_context=True,
+                      base_url=PET_HOME_TELEGRAM_BASE_URL,
+                      request_kwargs={'con_pool_size': _telegram_connections()})
+
+    # Get the dispatcher to register handlers
+    register_handlers(updater.dispatcher, updater.job_queue)
+    if PET_HOME_INDEX_USERNAME:
+        updater.job_queue.run_repeating(refresh_index, interval=PET_HOME_INDEX_REFRESH_INTERVAL, first=0)
+    return updater
+
+
+def run_worker(shard: int, shards: int, queue):
+    """Worker process of the sharded mode: handles the updates of the users of its shard."""
+    global outbound
+    # the supervisor handles the termination signals, workers stop on the end of their queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the Telegram limits are shared by all the workers
+    outbound = Outbound(PET_HOME_TG_GLOBAL_RATE / shards, PET_HOME_TG_CHAT_RATE, PET_HOME_TG_CHAT_BURST,
+                        PET_HOME_TG_SENDERS)
+    _create_dispatch_pool()
+
+    bot = Bot(PET_HOME_TOKEN, base_url=PET_HOME_TELEGRAM_BASE_URL,
+              request=Request(con_pool_size=_telegram_connections()))
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(bot, None, workers=0, job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    register_handlers(dispatcher, job_queue)
+
+    outbound.start(bot)
+    job_queue.start()
+    if PET_HOME_METRICS_PORT != 0:
+        metrics.start_http_server(registry, PET_HOME_METRICS_PORT + shard, PET_HOME_METRICS_ADDR)
+    logger.info('Worker %s of %s started', shard, shards)
+
+    serve(queue, _handle_item(dispatcher, bot))
+
+    job_queue.stop()
+    if dispatch_pool is not None:
+        dispatch_pool.shutdown(PET_HOME_DRAIN_TIMEOUT)
+    outbound.stop()
+    users.close()
+
+
+def _handle_item(dispatcher, bot):
+    """Handler of the items of a worker queue: updates, and the ad index snapshots of the supervisor."""
+    def handle(data):
+        if _INDEX_SNAPSHOT in data:
+            ads = data[_INDEX_SNAPSHOT]
+            indexed = refresh(ad_index, lambda page, size: ads[(page - 1) * size:page * size],
+                              PET_HOME_INDEX_PAGE_SIZE)
+            logger.debug('Ad index replaced by the snapshot of the supervisor, %s ads', indexed)
+            return
+        dispatcher.process_update(Update.de_json(data, bot))
+    return handle
+
+
+def _broadcast_index(supervisor: Supervisor):
+    """Job of the supervisor: walk the backend once and hand the index over to every worker."""
+    def broadcast(context):
+        if refresh_index(context):
+            supervisor.broadcast({_INDEX_SNAPSHOT: ad_index.query()})
+    return broadcast
+
+
+def _route_update(supervisor: Supervisor):
+    def route(update, context):
+        user_id = update.effective_user.id if update.effective_user is not None else None
+        supervisor.submit(user_id, update.to_dict())
+    return route
+
+
+def run_supervisor():
+    """Receive the updates in this process and hand them to PET_HOME_WORKERS worker processes."""
+    if PET_HOME_SESSION_STORE != 'sqlite':
+        logger.warning('Sessions are kept in worker memory, users moved to another worker lose them')
+    supervisor = Supervisor(run_worker, PET_HOME_WORKERS, PET_HOME_WORKER_QUEUE)
+    updater = Updater(PET_HOME_TOKEN, use_context=True,
+                      base_url=PET_HOME_TELEGRAM_BASE_URL,
+                      request_kwargs={'con_pool_size': _telegram_connections()})
+    updater.dispatcher.add_handler(TypeHandler(Update, _route_update(supervisor)))
+    # scaling stops the workers for a while, so it must not run in the signal handler
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+        target=supervisor.scale, args=(supervisor.workers + 1, PET_HOME_DRAIN_TIMEOUT), daemon=True).start())
+
+    if PET_HOME_INDEX_USERNAME:
+        updater.job_queue.run_repeating(_broadcast_index(supervisor), interval=PET_HOME_INDEX_REFRESH_INTERVAL,
+                                        first=0)
+
+    supervisor.start()
+    _start_updater(updater)
+    _serve_until_stopped(updater)
+    supervisor.stop(PET_HOME_DRAIN_TIMEOUT)
+    users.close()
+
+
+def main():
+    """Start the bot."""
+    _check_mode()
+    if PET_HOME_WORKERS > 1:
+        run_supervisor()
+        return
+
+    updater = build_updater()
+    outbound.start(updater.bot)
+    if PET_HOME_METRICS_PORT != 0:
+        metrics.start_http_server(registry, PET_HOME_METRICS_PORT, PET_HOME_METRICS_ADDR)
+
+    # Start the Bot, with long polling or with the built-in webhook server
+    _start_updater(updater)
 
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
-    # SIGTERM or SIGABRT. This should be used most of the time, since
-    # start_polling() is non-blocking and will stop the bot gracefully.
-    updater.idle()
+    # SIGTERM or SIGABRT. start_polling()/start_webhook() are non-blocking,
+    # the queued updates are drained before the dispatcher stops.
+    _serve_until_stopped(updater)
+    if dispatch_pool is not None:
+        dispatch_pool.shutdown(PET_HOME_DRAIN_TIMEOUT)
+    outbound.stop()
+    users.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import base64
+import json
+import pickle
+import threading
+import time
+
+import pytest
+
+from api import v1
+from api.auth import AuthExpired, Credentials, token_expires_at
+from api.v1 import PetHomeImpl
+
+
+def jwt(expires_in: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': time.time() + expires_in}).encode()).decode()
+    return f"header.{payload.rstrip('=')}.signature"
+
+
+class Response(object):
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = json.dumps(body).encode() if body is not None else b''
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Pool(object):
+    """Fake ``HttpPool``, every auth hands out the next token of ``tokens`` and only that one is accepted."""
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self.valid = None
+        self.auths = 0
+        self.lock = threading.Lock()
+
+    def post(self, path, headers=None, **kwargs):
+        with self.lock:
+            self.auths += 1
+            self.valid = self.tokens.pop(0)
+        # wide enough for the other threads to get their 401 meanwhile
+        time.sleep(0.01)
+        return Response(200, {'token': self.valid})
+
+    def request(self, method, path, headers=None, **kwargs):
+        if headers.get('Authorization') != f'Bearer {self.valid}':
+            return Response(401)
+        return Response(200, {'id': 1, 'pet-name': 'Джеррі', 'type': 'FOUND'})
+
+
+class Inline(object):
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture(autouse=True)
+def inline_refresh(monkeypatch):
+    monkeypatch.setattr(v1, '_fetch_executor', Inline())
+
+
+def api_of(pool):
+    return PetHomeImpl('user', 'secret', 'localhost', 1, pool)
+
+
+def test_expiry_is_read_from_the_jwt():
+    assert token_expires_at(jwt(60)) == pytest.approx(time.time() + 60, abs=1)
+    assert token_expires_at('opaque', 100) == pytest.approx(time.time() + 100, abs=1)
+    assert token_expires_at('a.!!!.c', 100) == pytest.approx(time.time() + 100, abs=1)
+
+
+def test_credentials_are_not_printed_or_serialized():
+    credentials = Credentials('user', 'secret')
+    assert 'secret' not in repr(credentials)
+    with pytest.raises(TypeError):
+        pickle.dumps(credentials)
+
+
+def test_token_close_to_its_expiry_is_refreshed_ahead():
+    pool = Pool([jwt(60), jwt(3600)])
+    api = api_of(pool)
+    first = api.token
+
+    assert api.get_advertisement_by(1, cache=False).pet_name == 'Джеррі'
+    assert pool.auths == 2
+    assert api.token != first
+    assert api.token_expires_at > time.time() + 3000
+
+
+def test_expired_token_is_renewed_before_the_request():
+    pool = Pool([jwt(-1), jwt(3600)])
+    api = api_of(pool)
+
+    assert api.get_advertisement_by(1, cache=False).pet_name == 'Джеррі'
+    assert pool.auths == 2
+
+
+def test_concurrent_refusals_share_one_reauth():
+    pool = Pool([jwt(3600), jwt(3600)])
+    api = api_of(pool)
+    pool.valid = None
+    results = list()
+
+    threads = [threading.Thread(target=lambda: results.append(api.get_advertisement_by(1, cache=False).id)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [1] * 8
+    assert pool.auths == 2
+
+
+def test_restored_session_cannot_renew_its_token():
+    pool = Pool([jwt(3600)])
+    api = PetHomeImpl(None, None, 'localhost', 1, pool, token='old')
+
+    with pytest.raises(AuthExpired):
+        api.get_advertisement_by(1, cache=False)
+    assert pool.auths == 0
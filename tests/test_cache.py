@@ -0,0 +1,59 @@
+from api.cache import TTLCache
+
+
+def expire(cache, key):
+    _, value = cache._data[key]
+    cache._data[key] = (0, value)
+
+
+def test_hit_and_miss_are_counted():
+    cache = TTLCache()
+    cache.set(1, 'a')
+
+    assert cache.get(1) == 'a'
+    assert cache.get(2, 'default') == 'default'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_leaves_first():
+    cache = TTLCache(maxsize=2)
+    cache.set(1, 'a')
+    cache.set(2, 'b')
+    cache.get(1)
+    cache.set(3, 'c')
+
+    assert len(cache) == 2
+    assert cache.get(2) is None
+    assert (cache.get(1), cache.get(3)) == ('a', 'c')
+
+
+def test_expired_entry_is_a_miss_but_kept_for_stale_reads():
+    cache = TTLCache()
+    cache.set(1, 'a')
+    expire(cache, 1)
+
+    assert cache.get(1) is None
+    assert cache.get(1, stale=True) == 'a'
+    assert len(cache) == 1
+
+    cache.set(1, 'b')
+    assert cache.get(1) == 'b'
+
+
+def test_entries_expire_after_the_ttl():
+    cache = TTLCache(ttl=-1)
+    cache.set(1, 'a')
+    assert cache.get(1) is None
+
+
+def test_invalidate_and_clear():
+    cache = TTLCache()
+    cache.set(1, 'a')
+    cache.set(2, 'b')
+    cache.invalidate(1)
+    cache.invalidate(100)
+
+    assert cache.get(1, stale=True) is None
+    assert cache.get(2) == 'b'
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from bot.dispatch import KeyedExecutor
+
+
+def test_tasks_of_a_key_run_in_order_one_at_a_time():
+    executor = KeyedExecutor(workers=8)
+    done = {key: [] for key in range(4)}
+    running = {key: 0 for key in range(4)}
+    overlaps = []
+
+    def task(key, n):
+        running[key] += 1
+        if running[key] != 1:
+            overlaps.append(key)
+        time.sleep(0.001)
+        done[key].append(n)
+        running[key] -= 1
+
+    for n in range(50):
+        for key in range(4):
+            executor.submit(key, task, key, n)
+    executor.shutdown()
+
+    assert overlaps == []
+    assert all(done[key] == list(range(50)) for key in done)
+
+
+def test_keys_run_in_parallel():
+    executor = KeyedExecutor(workers=2)
+    release = threading.Event()
+    other_done = threading.Event()
+    executor.submit('slow', release.wait, 5)
+    executor.submit('fast', other_done.set)
+    assert other_done.wait(5)
+    release.set()
+    executor.shutdown()
+
+
+def test_a_failing_task_does_not_stop_its_key():
+    executor = KeyedExecutor(workers=1)
+    done = []
+    executor.submit('user', lambda: 1 / 0)
+    executor.submit('user', done.append, 'next')
+    executor.shutdown()
+    assert done == ['next']
+
+
+def test_shutdown_waits_for_the_queued_tasks_and_stops_the_workers():
+    executor = KeyedExecutor(workers=2)
+    done = []
+    for n in range(20):
+        executor.submit(n % 3, lambda n=n: (time.sleep(0.002), done.append(n)))
+    executor.shutdown()
+
+    assert sorted(done) == list(range(20))
+    assert executor.pending() == 0
+    assert not any(t.is_alive() for t in executor._threads)
+
+
+def test_submit_blocks_while_max_pending_tasks_wait():
+    executor = KeyedExecutor(workers=1, max_pending=2)
+    release = threading.Event()
+    executor.submit('user', release.wait, 5)
+    executor.submit('user', lambda: None)
+    submitted = threading.Event()
+    t = threading.Thread(target=lambda: (executor.submit('user', lambda: None), submitted.set()))
+    t.start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+    t.join(5)
+    executor.shutdown()
@@ -0,0 +1,285 @@
+import os
+
+import pytest
+
+os.environ.setdefault('PET_HOME_TOKEN', '123:test')
+os.environ.setdefault('PET_HOME_ADDR', '127.0.0.1')
+os.environ.setdefault('PET_HOME_PORT', '1')
+
+import main  # noqa: E402
+from api.models import Account, Advertisement, Date, Location  # noqa: E402
+from api.policy import BackendError, BackendUnavailable  # noqa: E402
+from bot import pager as pager_module  # noqa: E402
+from bot.matching import MatchingIndex  # noqa: E402
+
+USER_ID = 42
+CHAT_ID = 42
+OTHER_ID = 43
+MSG_ID = 1000
+
+
+class Obj(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Outbound(object):
+    """Keeps the calls instead of sending them."""
+
+    def __init__(self):
+        self.edits = list()
+        self.sent = list()
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        self.edits.append((chat_id, text, reply_markup))
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append((chat_id, text))
+
+    def delete_message(self, chat_id, message_id):
+        pass
+
+    @property
+    def text(self) -> str:
+        return self.edits[-1][1]
+
+    @property
+    def buttons(self) -> list:
+        markup = self.edits[-1][2]
+        return [b.text for row in markup.inline_keyboard for b in row] if markup is not None else []
+
+
+def ad(id, type='FOUND', signs=('сірий кіт', 'біла лапка')):
+    return Advertisement(id, f'pet {id}', tuple(signs), 3, type, Location('Київ', 'Поділ', 'Сагайдачного'),
+                         Date(13, 5, 2021))
+
+
+class Api(object):
+    """Backend of one user, ``fail`` makes the named methods raise the exception."""
+    token = 'token'
+
+    def __init__(self, own=(), other=()):
+        self.own = list(own)
+        self.other = list(other)
+        self.fail = dict()
+        self.account = Account(1, 'Тарас', 'Шевченко', 'taras', '050', 't@test.ua')
+
+    def _check(self, name):
+        if name in self.fail:
+            raise self.fail[name]
+
+    def get_own_advertisements(self, page, size=4):
+        self._check('get_own_advertisements')
+        return self.own[(page - 1) * size:page * size]
+
+    def get_other_advertisements(self, page, size=4):
+        self._check('get_other_advertisements')
+        return self.other[(page - 1) * size:page * size]
+
+    def get_account(self):
+        self._check('get_account')
+        return self.account
+
+    def create_ad(self, created):
+        self._check('create_ad')
+        return 100
+
+    def update_ad(self, edited, id):
+        self._check('update_ad')
+        return id
+
+    def delete_ad(self, id):
+        self._check('delete_ad')
+        self.own = [a for a in self.own if a.id != id]
+
+
+def message(text):
+    msg = Obj(text=text, from_user={'id': USER_ID}, chat_id=CHAT_ID, message_id=MSG_ID + 1)
+    return Obj(message=msg, callback_query=None, effective_user=Obj(id=USER_ID))
+
+
+def callback(data, user_id=USER_ID):
+    query = Obj(data=data, from_user={'id': user_id}, message=Obj(chat=Obj(id=user_id)),
+                answer=lambda text=None: True)
+    return Obj(callback_query=query, message=None, effective_user=Obj(id=user_id))
+
+
+context = Obj(bot=None, dispatcher=None)
+
+
+@pytest.fixture
+def outbound(monkeypatch):
+    recorder = Outbound()
+    monkeypatch.setattr(main, 'outbound', recorder)
+    monkeypatch.setattr(main, 'ad_index', MatchingIndex(main.PET_HOME_MATCH_THRESHOLD, main.PET_HOME_MATCH_MAX_DAYS))
+    monkeypatch.setattr(pager_module, '_prefetch_executor', Inline())
+    yield recorder
+    for user_id in [USER_ID, OTHER_ID]:
+        if user_id in main.users:
+            del main.users[user_id]
+
+
+class Inline(object):
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def user(api, action=main.Action.MAIN, user_id=USER_ID):
+    u = main.User(MSG_ID)
+    u.api = api
+    u.current_action = action
+    main.users[user_id] = u
+    return u
+
+
+def press(data, user_id=USER_ID):
+    main.call_query_handler(callback(data, user_id), context)
+
+
+def test_failed_listing_shows_the_unavailable_view(outbound):
+    api = Api(other=[ad(1)])
+    api.fail['get_other_advertisements'] = BackendError('GET /v1/advertisements failed: timeout')
+    user(api)
+    press(main.Action.GET_LIST_OF_ADVERTISEMENTS.value)
+    assert outbound.text == main._UNAVAILABLE_TEXT
+
+    del api.fail['get_other_advertisements']
+    press(main.Action.GET_LIST_OF_ADVERTISEMENTS.value)
+    assert 'pet 1' in outbound.text
+
+
+def test_failed_page_turn_keeps_showing_the_current_ad(outbound):
+    api = Api(other=[ad(i) for i in range(1, 6)])
+    user(api)
+    press(main.Action.GET_LIST_OF_ADVERTISEMENTS.value)
+    for _ in range(3):
+        press('next_ad')
+    api.fail['get_other_advertisements'] = BackendUnavailable('PetHome backend is unavailable')
+    main.users[USER_ID].cache['paged']._pages.pop(2, None)
+    press('next_ad')
+    assert outbound.text.startswith(main._UNAVAILABLE_TEXT)
+    assert 'pet 4' in outbound.text
+
+
+def test_failed_account_shows_the_unavailable_view(outbound):
+    api = Api()
+    api.fail['get_account'] = BackendError('GET /v1/users failed')
+    user(api)
+    press(main.Action.VIEW_OWN_ACCOUNT.value)
+    assert outbound.text == main._UNAVAILABLE_TEXT
+
+
+def test_failed_create_is_reported(outbound):
+    api = Api()
+    api.fail['create_ad'] = BackendError('POST /v1/advertisements failed')
+    user(api, main.Action.CREATE_AD)
+    main.timed_msg_handler(message('Джеррі\nСіре вушко\n3\nзнайшов\nКиїв, Поділ, Сагайдачного\n13.05.2021'),
+                           context)
+    assert outbound.text == main._UNAVAILABLE_TEXT
+
+
+def test_failed_edit_of_the_current_ad_is_reported(outbound):
+    api = Api(own=[ad(1)])
+    u = user(api)
+    press(main.Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+    u.current_action = main.Action.EDIT_AD
+    u.cache['paged']._pages.clear()
+    api.fail['get_own_advertisements'] = BackendError('GET /v1/advertisements failed')
+    main.timed_msg_handler(message('Джеррі\nСіре вушко\n3\nзнайшов\nКиїв, Поділ, Сагайдачного\n13.05.2021'),
+                           context)
+    assert outbound.text == main._UNAVAILABLE_TEXT
+
+
+AD_TEXT = 'Мурчик\nсірий кіт, біла лапка\n3\n{}\nКиїв, Поділ, Сагайдачного\n13.05.2021'
+
+
+def test_saved_ad_is_not_matched_with_the_own_ads_of_its_author(outbound):
+    own_lost = ad(1, 'LOST')
+    other_lost = ad(2, 'LOST')
+    main.ad_index.add_many([own_lost, other_lost])
+    user(Api(own=[own_lost]), main.Action.CREATE_AD)
+    main.timed_msg_handler(message(AD_TEXT.format('знайшов')), context)
+
+    listed = [text for chat, text in outbound.sent if chat == CHAT_ID]
+    assert len(listed) == 1
+    assert 'pet 2' in listed[0] and 'pet 1' not in listed[0]
+
+
+def test_matches_are_reported_once_per_pair(outbound):
+    main.ad_index.add(ad(2, 'LOST'))
+    u = user(Api(), main.Action.CREATE_AD)
+    main.timed_msg_handler(message(AD_TEXT.format('знайшов')), context)
+    assert len(outbound.sent) == 1
+
+    u.api.own = [main.ad_index.get(100)]
+    press(main.Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+    press(main.Action.EDIT_AD.value)
+    main.timed_msg_handler(message(AD_TEXT.format('знайшов')), context)
+    assert len(outbound.sent) == 1
+
+
+def test_worker_index_is_replaced_by_the_snapshot_of_the_supervisor(outbound):
+    main.ad_index.add(ad(1))
+    handle = main._handle_item(dispatcher=None, bot=None)
+    handle({main._INDEX_SNAPSHOT: [ad(2), ad(3)]})
+    assert sorted(a.id for a in main.ad_index.query()) == [2, 3]
+
+
+@pytest.mark.parametrize('data', ['filter:days:abc', 'filter:days:3', 'filter:type:CAT'])
+def test_forged_filter_values_are_ignored(outbound, data):
+    u = user(Api())
+    press('filter:days:7')
+    press(data)
+    assert u.cache['filter'] == {'days': 7}
+    assert 'Тиждень' in ' '.join(outbound.buttons)
+
+
+def test_restored_own_list_keeps_reporting_its_owner(outbound):
+    u = user(Api(own=[ad(1), ad(2)]))
+    press(main.Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+
+    data = main.dump_user(u)
+    assert isinstance(data, str)
+    restored = main.load_user(data, u.api)
+    main.ad_index = MatchingIndex()
+    assert restored.cache['paged'].current().id == 1
+    assert restored.chat_id == CHAT_ID
+    assert main.ad_index.owner(1) == CHAT_ID
+
+
+def test_memory_store_keeps_idle_users_serialized(outbound):
+    store = main._create_session_store()
+    store.max_sessions = 1
+    store[USER_ID] = user(Api())
+    store[OTHER_ID] = user(Api(), user_id=OTHER_ID)
+    assert isinstance(store._compact[USER_ID], str)
+    assert store.get(USER_ID).current_action == main.Action.MAIN
+
+
+def test_empty_own_list_has_no_edit_or_delete_buttons(outbound):
+    user(Api())
+    press(main.Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+    assert outbound.text == main._NOTHING_FOUND_TEXT
+    assert 'Редагувати' not in outbound.buttons and 'Видалити' not in outbound.buttons
+
+
+@pytest.mark.parametrize('data', [main.Action.EDIT_AD.value, 'delete_ad'])
+def test_edit_and_delete_buttons_of_an_emptied_list_show_it_again(outbound, data):
+    user(Api())
+    press(main.Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+    press(data)
+    assert outbound.text == main._NOTHING_FOUND_TEXT
+
+
+def test_edit_of_an_ad_deleted_meanwhile_is_reported(outbound):
+    api = Api(own=[ad(1)])
+    u = user(api)
+    press(main.Action.GET_LIST_OF_CREATED_ADVERTISEMENTS.value)
+    assert 'Видалити' in outbound.buttons
+    press(main.Action.EDIT_AD.value)
+    api.own = []
+    u.cache['paged']._pages.clear()
+    main.timed_msg_handler(message(AD_TEXT.format('знайшов')), context)
+    assert outbound.text == main._AD_GONE_TEXT
@@ -0,0 +1,81 @@
+import datetime
+
+from api.models import Advertisement, Date, Location
+from bot.index import AdIndex, refresh
+
+
+def ad(id, type='FOUND', city='Київ', district='Поділ', day=1, month=5, year=2021):
+    return Advertisement(id, f'pet {id}', ('сірий',), 3, type, Location(city, district, 'Сагайдачного'),
+                         Date(day, month, year))
+
+
+def ids(ads):
+    return [a.id for a in ads]
+
+
+def test_query_by_type_and_place_newest_first():
+    index = AdIndex()
+    index.add_many([ad(1, day=1), ad(2, day=3), ad(3, 'LOST', day=2), ad(4, city='Львів', district='Центр', day=4)])
+
+    assert ids(index.query()) == [4, 2, 3, 1]
+    assert ids(index.query(type='FOUND')) == [4, 2, 1]
+    assert ids(index.query(city=' київ ')) == [2, 3, 1]
+    assert ids(index.query(type='FOUND', city='Київ', district='поділ')) == [2, 1]
+    assert index.query(city='Одеса') == []
+
+
+def test_date_range_includes_both_ends():
+    index = AdIndex()
+    index.add_many([ad(i, day=i) for i in range(1, 11)])
+    since, until = datetime.date(2021, 5, 3), datetime.date(2021, 5, 5)
+
+    assert ids(index.query(since=since, until=until)) == [5, 4, 3]
+    assert ids(index.query(since=datetime.date(2021, 5, 9))) == [10, 9]
+    assert ids(index.query(until=datetime.date(2021, 5, 2))) == [2, 1]
+    # few candidates are sorted instead of scanning the range
+    assert ids(index.query(type='LOST', since=since, until=until)) == []
+    index.add(ad(11, 'LOST', day=4))
+    assert ids(index.query(type='LOST', since=since, until=until)) == [11]
+
+
+def test_replaced_ad_is_only_listed_under_its_new_keys():
+    index = AdIndex()
+    index.add(ad(1, day=1))
+    index.add(ad(1, 'LOST', city='Львів', district='Центр', day=20))
+
+    assert len(index) == 1
+    assert index.query(type='FOUND') == []
+    assert index.query(city='Київ') == []
+    assert ids(index.query(type='LOST', city='Львів', since=datetime.date(2021, 5, 20))) == [1]
+    assert index.cities() == [('Львів', 1)]
+
+
+def test_removed_ad_leaves_every_index():
+    index = AdIndex()
+    index.add_many([ad(1), ad(2, city='Львів', district='Центр')])
+    index.remove(1)
+    index.remove(100)
+
+    assert 1 not in index
+    assert ids(index.query()) == [2]
+    assert index.cities() == [('Львів', 1)]
+    assert index.districts('Київ') == []
+
+
+def test_facets_count_the_ads_of_a_type():
+    index = AdIndex()
+    index.add_many([ad(1), ad(2), ad(3, 'LOST', district='Оболонь'), ad(4, city='Львів', district='Центр')])
+
+    assert index.cities() == [('Київ', 3), ('Львів', 1)]
+    assert index.cities(type='LOST') == [('Київ', 1)]
+    assert index.districts('київ') == [('Поділ', 2), ('Оболонь', 1)]
+    assert index.cities(limit=1) == [('Київ', 3)]
+
+
+def test_refresh_walks_every_page_and_drops_the_missing_ads():
+    index = AdIndex()
+    index.add(ad(100))
+    backend = [ad(i) for i in range(1, 8)]
+
+    assert refresh(index, lambda page, size: backend[(page - 1) * size:page * size], 3) == 7
+    assert sorted(ids(index.query())) == list(range(1, 8))
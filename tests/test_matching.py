@@ -0,0 +1,81 @@
+from api.models import Advertisement, Date, Location
+from bot.matching import MatchingIndex
+
+
+def ad(id, type, signs, day=1):
+    return Advertisement(id, f'pet {id}', tuple(signs), 2, type,
+                         Location('Київ', 'Поділ', 'Сагайдачного'), Date(day, 5, 2024))
+
+
+def reported(index, saved):
+    return [other.id for _, other in index.new_matches(saved.id, index.matches(saved))]
+
+
+def test_a_match_is_reported_once():
+    index = MatchingIndex()
+    index.add(ad(1, 'FOUND', ['чорний кіт', 'білий хвіст']))
+    lost = ad(2, 'LOST', ['чорний кіт', 'білий хвіст'])
+    index.add(lost)
+    assert reported(index, lost) == [1]
+    assert reported(index, lost) == []
+
+
+def test_an_edit_reports_only_the_new_matches():
+    index = MatchingIndex()
+    index.add(ad(1, 'FOUND', ['чорний кіт', 'білий хвіст']))
+    index.add(ad(3, 'OBSERVED', ['руда собака', 'довгі вуха']))
+    lost = ad(2, 'LOST', ['чорний кіт', 'білий хвіст'])
+    index.add(lost)
+    assert reported(index, lost) == [1]
+
+    edited = ad(2, 'LOST', ['чорний кіт', 'білий хвіст', 'руда собака', 'довгі вуха'])
+    index.add(edited)
+    assert reported(index, edited) == [3]
+
+
+def test_the_other_side_of_a_reported_pair_is_not_reported_again():
+    index = MatchingIndex()
+    found = ad(1, 'FOUND', ['чорний кіт', 'білий хвіст'])
+    lost = ad(2, 'LOST', ['чорний кіт', 'білий хвіст'])
+    index.add_many([found, lost])
+    assert reported(index, lost) == [1]
+    assert reported(index, found) == []
+
+
+def test_a_removed_ad_is_reported_again_once_it_is_back():
+    index = MatchingIndex()
+    found = ad(1, 'FOUND', ['чорний кіт', 'білий хвіст'])
+    lost = ad(2, 'LOST', ['чорний кіт', 'білий хвіст'])
+    index.add_many([found, lost])
+    assert reported(index, lost) == [1]
+
+    index.remove(1)
+    index.add(found)
+    assert reported(index, lost) == [1]
+
+    index.retain({2})
+    index.add(found)
+    assert reported(index, lost) == [1]
+
+
+def test_ads_of_the_owner_are_not_matched():
+    index = MatchingIndex()
+    own = ad(1, 'LOST', ['чорний кіт', 'білий хвіст'])
+    other = ad(3, 'LOST', ['чорний кіт', 'білий хвіст'])
+    found = ad(2, 'FOUND', ['чорний кіт', 'білий хвіст'])
+    index.add_many([own, other, found])
+    index.set_owner(1, 'chat')
+    index.set_owner(2, 'chat')
+    assert [m.id for _, m in index.matches(found, owner='chat')] == [3]
+    assert sorted(m.id for _, m in index.matches(found)) == [1, 3]
+
+
+def test_owner_is_kept_over_an_edit_and_dropped_with_the_ad():
+    index = MatchingIndex()
+    own = ad(1, 'LOST', ['чорний кіт', 'білий хвіст'])
+    index.add(own)
+    index.set_owner(1, 'chat')
+    index.add(ad(1, 'LOST', ['чорний кіт', 'рудий хвіст']))
+    assert index.owner(1) == 'chat'
+    index.retain(set())
+    assert index.owner(1) is None
@@ -0,0 +1,75 @@
+import pickle
+
+from api.models import Account, Advertisement, Date, Location, dumps, loads
+
+AD_BODY = {
+    'id': 7,
+    'pet-name': 'Джеррі',
+    'signs': ['Сіре вушко', 'чорний носик'],
+    'age': 3,
+    'type': 'FOUND',
+    'location': {'city': 'Київ', 'district': "Солом'янський", 'street': 'Берегівська'},
+    'date': {'day': 13, 'month': 5, 'year': 2021},
+}
+
+
+def test_ad_is_decoded_from_a_response_body():
+    ad = Advertisement.from_dict(AD_BODY)
+
+    assert ad.id == 7
+    assert ad.signs == ('Сіре вушко', 'чорний носик')
+    assert ad.location == Location('Київ', "Солом'янський", 'Берегівська')
+    assert ad.date == Date(13, 5, 2021)
+    assert str(ad.location) == "Київ, Солом'янський, Берегівська"
+    assert str(ad.date) == '13.5.2021'
+
+
+def test_ad_to_dict_is_the_request_body_without_the_id():
+    ad = Advertisement.from_dict(AD_BODY)
+    body = {k: v for k, v in AD_BODY.items() if k != 'id'}
+
+    assert ad.to_dict() == body
+    assert Advertisement.from_dict(ad.to_dict(), 7) == ad
+
+
+def test_partial_body_is_decoded_with_defaults():
+    ad = Advertisement.from_dict({'pet-name': 'Рекс', 'signs': 'рудий'}, 3)
+
+    assert ad.id == 3
+    assert ad.signs == ('рудий',)
+    assert ad.location == Location('', '', '')
+    assert ad.date.ordinal() == 0
+
+
+def test_models_compare_by_fields_and_type():
+    assert Date(1, 2, 2021) == Date(1, 2, 2021)
+    assert Date(1, 2, 2021) != Date(2, 2, 2021)
+    assert Date(1, 2, 2021) != (1, 2, 2021)
+    assert repr(Date(1, 2, 2021)) == 'Date(day=1, month=2, year=2021)'
+
+
+def test_date_ordinal_orders_dates():
+    assert Date(31, 12, 2020).ordinal() + 1 == Date(1, 1, 2021).ordinal()
+    assert Date(31, 2, 2021).ordinal() == 0
+
+
+def test_account_update_keeps_the_other_fields():
+    account = Account.from_dict({'id': 1, 'firstname': 'Тарас', 'lastname': 'Шевченко', 'username': 'taras',
+                                 'phone-numbers': '050', 'email-addresses': 't@test.ua'})
+    updated = account.updated({'lastname': 'Franko'})
+
+    assert updated.lastname == 'Franko'
+    assert (updated.id, updated.firstname, updated.phone_numbers) == (1, 'Тарас', '050')
+    assert account.lastname == 'Шевченко'
+    assert 'id' not in account.to_dict()
+
+
+def test_json_round_trip_keeps_unicode():
+    data = dumps(AD_BODY)
+    assert isinstance(data, bytes)
+    assert loads(data) == AD_BODY
+
+
+def test_models_are_picklable_for_the_worker_queues():
+    ad = Advertisement.from_dict(AD_BODY)
+    assert pickle.loads(pickle.dumps(ad)) == ad
@@ -0,0 +1,213 @@
+import threading
+import time
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+from bot.outbound import Outbound, TokenBucket
+
+
+class Bot(object):
+    """Records the calls; ``gate`` holds every call until it is set, ``errors`` are raised in turn."""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = list()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.errors = dict()
+        self.lock = threading.Lock()
+
+    def _call(self, kind, **kwargs):
+        self.gate.wait(5)
+        if self.latency:
+            time.sleep(self.latency)
+        errors = self.errors.get(kwargs['chat_id'])
+        if errors:
+            raise errors.pop(0)
+        with self.lock:
+            self.calls.append((kind, kwargs['chat_id'], kwargs.get('text'), time.monotonic()))
+
+    def edit_message_text(self, **kwargs):
+        self._call('edit', **kwargs)
+
+    def send_message(self, **kwargs):
+        self._call('send', **kwargs)
+
+    def delete_message(self, **kwargs):
+        self._call('delete', **kwargs)
+
+    def texts(self, chat_id=None):
+        return [text for _, chat, text, _ in self.calls if chat_id is None or chat == chat_id]
+
+
+def started(bot, **kwargs):
+    kwargs.setdefault('global_rate', 1000)
+    kwargs.setdefault('chat_rate', 1000)
+    kwargs.setdefault('chat_burst', 1000)
+    outbound = Outbound(**kwargs)
+    outbound.start(bot)
+    return outbound
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_pending_edits_of_a_message_are_coalesced():
+    bot = Bot()
+    bot.gate.clear()
+    outbound = started(bot, senders=1)
+    outbound.send_message(1, 'hold')
+    wait_until(lambda: outbound.qsize() == 0)
+    for text in ('a', 'b', 'c'):
+        outbound.edit_message_text(1, 10, text)
+    bot.gate.set()
+    outbound.stop()
+    assert bot.texts() == ['hold', 'c']
+
+
+def test_edit_matching_the_shown_render_is_dropped():
+    bot = Bot()
+    outbound = started(bot)
+    outbound.edit_message_text(1, 10, 'a')
+    wait_until(lambda: len(bot.calls) == 1)
+    outbound.edit_message_text(1, 10, 'a')
+    outbound.stop()
+    assert bot.texts() == ['a']
+
+
+def test_going_back_to_the_sent_render_while_another_is_in_flight():
+    bot = Bot()
+    outbound = started(bot)
+    outbound.edit_message_text(1, 10, 'A')
+    wait_until(lambda: len(bot.calls) == 1)
+    bot.gate.clear()
+    outbound.edit_message_text(1, 10, 'B')
+    wait_until(lambda: outbound.qsize() == 0)
+    # B is in flight, the message is going to show it, so A has to be sent again
+    outbound.edit_message_text(1, 10, 'A')
+    bot.gate.set()
+    outbound.stop()
+    assert bot.texts() == ['A', 'B', 'A']
+
+
+def test_failed_edit_can_be_sent_again():
+    bot = Bot()
+    bot.errors[1] = [Exception('network')]
+    outbound = started(bot)
+    outbound.edit_message_text(1, 10, 'a')
+    wait_until(lambda: len(bot.errors[1]) == 0 and outbound.qsize() == 0)
+    wait_until(lambda: len(outbound._busy) == 0)
+    outbound.edit_message_text(1, 10, 'a')
+    outbound.stop()
+    assert bot.texts() == ['a']
+
+
+def test_not_modified_counts_as_shown():
+    bot = Bot()
+    bot.errors[1] = [BadRequest('Message is not modified')]
+    outbound = started(bot)
+    outbound.edit_message_text(1, 10, 'a')
+    wait_until(lambda: len(bot.errors[1]) == 0)
+    outbound.edit_message_text(1, 10, 'a')
+    outbound.stop()
+    assert bot.calls == []
+
+
+def test_deleted_message_drops_its_pending_edit():
+    bot = Bot()
+    bot.gate.clear()
+    outbound = started(bot, senders=1)
+    outbound.send_message(1, 'hold')
+    wait_until(lambda: outbound.qsize() == 0)
+    outbound.edit_message_text(1, 10, 'a')
+    outbound.delete_message(1, 10)
+    bot.gate.set()
+    outbound.stop()
+    assert [kind for kind, *_ in bot.calls] == ['send', 'delete']
+
+
+def test_calls_of_a_chat_keep_their_order_across_senders():
+    bot = Bot(latency=0.001)
+    outbound = started(bot, senders=8)
+    for n in range(30):
+        for chat in (1, 2, 3):
+            outbound.send_message(chat, str(n))
+    outbound.stop()
+    for chat in (1, 2, 3):
+        assert bot.texts(chat) == [str(n) for n in range(30)]
+
+
+def test_chats_are_sent_in_parallel():
+    bot = Bot(latency=0.1)
+    outbound = started(bot, senders=8)
+    began = time.monotonic()
+    for chat in range(8):
+        outbound.send_message(chat, 'hi')
+    outbound.stop()
+    assert len(bot.calls) == 8
+    assert time.monotonic() - began < 0.5
+
+
+def test_chat_rate_is_limited():
+    bot = Bot()
+    outbound = started(bot, chat_rate=20, chat_burst=1)
+    for n in range(5):
+        outbound.send_message(1, str(n))
+    outbound.stop()
+    times = [t for *_, t in bot.calls]
+    assert len(times) == 5
+    # one token every 50 ms once the burst of one is spent
+    assert times[-1] - times[0] >= 0.18
+
+
+def test_global_rate_is_limited():
+    bot = Bot()
+    outbound = started(bot, global_rate=20)
+    for chat in range(40):
+        outbound.send_message(chat, 'hi')
+    outbound.stop()
+    times = [t for *_, t in bot.calls]
+    assert len(times) == 40
+    # 20 at once, the other 20 at 20 per second
+    assert times[-1] - times[0] >= 0.9
+
+
+def test_flood_controlled_chat_does_not_stall_the_others():
+    bot = Bot()
+    bot.errors[1] = [RetryAfter(1)]
+    outbound = started(bot, senders=2)
+    began = time.monotonic()
+    outbound.send_message(1, 'late')
+    wait_until(lambda: len(bot.errors[1]) == 0)
+    outbound.send_message(2, 'now')
+    wait_until(lambda: bot.texts(2) == ['now'])
+    assert time.monotonic() - began < 0.5
+    outbound.stop()
+    assert bot.texts(1) == ['late']
+    assert bot.calls[-1][3] - began >= 1
+
+
+def test_stop_drops_what_is_not_sent_in_time():
+    bot = Bot()
+    bot.gate.clear()
+    outbound = started(bot, senders=1)
+    outbound.send_message(1, 'hold')
+    outbound.send_message(1, 'never')
+    began = time.monotonic()
+    outbound.stop(timeout=0.2)
+    assert time.monotonic() - began < 1
+    bot.gate.set()
+
+
+@pytest.mark.parametrize('elapsed, expected', [(0, 0.5), (0.25, 0.25), (0.5, 0), (10, 0)])
+def test_token_bucket_wait_time(elapsed, expected):
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated_at
+    assert bucket.wait_time(now) == 0
+    bucket.take()
+    assert bucket.wait_time(now + elapsed) == pytest.approx(expected)
@@ -0,0 +1,223 @@
+import random
+
+import pytest
+
+from bot import pager as pager_module
+from bot.pager import Pager
+
+
+class Ad(object):
+
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return f'Ad({self.id})'
+
+
+class Inline(object):
+    """Runs the read-ahead in the calling thread, so the tests are deterministic."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture(autouse=True)
+def inline_prefetch(monkeypatch):
+    monkeypatch.setattr(pager_module, '_prefetch_executor', Inline())
+
+
+class Backend(object):
+
+    def __init__(self, n):
+        self.ads = [Ad(i) for i in range(n)]
+        self.fetches = 0
+
+    def fetch(self, page, size):
+        self.fetches += 1
+        return list(self.ads[(page - 1) * size:page * size])
+
+
+def walk(pager):
+    """Every ad of the list, from the first one."""
+    while pager.prev():
+        pass
+    ad = pager.current()
+    seen = [ad] if ad is not None else []
+    while pager.next():
+        seen.append(pager.current())
+    return seen
+
+
+def test_next_and_prev_walk_the_list():
+    backend = Backend(10)
+    pager = Pager(backend.fetch, 4, 1)
+
+    assert walk(pager) == backend.ads
+    assert (pager.page, pager.current_ad) == (3, 1)
+    assert pager.next() is False
+
+
+def test_opening_a_list_loads_only_its_first_page():
+    backend = Backend(10)
+    pager = Pager(backend.fetch, 4, 1)
+
+    assert pager.current() is backend.ads[0]
+    assert backend.fetches == 1
+
+
+def test_next_page_is_loaded_once_the_user_reaches_the_prefetch_position():
+    backend = Backend(10)
+    pager = Pager(backend.fetch, 4, 1, prefetch_at=2)
+    pager.current()
+
+    pager.next()
+    assert backend.fetches == 1
+    pager.next()
+    assert backend.fetches == 2
+    assert 2 in pager._pages
+
+    pager.next()
+    pager.next()
+    assert backend.fetches == 2
+
+
+def test_empty_list():
+    pager = Pager(Backend(0).fetch, 4, 1)
+
+    assert pager.current() is None
+    assert pager.next() is False
+    assert pager.prev() is False
+
+
+def test_remove_keeps_the_cursor_on_the_next_ad_without_loading_pages():
+    backend = Backend(10)
+    pager = Pager(backend.fetch, 4, 1)
+    pager.next()
+    fetches = backend.fetches
+
+    removed = pager.current()
+    backend.ads.remove(removed)
+    assert pager.remove(removed.id) is True
+
+    assert pager.current() is backend.ads[1]
+    assert backend.fetches == fetches
+    assert walk(pager) == backend.ads
+
+
+def test_remove_of_the_last_ad_moves_back():
+    backend = Backend(5)
+    pager = Pager(backend.fetch, 4, 1)
+    while pager.next():
+        pass
+
+    removed = pager.current()
+    backend.ads.remove(removed)
+    pager.remove(removed.id)
+
+    assert pager.current() is backend.ads[-1]
+    assert pager.page == 1
+
+
+def test_remove_of_an_ad_that_is_not_loaded_reloads_the_pages():
+    backend = Backend(12)
+    pager = Pager(backend.fetch, 2, 0)
+    for _ in range(6):
+        pager.next()
+
+    removed = backend.ads[0]
+    backend.ads.remove(removed)
+    assert pager.remove(removed.id) is False
+
+    assert walk(pager) == backend.ads
+
+
+def test_insert_appends_to_the_loaded_last_page():
+    backend = Backend(3)
+    pager = Pager(backend.fetch, 4, 1)
+    pager.current()
+    fetches = backend.fetches
+
+    ad = Ad(100)
+    backend.ads.append(ad)
+    assert pager.insert(ad) is True
+
+    assert backend.fetches == fetches
+    assert walk(pager) == backend.ads
+
+
+def test_insert_is_left_to_the_backend_when_the_end_is_not_loaded():
+    backend = Backend(20)
+    pager = Pager(backend.fetch, 4, 1)
+    pager.current()
+
+    ad = Ad(100)
+    backend.ads.append(ad)
+    assert pager.insert(ad) is False
+
+    assert walk(pager) == backend.ads
+
+
+def test_patch_replaces_the_loaded_ad():
+    backend = Backend(3)
+    pager = Pager(backend.fetch, 4, 1)
+    pager.current()
+
+    edited = Ad(1)
+    assert pager.patch(edited) is True
+
+    assert pager.ads[1] is edited
+    assert pager.patch(Ad(100)) is False
+
+
+def test_single_ad_pages_keep_the_first_ad_after_inserts_and_removes():
+    backend = Backend(1)
+    pager = Pager(backend.fetch, 1, 0)
+    first = backend.ads[0]
+
+    pager.next()
+    a, b = Ad(100), Ad(101)
+    backend.ads.append(a)
+    pager.insert(a)
+    pager.next()
+    backend.ads.append(b)
+    pager.insert(b)
+    backend.ads.remove(a)
+    pager.remove(a.id)
+    backend.ads.remove(b)
+    pager.remove(b.id)
+
+    assert pager.current() is first
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 4])
+@pytest.mark.parametrize('depth', [0, 1, 2])
+def test_random_writes_match_the_backend(size, depth):
+    for seed in range(200):
+        rnd = random.Random(seed)
+        backend = Backend(rnd.randint(0, 8))
+        pager = Pager(backend.fetch, size, depth)
+        ids = iter(range(100, 200))
+        for _ in range(25):
+            op = rnd.random()
+            current = pager.current()
+            if op < 0.25:
+                pager.next()
+            elif op < 0.4:
+                pager.prev()
+            elif op < 0.6:
+                ad = Ad(next(ids))
+                backend.ads.append(ad)
+                pager.insert(ad)
+            elif len(backend.ads) != 0:
+                ad = current if op < 0.8 and current is not None else rnd.choice(backend.ads)
+                backend.ads.remove(ad)
+                pager.remove(ad.id)
+
+            current = pager.current()
+            position = (pager.page - 1) * size + pager.current_ad
+            if len(backend.ads) == 0:
+                assert current is None, seed
+            else:
+                assert current is backend.ads[position], seed
+        assert walk(pager) == backend.ads, seed
@@ -0,0 +1,83 @@
+import pytest
+
+from bot.parsing import AdType, ParseError, parse_account, parse_ad
+
+
+def ad_text(name='Джеррі', signs='Сіре вушко, білий хвіст', age='3', type='знайшов',
+            place="Київ, Солом'янський, Берегівська 5", date='13.05.2021'):
+    return '\n'.join([name, signs, age, type, place, date])
+
+
+def test_ad_template_is_parsed():
+    assert parse_ad(ad_text()) == {
+        'pet-name': 'Джеррі',
+        'signs': ['Сіре вушко', 'білий хвіст'],
+        'age': 3,
+        'type': 'FOUND',
+        'location': {'city': 'Київ', 'district': "Солом'янський", 'street': 'Берегівська 5'},
+        'date': {'day': 13, 'month': 5, 'year': 2021},
+    }
+
+
+@pytest.mark.parametrize('type, expected', [('знайшов', 'FOUND'), (' Загубив ', 'LOST'),
+                                            ('СПОСТЕРІГАЮ', 'OBSERVED')])
+def test_ad_type_ignores_case_and_spaces(type, expected):
+    assert parse_ad(ad_text(type=type))['type'] == expected
+
+
+def test_street_keeps_its_commas():
+    assert parse_ad(ad_text(place='Київ, Поділ, Сагайдачного, 5'))['location']['street'] == 'Сагайдачного, 5'
+
+
+@pytest.mark.parametrize('date, expected', [
+    ('13.05.2021', (13, 5, 2021)),
+    ('1.5.2021', (1, 5, 2021)),
+    (' 13.05.2021 ', (13, 5, 2021)),
+    # accepted by the split-based parser before
+    ('13. 05. 2021', (13, 5, 2021)),
+    ('13 .05 .2021', (13, 5, 2021)),
+    ('13.05.21', (13, 5, 2021)),
+    ('29.02.2020', (29, 2, 2020)),
+])
+def test_dates(date, expected):
+    body = parse_ad(ad_text(date=date))
+    assert (body['date']['day'], body['date']['month'], body['date']['year']) == expected
+
+
+@pytest.mark.parametrize('date', ['31.02.2021', '29.02.2021', '0.05.2021', '13.13.2021', '13.05.202',
+                                  '13/05/2021', '13.05', ''])
+def test_wrong_dates_are_rejected(date):
+    with pytest.raises(ParseError) as e:
+        parse_ad(ad_text(date=date))
+    assert list(e.value.errors) == ['Дата']
+
+
+def test_every_wrong_field_is_reported():
+    with pytest.raises(ParseError) as e:
+        parse_ad(ad_text(name=' ', age='три', type='шукаю', place='Київ'))
+    assert list(e.value.errors) == ["Ім'я тварини", "Приблизний вік", "Тип оголошення", "Місце"]
+    assert 'Приблизний вік: тільки цілі числа' in e.value.describe()
+
+
+def test_missing_lines_are_reported():
+    with pytest.raises(ParseError) as e:
+        parse_ad('Джеррі\nСіре вушко')
+    assert list(e.value.errors) == ["Приблизний вік", "Тип оголошення", "Місце", "Дата"]
+
+
+def test_account_template_is_parsed():
+    text = "Ім'я: Тарас\nфамілія:Шевченко \n\nEmail адреси: t@test.ua, s@test.ua\nНікнейм: kobzar"
+    assert parse_account(text) == {'firstname': 'Тарас', 'lastname': 'Шевченко',
+                                   'email-addresses': 't@test.ua, s@test.ua'}
+
+
+def test_account_lines_without_a_key_are_reported():
+    with pytest.raises(ParseError) as e:
+        parse_account("Ім'я: Тарас\nШевченко")
+    assert e.value.errors == {'Рядок 2': 'ключ: значення'}
+
+
+def test_ad_type_by_ua_name():
+    assert AdType.get_by(' Знайшов') is AdType.FOUND
+    with pytest.raises(Exception):
+        AdType.get_by('шукаю')
@@ -0,0 +1,95 @@
+import pytest
+
+from api.policy import DEFAULT_ENDPOINT_TIMEOUTS, BackendUnavailable, CircuitBreaker, Policy, RetryPolicy, parse_timeouts
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_only_gets_are_retried():
+    retry = RetryPolicy(attempts=3)
+    assert retry.attempts_for('GET') == 3
+    assert retry.attempts_for('POST') == 1
+    assert retry.attempts_for('DELETE') == 1
+
+
+def test_delay_is_jittered_below_the_capped_backoff():
+    retry = RetryPolicy(backoff=0.1, max_backoff=0.5)
+    for attempt in range(8):
+        cap = min(0.5, 0.1 * 2 ** attempt)
+        for _ in range(50):
+            assert 0 <= retry.delay(attempt) <= cap
+
+
+def test_breaker_opens_after_failures_in_a_row(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=clock)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    breaker.check()
+    assert not breaker.is_open
+
+    breaker.failure()
+    assert breaker.is_open
+    with pytest.raises(BackendUnavailable):
+        breaker.check()
+
+
+def test_breaker_lets_one_trial_through_after_the_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.failure()
+    clock.now += 29
+    with pytest.raises(BackendUnavailable):
+        breaker.check()
+
+    clock.now += 1
+    breaker.check()
+    with pytest.raises(BackendUnavailable):
+        breaker.check()
+
+    breaker.success()
+    assert not breaker.is_open
+    breaker.check()
+
+
+def test_failed_trial_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30, clock=clock)
+    for _ in range(5):
+        breaker.failure()
+    clock.now += 30
+    breaker.check()
+    breaker.failure()
+    assert breaker.is_open
+    clock.now += 29
+    with pytest.raises(BackendUnavailable):
+        breaker.check()
+    clock.now += 1
+    breaker.check()
+
+
+def test_timeout_for_falls_back_to_the_default():
+    policy = Policy(timeouts={'GET /v1/users': (1, 2)}, default_timeout=(4, 8))
+    assert policy.timeout_for('GET /v1/users') == (1, 2)
+    assert policy.timeout_for('POST /v1/users/auth') == DEFAULT_ENDPOINT_TIMEOUTS['POST /v1/users/auth']
+    assert policy.timeout_for('PUT /v1/advertisements/{id}') == (4, 8)
+
+
+def test_parse_timeouts():
+    assert parse_timeouts('GET /v1/users=2,5; POST /v1/users/auth = 3,10;') == {
+        'GET /v1/users': (2.0, 5.0),
+        'POST /v1/users/auth': (3.0, 10.0),
+    }
+    assert parse_timeouts('') == {}
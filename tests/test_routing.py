@@ -0,0 +1,60 @@
+from bot.routing import CallbackRouter
+
+
+class Obj(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def callback(data, user_id=1):
+    answers = list()
+    query = Obj(data=data, from_user={'id': user_id}, answers=answers,
+                answer=lambda text=None: answers.append(text))
+    return Obj(callback_query=query)
+
+
+def make_router(users):
+    router = CallbackRouter(users.get, expired_text='expired')
+    calls = list()
+
+    @router.route('a', 'b')
+    def exact(update, context, u):
+        calls.append(('exact', u))
+
+    @router.prefix('filter')
+    def with_param(update, context, u, param):
+        calls.append(('prefix', u, param))
+
+    return router, calls
+
+
+def test_exact_routes_win_over_prefixes():
+    router, calls = make_router({1: 'user'})
+    for data in ('a', 'b', 'filter:days:7', 'filter:'):
+        router(callback(data), None)
+    assert calls == [('exact', 'user'), ('exact', 'user'), ('prefix', 'user', 'days:7'), ('prefix', 'user', '')]
+
+
+def test_query_is_answered_exactly_once():
+    router, calls = make_router({1: 'user'})
+    for data in ('a', 'filter:x', 'unknown', 'filter', None):
+        update = callback(data)
+        router(update, None)
+        assert update.callback_query.answers == [None]
+    assert len(calls) == 2
+
+
+def test_unknown_user_gets_the_expired_text():
+    router, calls = make_router({})
+    update = callback('a', user_id=2)
+    router(update, None)
+    assert calls == []
+    assert update.callback_query.answers == ['expired']
+
+
+def test_resolve():
+    router, _ = make_router({})
+    handler, args = router.resolve('filter:city:Київ')
+    assert handler.__name__ == 'with_param' and args == ('city:Київ',)
+    assert router.resolve('nothing:here') == (None, ())
@@ -0,0 +1,101 @@
+from bot.sessions import MemorySessionStore, SqliteSessionStore
+
+
+class User(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+def dumps(user):
+    return user.value
+
+
+def loads(data):
+    return User(data)
+
+
+def sqlite_store(tmp_path, **kwargs):
+    # the flusher thread is kept idle, tests flush explicitly
+    return SqliteSessionStore(str(tmp_path / 'sessions.db'), dumps, loads, flush_interval=3600,
+                              batch_size=1000, **kwargs)
+
+
+def test_memory_store_keeps_evicted_users_serialized():
+    store = MemorySessionStore(dumps, loads, max_sessions=1)
+    store[1] = User('a')
+    store[2] = User('b')
+
+    assert len(store) == 1
+    assert store[1].value == 'a'
+    assert store.get(3) is None
+
+
+def test_memory_store_without_dumps_forgets_evicted_users():
+    store = MemorySessionStore(max_sessions=1)
+    store[1] = User('a')
+    store[2] = User('b')
+
+    assert store.get(1) is None
+
+
+def test_memory_store_evicts_idle_users():
+    store = MemorySessionStore(dumps, loads, idle_timeout=0)
+    store[1] = User('a')
+
+    assert store.evict_idle() == 1
+    assert len(store) == 0
+    assert store[1].value == 'a'
+
+
+def test_sqlite_store_reads_back_flushed_users(tmp_path):
+    store = sqlite_store(tmp_path)
+    store[1] = User('a')
+    store.close()
+
+    store = sqlite_store(tmp_path)
+    assert store[1].value == 'a'
+    store.close()
+
+
+def test_sqlite_store_writes_changes_made_after_reload_of_evicted_user(tmp_path):
+    store = sqlite_store(tmp_path, max_sessions=1)
+    store[1] = User('old')
+    store[2] = User('other')
+
+    user = store[1]
+    assert user.value == 'old'
+    user.value = 'new'
+    store.touch(1)
+    store.flush()
+    store.close()
+
+    store = sqlite_store(tmp_path)
+    assert store[1].value == 'new'
+    store.close()
+
+
+def test_sqlite_store_writes_evicted_users_not_seen_again(tmp_path):
+    store = sqlite_store(tmp_path, max_sessions=1)
+    store[1] = User('a')
+    store[2] = User('b')
+    store.close()
+
+    store = sqlite_store(tmp_path)
+    assert store[1].value == 'a'
+    assert store[2].value == 'b'
+    store.close()
+
+
+def test_sqlite_store_deletes_users(tmp_path):
+    store = sqlite_store(tmp_path)
+    store[1] = User('a')
+    store.flush()
+    del store[1]
+
+    assert store.get(1) is None
+    store.close()
+
+    store = sqlite_store(tmp_path)
+    assert store.get(1) is None
+    store.close()
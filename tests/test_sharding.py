@@ -0,0 +1,32 @@
+import multiprocessing
+
+from bot.sharding import Supervisor, serve, shard_of
+
+_received = multiprocessing.get_context('fork').Queue()
+
+
+def record(shard, shards, queue):
+    serve(queue, lambda item: _received.put((shard, item)))
+
+
+def received(n):
+    return sorted(_received.get(timeout=5) for _ in range(n))
+
+
+def test_items_go_to_the_shard_of_their_key():
+    assert [shard_of(key, 3) for key in (0, 1, 2, 3, None)] == [0, 1, 2, 0, 0]
+
+
+def test_broadcast_reaches_every_worker_and_the_ones_started_later():
+    supervisor = Supervisor(record, 2, start_method='fork')
+    supervisor.start()
+    try:
+        supervisor.broadcast('index')
+        assert received(2) == [(0, 'index'), (1, 'index')]
+        supervisor.submit(1, 'update')
+        assert received(1) == [(1, 'update')]
+
+        supervisor.scale(3)
+        assert received(3) == [(0, 'index'), (1, 'index'), (2, 'index')]
+    finally:
+        supervisor.stop()
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from api.singleflight import SingleFlight
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'ad'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', fetch)))
+    leader.start()
+    wait_until(lambda: len(calls) == 1)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', fetch))) for _ in range(4)]
+    for t in followers:
+        t.start()
+    wait_until(lambda: flight.shared == 4)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('ad', False)] + [('ad', True)] * 4
+
+
+def test_exceptions_are_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('down')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', fail)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    wait_until(lambda: flight.shared == 1)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_nothing_is_kept_after_the_call():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == (1, False)
+    assert flight.do('key', lambda: 2) == (2, False)
+    with pytest.raises(KeyError):
+        flight.do('key', {}.__getitem__, 'missing')
+    assert flight.do('key', lambda: 3) == (3, False)
+    assert flight.shared == 0
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    t = threading.Thread(target=flight.do, args=('a', slow))
+    t.start()
+    started.wait(5)
+    assert flight.do('b', lambda: 'fast') == ('fast', False)
+    release.set()
+    t.join(5)
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+from api.http import HttpPool
+from api.policy import BackendError, BackendUnavailable, CircuitBreaker, Policy, RetryPolicy
+from api.v1 import PetHomeImpl
+
+
+def ad_body(id, name='Джеррі'):
+    return {'id': id, 'pet-name': name, 'signs': ['сірий'], 'age': 3, 'type': 'FOUND',
+            'location': {'city': 'Київ', 'district': 'Поділ', 'street': 'Сагайдачного'},
+            'date': {'day': 13, 'month': 5, 'year': 2021}}
+
+
+class Response(object):
+
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(body).encode() if body is not None else b''
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Pool(object):
+    """Fake ``HttpPool``: ``down`` raises the exception for every request but auth, ``status``
+    replaces the status of the answers."""
+
+    def __init__(self, ads=()):
+        self.ads = {ad['id']: ad for ad in ads}
+        self.calls = list()
+        self.down = None
+        self.status = None
+
+    def post(self, path, headers=None, **kwargs):
+        return Response(200, {'token': 'token'})
+
+    def request(self, method, path, headers=None, **kwargs):
+        self.calls.append((method, path))
+        if self.down is not None:
+            raise self.down
+        if self.status is not None:
+            return Response(self.status)
+        if path == '/v1/users':
+            return Response(200, {'id': 1, 'firstname': 'Тарас', 'lastname': 'Шевченко'})
+        if path == '/v1/advertisements':
+            return Response(200, {'ids': sorted(self.ads)})
+        if path == '/v1/advertisements/batch':
+            return Response(404)
+        id = int(path.rsplit('/', 1)[1])
+        return Response(200, self.ads[id]) if id in self.ads else Response(404)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    PetHomeImpl.ad_cache.clear()
+    PetHomeImpl.ad_validators.clear()
+    monkeypatch.setattr(PetHomeImpl, 'bulk_supported', None)
+
+
+def api_of(pool):
+    return PetHomeImpl('user', 'secret', 'localhost', 1, pool)
+
+
+def expire(cache):
+    for key, (_, value) in list(cache._data.items()):
+        cache._data[key] = (0, value)
+
+
+def test_expired_ad_is_served_while_the_backend_is_down():
+    pool = Pool([ad_body(1)])
+    api = api_of(pool)
+    assert api.get_advertisement_by(1).pet_name == 'Джеррі'
+    expire(PetHomeImpl.ad_cache)
+
+    pool.down = BackendUnavailable('PetHome backend is unavailable')
+    assert api.get_advertisement_by(1).pet_name == 'Джеррі'
+    assert api.get_advertisements_by([1])[0].id == 1
+    with pytest.raises(BackendUnavailable):
+        api.get_advertisement_by(2)
+
+
+def test_5xx_of_an_ad_is_a_backend_error_not_a_missing_ad():
+    pool = Pool([ad_body(1)])
+    api = api_of(pool)
+    pool.status = 503
+    with pytest.raises(BackendError):
+        api.get_advertisement_by(1)
+    with pytest.raises(BackendError):
+        api.get_advertisement_by(1, cache=False)
+    with pytest.raises(BackendError):
+        api.get_other_advertisements(1)
+    pool.status = 404
+    assert api.get_advertisement_by(1) is None
+
+
+def test_account_is_served_as_last_seen_while_the_backend_is_down(monkeypatch):
+    monkeypatch.setattr(PetHomeImpl, 'account_ttl', 0)
+    pool = Pool()
+    api = api_of(pool)
+    assert api.get_account().firstname == 'Тарас'
+
+    pool.down = BackendUnavailable('PetHome backend is unavailable')
+    assert api.get_account().firstname == 'Тарас'
+    pool.down = None
+    pool.status = 502
+    assert api.get_account().firstname == 'Тарас'
+
+    with pytest.raises(BackendError):
+        api_of(pool).get_account()
+
+
+def test_login_on_a_failing_backend_is_not_a_wrong_password():
+    class Down(Pool):
+        def post(self, path, headers=None, **kwargs):
+            return Response(500)
+
+    with pytest.raises(BackendError):
+        api_of(Down())
+
+
+def test_pool_turns_connection_errors_into_backend_errors():
+    policy = Policy(retry=RetryPolicy(attempts=2, backoff=0), breaker=CircuitBreaker(failure_threshold=2))
+    # nothing listens on the port
+    pool = HttpPool('127.0.0.1', 9, policy=policy)
+    with pytest.raises(BackendError):
+        pool.request('GET', '/v1/users')
+    with pytest.raises(BackendUnavailable):
+        pool.request('GET', '/v1/users')
@@ -0,0 +1,280 @@
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api.auth import AuthExpired
+from api.models import Advertisement, Date, Location
+from api.policy import BackendUnavailable, CircuitBreaker, Policy, RetryPolicy
+from api.v1_async import AsyncHttpPool, AsyncPetHomeImpl, Response
+
+
+def jwt(expires_in: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': time.time() + expires_in}).encode()).decode()
+    return f"header.{payload.rstrip('=')}.signature"
+
+
+def ad_body(id, name='Джеррі'):
+    return {'id': id, 'pet-name': name, 'signs': ['сірий'], 'age': 3, 'type': 'FOUND',
+            'location': {'city': 'Київ', 'district': 'Поділ', 'street': 'Сагайдачного'},
+            'date': {'day': 13, 'month': 5, 'year': 2021}}
+
+
+class Backend(object):
+    """Fake pool with the ads by id, every auth hands out the next token of ``tokens``."""
+
+    def __init__(self, ads=(), tokens=None):
+        self.ads = {ad['id']: ad for ad in ads}
+        self.tokens = list(tokens or [jwt(3600)])
+        self.valid = set()
+        self.calls = list()
+        self.gate = None
+        self.bulk = 200
+
+    async def request(self, method, path, headers=None, data=None):
+        self.calls.append((method, path))
+        if self.gate is not None:
+            await self.gate.wait()
+        body = json.loads(data) if data else None
+        if path == '/v1/users/auth':
+            token = self.tokens.pop(0)
+            self.valid = {token}
+            return respond(200, {'token': token})
+        if (headers or {}).get('Authorization', '')[len('Bearer '):] not in self.valid:
+            return respond(401)
+        if path == '/v1/advertisements':
+            ids = sorted(self.ads)
+            size = body['paged']['size']
+            start = (body['paged']['current'] - 1) * size
+            return respond(200, {'ids': ids[start:start + size]})
+        if path == '/v1/advertisements/batch':
+            if self.bulk != 200:
+                return respond(self.bulk)
+            return respond(200, {'advertisements': [self.ads[id] for id in body['ids'] if id in self.ads]})
+        if path.startswith('/v1/advertisements/'):
+            id = int(path.rsplit('/', 1)[1])
+            if method == 'DELETE':
+                return respond(204 if self.ads.pop(id, None) is not None else 404)
+            return respond(200, self.ads[id]) if id in self.ads else respond(404)
+        return respond(404)
+
+    def count(self, path):
+        return sum(1 for _, p in self.calls if p == path)
+
+
+def respond(status, body=None, headers=None):
+    return Response(status, headers or {}, json.dumps(body).encode() if body is not None else b'')
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    AsyncPetHomeImpl.ad_cache.clear()
+    AsyncPetHomeImpl.ad_validators.clear()
+    AsyncPetHomeImpl.bulk_supported = None
+    yield
+    AsyncPetHomeImpl.bulk_supported = None
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def login(backend):
+    return await AsyncPetHomeImpl.login('user', 'secret', 'localhost', 1, pool=backend)
+
+
+def test_pages_are_fetched_in_bulk_and_cached():
+    backend = Backend([ad_body(i) for i in (3, 1, 2)])
+
+    async def scenario():
+        api = await login(backend)
+        first = await api.get_other_advertisements(1, 2)
+        again = await api.get_other_advertisements(1, 2)
+        return first, again
+
+    first, again = run(scenario())
+    assert [ad.id for ad in first] == [1, 2]
+    assert isinstance(first[0], Advertisement)
+    assert again == first
+    assert backend.count('/v1/advertisements/batch') == 1
+    assert AsyncPetHomeImpl.bulk_supported is True
+
+
+def test_refused_bulk_request_falls_back_to_single_ads():
+    backend = Backend([ad_body(1), ad_body(2)])
+    backend.bulk = 404
+
+    async def scenario():
+        api = await login(backend)
+        return await api.get_other_advertisements(1, 4, cache=False)
+
+    assert [ad.id for ad in run(scenario())] == [1, 2]
+    assert AsyncPetHomeImpl.bulk_supported is False
+    assert backend.count('/v1/advertisements/1') == 1
+    assert len(AsyncPetHomeImpl.ad_cache) == 0
+
+
+def test_refused_token_is_renewed_once():
+    backend = Backend([ad_body(1)], tokens=[jwt(3600), jwt(3600)])
+
+    async def scenario():
+        api = await login(backend)
+        backend.valid = set()
+        return await api.get_advertisement_by(1)
+
+    assert run(scenario()).id == 1
+    assert backend.count('/v1/users/auth') == 2
+
+
+def test_concurrent_refusals_share_one_reauth():
+    backend = Backend([ad_body(i) for i in range(5)], tokens=[jwt(3600), jwt(3600)])
+
+    async def scenario():
+        api = await login(backend)
+        backend.valid = set()
+        return await asyncio.gather(*[api.get_advertisement_by(i, cache=False) for i in range(5)])
+
+    assert [ad.id for ad in run(scenario())] == list(range(5))
+    assert backend.count('/v1/users/auth') == 2
+
+
+def test_restored_session_raises_auth_expired():
+    backend = Backend([ad_body(1)])
+
+    async def scenario():
+        api = AsyncPetHomeImpl(None, None, 'localhost', 1, pool=backend, token='old')
+        await api.get_advertisement_by(1)
+
+    with pytest.raises(AuthExpired):
+        run(scenario())
+    assert backend.count('/v1/users/auth') == 0
+
+
+def test_token_is_refreshed_ahead_of_its_expiry():
+    backend = Backend([ad_body(1)], tokens=[jwt(60), jwt(3600)])
+
+    async def scenario():
+        api = await login(backend)
+        first = api.token
+        await api.get_advertisement_by(1, cache=False)
+        await asyncio.sleep(0)
+        refreshing = api._refresh
+        if refreshing is not None:
+            await refreshing
+        return first, api.token
+
+    first, renewed = run(scenario())
+    assert renewed != first
+    assert backend.count('/v1/users/auth') == 2
+
+
+def test_expired_token_is_renewed_before_the_request():
+    backend = Backend([ad_body(1)], tokens=[jwt(-1), jwt(3600)])
+
+    async def scenario():
+        api = await login(backend)
+        await api.get_advertisement_by(1)
+
+    run(scenario())
+    assert [p for _, p in backend.calls] == ['/v1/users/auth', '/v1/users/auth', '/v1/advertisements/1']
+
+
+def test_identical_gets_in_flight_share_one_request():
+    backend = Backend([ad_body(1)])
+
+    async def scenario():
+        api = await login(backend)
+        backend.gate = asyncio.Event()
+        calls = [asyncio.ensure_future(api.get_advertisement_by(1)) for _ in range(5)]
+        await asyncio.sleep(0)
+        backend.gate.set()
+        return await asyncio.gather(*calls)
+
+    ads = run(scenario())
+    assert all(ad == ads[0] for ad in ads)
+    assert backend.count('/v1/advertisements/1') == 1
+
+
+def test_failed_delete_raises_and_forgets_the_ad():
+    backend = Backend([ad_body(1)])
+
+    async def scenario():
+        api = await login(backend)
+        await api.get_advertisement_by(1)
+        await api.delete_ad(1)
+        assert AsyncPetHomeImpl.ad_cache.get(1) is None
+        await api.delete_ad(1)
+
+    with pytest.raises(Exception, match='Could not delete advertisement'):
+        run(scenario())
+
+
+def test_create_ad_sends_the_model_as_json():
+    sent = list()
+
+    class Pool(Backend):
+        async def request(self, method, path, headers=None, data=None):
+            if path == '/v1/advertisements' and method == 'POST':
+                sent.append((headers['Content-Type'], json.loads(data)))
+                return respond(200, {'id': 7})
+            return await super().request(method, path, headers, data)
+
+    ad = Advertisement(None, 'Джеррі', ('сірий',), 3, 'FOUND', Location('Київ', 'Поділ', ''), Date(13, 5, 2021))
+
+    async def scenario():
+        api = await login(Pool())
+        return await api.create_ad(ad)
+
+    assert run(scenario()) == 7
+    assert sent == [('application/json', ad.to_dict())]
+
+
+def serve(handler, scenario):
+    """Run ``scenario(pool)`` against a local aiohttp server answering with ``handler``."""
+    async def main():
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', handler)
+        server = TestServer(app)
+        await server.start_server()
+        policy = Policy(retry=RetryPolicy(attempts=3, backoff=0),
+                        breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+        pool = AsyncHttpPool(server.host, server.port, policy=policy)
+        try:
+            return await scenario(pool)
+        finally:
+            await pool.close()
+            await server.close()
+    return run(main())
+
+
+def test_pool_retries_idempotent_gets_only():
+    statuses = {'GET': [503, 200], 'POST': [503, 200]}
+
+    async def handler(request):
+        return web.Response(status=statuses[request.method].pop(0))
+
+    async def scenario(pool):
+        return (await pool.request('GET', '/v1/users')).status_code, \
+               (await pool.request('POST', '/v1/users')).status_code
+
+    assert serve(handler, scenario) == (200, 503)
+
+
+def test_pool_breaker_opens_after_failures_in_a_row():
+    hits = list()
+
+    async def handler(request):
+        hits.append(request.path)
+        return web.Response(status=503)
+
+    async def scenario(pool):
+        assert (await pool.request('GET', '/v1/users')).status_code == 503
+        with pytest.raises(BackendUnavailable):
+            await pool.request('GET', '/v1/users')
+
+    serve(handler, scenario)
+    assert len(hits) == 3